@@ -11,11 +11,14 @@ from qiskit import transpile
 import numpy as np
 import argparse
 from utils import distanceVecFromSubspace, get_exp_cross, get_exp_X, get_exp_ZZ
+from utils import load_ledger, update_ledger, is_job_failed, save_atomic, dump_atomic
 import pickle
 import matplotlib.pyplot as plt
 import os
 
 HR_dist_hist = []
+#checkpoint ledger of the sweep: (param_idx, basis) -> latest ledger entry
+ledger = {}
 
 def get_args(parser):
     parser.add_argument('--input_dir', type = str, help = "directory where VQE_hyperparam_dict.npy exists and HR distances and plots will be stored")
@@ -67,21 +70,43 @@ def Q_Circuit(N_qubits, var_params, h_l, n_layers):
     return circ
 
 def get_measurement(n_qbts, var_params, backend, h_l, hyperparam_dict, param_idx):
-    measurement_path = os.path.join(args.input_dir, "measurement", f"{param_idx}th_param_{''.join([str(e) for e in h_l])}qbt_h_gate.npy")
+    basis = ''.join([str(e) for e in h_l])
+    measurement_path = os.path.join(args.input_dir, "measurement", f"{param_idx}th_param_{basis}qbt_h_gate.npy")
+    ledger_path = os.path.join(args.input_dir, "measurement", "ledger.jsonl")
+    entry = ledger.get((int(param_idx), basis))
     if os.path.exists(measurement_path):
         #no need to save as it is already saved
         measurement = np.load(measurement_path, allow_pickle = "True").item()
+        if entry is None or entry["status"] != "done":
+            update_ledger(ledger_path, ledger, param_idx, basis, "done", path = measurement_path)
+        return measurement
+    if entry is not None and entry["status"] == "submitted":
+        #job is already submitted (and paid for), so retrieve it instead of resubmitting
+        try:
+            job = backend.retrieve_job(entry["job_id"])
+        except Exception as err:
+            #the job stays "submitted" with the error, so the next run retries the retrieve
+            update_ledger(ledger_path, ledger, param_idx, basis, "submitted", job_id = entry["job_id"], error = str(err))
+            raise
     else:
         circ = Q_Circuit(n_qbts, var_params, h_l, hyperparam_dict["n_layers"])
         circ.measure(list(range(n_qbts)), list(range(n_qbts)))
         circ = transpile(circ, backend)
         job = backend.run(circ, shots = hyperparam_dict["shots"])
         if hyperparam_dict["backend"] != "aer_simulator":
-            job_id = job.id()
+            entry = update_ledger(ledger_path, ledger, param_idx, basis, "submitted", job_id = job.id())
+    try:
+        if hyperparam_dict["backend"] != "aer_simulator":
             job_monitor(job)
         result = job.result()
-        measurement = dict(result.get_counts())
-        np.save(measurement_path, measurement)
+    except Exception as err:
+        #a submitted (paid) job stays "submitted" after a polling or network error, so the next run retrieves it again
+        if entry is None or entry["status"] != "submitted" or is_job_failed(job):
+            update_ledger(ledger_path, ledger, param_idx, basis, "failed", job_id = None if entry is None else entry.get("job_id"), error = str(err))
+        raise
+    measurement = dict(result.get_counts())
+    save_atomic(measurement_path, measurement)
+    update_ledger(ledger_path, ledger, param_idx, basis, "done", path = measurement_path)
     return measurement
 
 def get_params(params_dir_path, param_idx):
@@ -178,13 +203,21 @@ def main(args):
     else:
         param_idx_l = list(range(len(E_hist)))
 
+    #restart the sweep exactly where it stopped
+    ledger_path = os.path.join(args.input_dir, "measurement", "ledger.jsonl")
+    ledger.update(load_ledger(ledger_path))
+
     #get every nth HR distance
     for param_idx in param_idx_l:
+        entry = ledger.get((int(param_idx), "HR"))
+        if entry is not None and entry["status"] == "done":
+            print(f"HR distance for {param_idx}th param already in ledger: ", entry["HR_dist"])
+            continue
         HR_dist = get_HR_distance(hyperparam_dict, param_idx, params_dir_path, backend)
         print("This is HR distance: ", HR_dist)
-        HR_dist_hist.append(HR_dist)
-        with open(os.path.join(args.input_dir, "HR_dist_hist.pkl"), "wb") as fp:
-            pickle.dump(HR_dist_hist, fp)
+        update_ledger(ledger_path, ledger, param_idx, "HR", "done", HR_dist = HR_dist)
+    HR_dist_hist = [ledger[(int(param_idx), "HR")]["HR_dist"] for param_idx in param_idx_l]
+    dump_atomic(os.path.join(args.input_dir, "HR_dist_hist.pkl"), HR_dist_hist)
 
     fig, ax = plt.subplots()
     VQE_steps = np.array(list(range(len(E_hist))))
@@ -1,5 +1,8 @@
 import numpy as np
 from functools import reduce
+import os
+import json
+import pickle
 
 def get_exp_cross(cross_m, indices):
     tot_val, tot_count = 0, 0
@@ -89,3 +92,85 @@ def distanceVecFromSubspace(w, A):
     for i in range(len(Q[0])):
         r += np.dot(w, Q[:,i])*Q[:,i]
     return np.linalg.norm(r-w)
+
+def load_ledger(ledger_path):
+    """
+    Replay the checkpoint ledger of a sweep.
+    The ledger is an append-only file with one JSON entry per line, each entry recording
+    the status ("submitted", "done" or "failed") of a (param_idx, basis) pair.
+
+    Args:
+        ledger_path (str): path to the ledger file
+
+    Return:
+        ledger (dict): latest entry of every (param_idx, basis) pair
+    """
+    ledger = {}
+    if not os.path.isfile(ledger_path):
+        return ledger
+    with open(ledger_path, "r+") as fp:
+        content = fp.read()
+        #drop a partially written last line, left over if the sweep was killed mid-write
+        if not content.endswith("\n"):
+            content = content[:content.rfind("\n") + 1]
+            fp.seek(0)
+            fp.truncate()
+            fp.write(content)
+    for line in content.splitlines():
+        entry = json.loads(line)
+        ledger[(entry["param_idx"], entry["basis"])] = entry
+    return ledger
+
+def update_ledger(ledger_path, ledger, param_idx, basis, status, **fields):
+    """
+    Append an entry to the ledger. Costs O(1) per call regardless of the sweep length.
+
+    Args:
+        ledger_path (str): path to the ledger file
+        ledger (dict): ledger loaded by load_ledger, updated in place
+        param_idx (int): parameter index
+        basis (str): measurement basis ("HR" for the HR distance of param_idx)
+        status (str): "submitted", "done" or "failed"
+        fields: extra fields to record (e.g. job_id, path, HR_dist)
+    """
+    entry = {"param_idx": int(param_idx), "basis": basis, "status": status}
+    entry.update(fields)
+    with open(ledger_path, "a") as fp:
+        fp.write(json.dumps(entry) + "\n")
+        fp.flush()
+        os.fsync(fp.fileno())
+    ledger[(entry["param_idx"], basis)] = entry
+    return entry
+
+def is_job_failed(job):
+    """
+    True if job reports a terminal ERROR or CANCELLED status. A job whose status can't be read (e.g. a
+    network error) may still finish, so it is not failed and its ledger entry stays "submitted".
+    """
+    try:
+        status = job.status()
+    except Exception:
+        return False
+    return getattr(status, "name", str(status)) in ("ERROR", "CANCELLED")
+
+def save_atomic(path, obj):
+    """
+    np.save obj to path through a temporary file, so that path never holds a partial result
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as fp:
+        np.save(fp, obj, allow_pickle = True)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, path)
+
+def dump_atomic(path, obj):
+    """
+    pickle.dump obj to path through a temporary file, so that path never holds a partial result
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as fp:
+        pickle.dump(obj, fp)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, path)
@@ -1,6 +1,10 @@
 import numpy as np
+from scipy.sparse.linalg import eigsh
 import os
+import sys
 import argparse
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from model_spec import get_sparse_X_plus_diag
 
 def get_args(parser):
     parser.add_argument('--max_n_qbts', type = int, default = 11, help = "maximum number of qubits to find the ground state energy of")
@@ -9,64 +13,26 @@ def get_args(parser):
     args = parser.parse_args()
     return args
 
-def get_Hx(N_qubits):
-    sig_x = np.array([[0., 1.], [1., 0.]])
-    Hx = 0
-    for i in range(N_qubits):
-        temp = [np.eye(2)]*N_qubits
-        temp[i] = sig_x
-        tempSum = temp[0]
-        for j in range(1, N_qubits):
-            tempSum = np.kron(temp[j], tempSum)
-        Hx += tempSum
-    return Hx
-
-def get_Hamiltonian_no_periodic(N_qubits, J):
-    """ get Hamiltonian for 1-D TFIM
+def get_sparse_Hamiltonian(N_qubits, J, periodic):
+    """ get Hamiltonian for 1-D TFIM as a scipy CSR matrix, built from bit operations on all 2^N
+    basis states at once instead of kron products
 
     Args:
         N_qubits(int): number of spins in 1-D TFIM
         J: coupling strength between nearest neighbor
+        periodic(bool): periodic boundary condition
 
     Return:
         Hamiltonian that corresponds to 1-D TFIM.
     """
-
-    sig_z = np.array([[1., 0.], [0., -1.]])
-    Hx = get_Hx(N_qubits)
-    Hz = 0
-    for i in range(N_qubits - 1):
-        temp = [np.eye(2)]*N_qubits
-        temp[i] = sig_z
-        temp[i+1] = sig_z
-        tempSum = temp[0]
-        for j in range(1, N_qubits):
-            tempSum = np.kron(temp[j], tempSum)
-        Hz += tempSum
-    return Hx + J*Hz
-
-def get_Hamiltonian_periodic(N_qubits, J):
-    """ get Hamiltonian for 1-D TFIM
-
-    Args:
-        N_qubits(int): number of spins in 1-D TFIM
-        J: coupling strength between nearest neighbor
-
-    Return:
-        Hamiltonian that corresponds to 1-D TFIM.
-    """
-    sig_z = np.array([[1., 0.], [0., -1.]])
-    Hx = get_Hx(N_qubits)
-    Hz = 0
-    for i in range(N_qubits):
-        temp = [np.eye(2)]*N_qubits
-        temp[i] = sig_z
-        temp[(i+1)%N_qubits] = sig_z
-        tempSum = temp[0]
-        for j in range(1, N_qubits):
-            tempSum = np.kron(temp[j], tempSum)
-        Hz += tempSum
-    return Hx + J*Hz
+    basis = np.arange(2**N_qubits, dtype = np.int32)
+    bit_l = [((basis >> i) & 1).astype(np.int8) for i in range(N_qubits)]
+    n_bonds = N_qubits if periodic else N_qubits - 1
+    #number of anti-aligned bonds of every basis state
+    n_anti = np.zeros(2**N_qubits, dtype = np.int16)
+    for i in range(n_bonds):
+        n_anti += bit_l[i] ^ bit_l[(i+1)%N_qubits]
+    return get_sparse_X_plus_diag(N_qubits, J * (n_bonds - 2*n_anti))
 
 def main(args):
     gst_E_dict = {}
@@ -76,13 +42,9 @@ def main(args):
     J = float(J)
     for i in range(4, max_n_qbts):
         n_qbts = i+1
-        if periodic:
-            Ham = get_Hamiltonian_periodic(n_qbts, J)
-        else:
-            Ham = get_Hamiltonian_no_periodic(n_qbts, J)
-        eig_vals, _ = np.linalg.eig(Ham)
-        ground_energy = np.amin(eig_vals)
-        gst_E_dict[n_qbts] = ground_energy.real
+        Ham = get_sparse_Hamiltonian(n_qbts, J, periodic)
+        eig_vals = eigsh(Ham, k = 1, which = "SA", return_eigenvectors = False)
+        gst_E_dict[n_qbts] = eig_vals[0]
         if periodic:
             np.save(f"gst_E_dict_J_{str(J)}_periodic.npy", gst_E_dict)
         else:
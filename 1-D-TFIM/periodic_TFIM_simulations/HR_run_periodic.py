@@ -1,20 +1,23 @@
 import sys
-import qiskit
-from qiskit import QuantumCircuit, Aer
-from qiskit_aer.noise import NoiseModel, depolarizing_error
-from qiskit_aer import AerSimulator
-from qiskit.visualization import plot_histogram
-from qiskit.tools.monitor import job_monitor
-from azure.quantum.qiskit import AzureQuantumProvider
-from qiskit import transpile
 import numpy as np
 import argparse
-from utils_periodic import distanceVecFromSubspace, get_exp_cross, get_exp_X, get_exp_ZZ
+from utils_periodic import get_HR_dist_from_counts
+from utils_periodic import load_ledger, update_ledger, is_job_failed, save_atomic, dump_atomic
+from utils_periodic import get_basis_probs, sample_counts, subsample_counts
+import timing
+import sampling_profiler
 import pickle
-import matplotlib.pyplot as plt
 import os
 
 HR_dist_hist = []
+#checkpoint ledger of the sweep: (param_idx, basis) -> latest ledger entry
+ledger = {}
+#exact output distributions for --exact_sampling: (param_idx, basis) -> probabilities, kept for the latest param_idx only
+probs_cache = {}
+#backends by (backend name, p1, p2), built on the first circuit run
+backend_cache = {}
+statevector_cache = {}
+rng = np.random.default_rng()
 
 def get_args(parser):
     parser.add_argument('--input_dir', type = str, help = "directory where VQE_hyperparam_dict.npy exists and HR distances and plots will be stored")
@@ -25,10 +28,49 @@ def get_args(parser):
                                 to load the parameter index list to measure corresponding HR distances")
     parser.add_argument('--p1', type = float, default = 0.0, help = "one-qubit gate depolarization noise (default: 0.0)")
     parser.add_argument('--p2', type = float, default = 0.0, help = "two-qubit gate depolarization noise (default: 0.0)")
+    parser.add_argument('--exact_sampling', action = 'store_true', help = "draw the shots from the exact output distribution of the statevector \
+                                instead of rerunning every basis circuit. Only compatible with noiseless aer_simulator backend")
+    parser.add_argument('--seed', type = int, default = None, help = "seed of the shot sampling with --exact_sampling or --subsample_from (default: None)")
+    parser.add_argument('--subsample_from', type = int, default = None, help = "draw the shots without replacement from the stored measurements with SUBSAMPLE_FROM shots \
+                                (run once if they are not stored yet) instead of running the circuits with --shots, e.g. for shot convergence studies")
+    parser.add_argument('--n_replicates', type = int, default = None, help = "with --subsample_from, draw N_REPLICATES independent subsamples of every basis in one call \
+                                and record one HR distance per replicate (default: None, a single subsample)")
+    parser.add_argument('--reuse_VQE_counts', action = 'store_true', help = "read the Z and X basis counts from input_dir/measurement/VQE (VQE --save_counts) \
+                                and only run the Hadamard basis circuits. Only compatible with aer_simulator backend and the VQE p1 and p2")
+    parser.add_argument('--timing', action = 'store_true', help = "time the stages of every HR point and write HR_{shots}shots_{backend}_timing.json/csv to input_dir")
+    parser.add_argument('--profile', action = 'store_true', help = "sample the call stacks and write HR_{shots}shots_{backend}_profile.collapsed (flamegraph/speedscope) to input_dir, also on with SAMPLING_PROFILE=1")
     args = parser.parse_args()
     return args
 
+def get_backend(backend_name, p1, p2):
+    """
+    qiskit, qiskit_aer and the Azure SDK are only imported here and in the circuit functions, so runs
+    that only read stored measurements (and plots) start without them
+    """
+    key = (backend_name, p1, p2)
+    if key not in backend_cache:
+        if backend_name == "aer_simulator":
+            if p1 == 0 and p2 == 0:
+                from qiskit import Aer
+                backend_cache[key] = Aer.get_backend(backend_name)
+            else:
+                from qiskit_aer import AerSimulator
+                from qiskit_aer.noise import NoiseModel, depolarizing_error
+                noise_model = NoiseModel()
+                p1_error = depolarizing_error(p1, 1)
+                p2_error = depolarizing_error(p2, 2)
+                noise_model.add_all_qubit_quantum_error(p1_error, ['h','ry'])
+                noise_model.add_all_qubit_quantum_error(p2_error, ['cx'])
+                backend_cache[key] = AerSimulator(noise_model = noise_model)
+        else:
+            from azure.quantum.qiskit import AzureQuantumProvider
+            provider = AzureQuantumProvider(resource_id = "/subscriptions/58687a6b-a9bd-4f79-b7af-1f8f76760d4b/resourceGroups/AzureQuantum/providers/Microsoft.Quantum/Workspaces/HamiltonianReconstruction",\
+                                            location = "West US")
+            backend_cache[key] = provider.get_backend(backend_name)
+    return backend_cache[key]
+
 def Q_Circuit(N_qubits, var_params, h_l, n_layers):
+    from qiskit import QuantumCircuit
     circ = QuantumCircuit(N_qubits, N_qubits)
     param_idx = 0
     for i in range(N_qubits):
@@ -44,22 +86,108 @@ def Q_Circuit(N_qubits, var_params, h_l, n_layers):
         circ.h(h_idx)
     return circ
 
+def get_exact_measurement(n_qbts, var_params, backend, h_l, hyperparam_dict, param_idx):
+    """
+    Measurement in the same counts format as get_measurement, with the shots drawn from the exact
+    output distribution. The statevector is simulated once per param_idx and the distribution is
+    computed once per (param_idx, basis), so redrawing any number of shots costs one multinomial draw.
+    """
+    basis = ''.join([str(e) for e in h_l])
+    if statevector_cache.get("param_idx") != param_idx:
+        probs_cache.clear()
+        if backend is None:
+            backend = get_backend(hyperparam_dict["backend"], hyperparam_dict["p1"], hyperparam_dict["p2"])
+        with timing.stage("statevector"):
+            circ = Q_Circuit(n_qbts, var_params, [], hyperparam_dict["n_layers"])
+            circ.save_statevector()
+            result = backend.run(circ).result()
+            statevector_cache["param_idx"] = param_idx
+            statevector_cache["statevector"] = np.array(result.get_statevector(circ))
+    with timing.stage("sampling"):
+        if (param_idx, basis) not in probs_cache:
+            probs_cache[(param_idx, basis)] = get_basis_probs(statevector_cache["statevector"], h_l, n_qbts)
+        return sample_counts(probs_cache[(param_idx, basis)], hyperparam_dict["shots"], rng)
+
+def get_VQE_counts_path(n_qbts, h_l, param_idx):
+    """
+    Path of the Z or X basis counts of the VQE energy evaluation of param_idx if --reuse_VQE_counts reuses them, else None
+    """
+    if not args.reuse_VQE_counts or len(h_l) not in (0, n_qbts):
+        return None
+    basis = ''.join([str(e) for e in h_l])
+    VQE_path = os.path.join(args.input_dir, "measurement", "VQE", f"{param_idx}th_param_{basis}qbt_h_gate.npy")
+    return VQE_path if os.path.exists(VQE_path) else None
+
 def get_measurement(n_qbts, var_params, backend, h_l, hyperparam_dict, param_idx):
-    measurement_path = os.path.join(args.input_dir, "measurement", f"{param_idx}th_param_{''.join([str(e) for e in h_l])}qbt_h_gate.npy")
+    if hyperparam_dict["exact_sampling"]:
+        return get_exact_measurement(n_qbts, var_params, backend, h_l, hyperparam_dict, param_idx)
+    if hyperparam_dict["subsample_from"] is not None:
+        #shots drawn without replacement from the measurement with subsample_from shots, which is run once and stored
+        measurement = get_measurement(n_qbts, var_params, backend, h_l, {**hyperparam_dict, "shots": hyperparam_dict["subsample_from"], "subsample_from": None}, param_idx)
+        #the measurement store is not keyed by shots, so a stored measurement with another number of shots is refused
+        #(reused VQE counts carry the VQE shots)
+        if get_VQE_counts_path(n_qbts, h_l, param_idx) is None and sum(measurement.values()) != hyperparam_dict["subsample_from"]:
+            raise ValueError(f"stored measurement of {param_idx}th param has {sum(measurement.values())} shots, not subsample_from = {hyperparam_dict['subsample_from']}")
+        with timing.stage("subsample"):
+            measurement = subsample_counts(measurement, hyperparam_dict["shots"], rng, hyperparam_dict["n_replicates"])
+        timing.count("subsampled_counts")
+        return measurement
+    basis = ''.join([str(e) for e in h_l])
+    VQE_path = get_VQE_counts_path(n_qbts, h_l, param_idx)
+    if VQE_path is not None:
+        #Z and X basis counts of the VQE energy evaluation of this param_idx (VQE shots)
+        with timing.stage("load"):
+            measurement = np.load(VQE_path, allow_pickle = True).item()
+        timing.count("reused_VQE_counts")
+        return measurement
+    measurement_path = os.path.join(args.input_dir, "measurement", f"{param_idx}th_param_{basis}qbt_h_gate.npy")
+    ledger_path = os.path.join(args.input_dir, "measurement", "ledger.jsonl")
+    entry = ledger.get((int(param_idx), basis))
     if os.path.exists(measurement_path):
         #no need to save as it is already saved
-        measurement = np.load(measurement_path, allow_pickle = "True").item()
+        with timing.stage("load"):
+            measurement = np.load(measurement_path, allow_pickle = "True").item()
+        if entry is None or entry["status"] != "done":
+            update_ledger(ledger_path, ledger, param_idx, basis, "done", path = measurement_path)
+        return measurement
+    if backend is None:
+        backend = get_backend(hyperparam_dict["backend"], hyperparam_dict["p1"], hyperparam_dict["p2"])
+    if entry is not None and entry["status"] == "submitted":
+        #job is already submitted (and paid for), so retrieve it instead of resubmitting
+        try:
+            job = backend.retrieve_job(entry["job_id"])
+        except Exception as err:
+            #the job stays "submitted" with the error, so the next run retries the retrieve
+            update_ledger(ledger_path, ledger, param_idx, basis, "submitted", job_id = entry["job_id"], error = str(err))
+            raise
     else:
-        circ = Q_Circuit(n_qbts, var_params, h_l, hyperparam_dict["n_layers"])
-        circ.measure(list(range(n_qbts)), list(range(n_qbts)))
-        circ = transpile(circ, backend)
-        job = backend.run(circ, shots = hyperparam_dict["shots"])
+        with timing.stage("circuit"):
+            circ = Q_Circuit(n_qbts, var_params, h_l, hyperparam_dict["n_layers"])
+            circ.measure(list(range(n_qbts)), list(range(n_qbts)))
+        with timing.stage("transpile"):
+            from qiskit import transpile
+            circ = transpile(circ, backend)
+        with timing.stage("backend.run"):
+            job = backend.run(circ, shots = hyperparam_dict["shots"])
+        timing.count("circuits")
         if hyperparam_dict["backend"] != "aer_simulator":
-            job_id = job.id()
-            job_monitor(job)
-        result = job.result()
+            entry = update_ledger(ledger_path, ledger, param_idx, basis, "submitted", job_id = job.id())
+    try:
+        with timing.stage("backend.run"):
+            if hyperparam_dict["backend"] != "aer_simulator":
+                from qiskit.tools.monitor import job_monitor
+                job_monitor(job)
+            result = job.result()
+    except Exception as err:
+        #a submitted (paid) job stays "submitted" after a polling or network error, so the next run retrieves it again
+        if entry is None or entry["status"] != "submitted" or is_job_failed(job):
+            update_ledger(ledger_path, ledger, param_idx, basis, "failed", job_id = None if entry is None else entry.get("job_id"), error = str(err))
+        raise
+    with timing.stage("counts"):
         measurement = dict(result.get_counts())
-        np.save(measurement_path, measurement)
+    with timing.stage("save"):
+        save_atomic(measurement_path, measurement)
+        update_ledger(ledger_path, ledger, param_idx, basis, "done", path = measurement_path)
     return measurement
 
 def get_params(params_dir_path, param_idx):
@@ -67,37 +195,22 @@ def get_params(params_dir_path, param_idx):
     return var_params
 
 def get_HR_distance(hyperparam_dict, param_idx, params_dir_path, backend):
-    cov_mat = np.zeros((2,2))
     n_qbts = hyperparam_dict["n_qbts"]
-    #need to delete the below as well
     z_l, x_l = [], [i for i in range(n_qbts)]
     var_params = get_params(params_dir_path, param_idx)
     z_m = get_measurement(n_qbts, var_params, backend, z_l, hyperparam_dict, param_idx)
     x_m = get_measurement(n_qbts, var_params, backend, x_l, hyperparam_dict, param_idx)
-    exp_X, exp_ZZ = get_exp_X(x_m, 1),  get_exp_ZZ(z_m, 1)
-    cov_mat[0, 0] =  get_exp_X(x_m, 2) - exp_X**2
-    cov_mat[1, 1] = get_exp_ZZ(z_m, 2) - exp_ZZ**2
-    cross_val = 0
-    z_indices = [[i%n_qbts, (i+1)%n_qbts] for i in range(n_qbts)]
-    for h_idx in range(n_qbts):
-        h_l = [h_idx]
-        cross_m = get_measurement(n_qbts, var_params, backend, h_l, hyperparam_dict, param_idx)
-        for z_ind in z_indices:
-            if h_idx not in z_ind:
-                indices = h_l + z_ind
-                cross_val += get_exp_cross(cross_m, indices)
-    cov_mat[0,1] = cross_val - exp_X*exp_ZZ
-    cov_mat[1,0] = cov_mat[0,1]
-    val, vec = np.linalg.eigh(cov_mat)
-    argsort = np.argsort(val)
-    val, vec = val[argsort], vec[:, argsort]
-    orig_H = np.array([1, hyperparam_dict["J"]])
-    orig_H = orig_H/np.linalg.norm(orig_H)
-    HR_dist = distanceVecFromSubspace(orig_H, vec[:, :1])
+    cross_m_l = [get_measurement(n_qbts, var_params, backend, [h_idx], hyperparam_dict, param_idx) for h_idx in range(n_qbts)]
+    with timing.stage("estimators"):
+        if hyperparam_dict["n_replicates"] is not None:
+            #every basis holds n_replicates subsamples, one HR distance per replicate
+            return [float(get_HR_dist_from_counts(z_m[r], x_m[r], [cross_m[r] for cross_m in cross_m_l], hyperparam_dict["J"]))
+                    for r in range(hyperparam_dict["n_replicates"])]
+        HR_dist = get_HR_dist_from_counts(z_m, x_m, cross_m_l, hyperparam_dict["J"])
     return HR_dist
 
 def main(args):
-    global HR_dist_hist
+    global HR_dist_hist, rng
     if not os.path.exists(os.path.join(args.input_dir,"VQE_hyperparam_dict.npy")):
         raise ValueError( "input directory must be a valid input path that contains VQE_hyperparam_dict.npy")
     if not os.path.isdir(os.path.join(args.input_dir, "measurement")):
@@ -117,23 +230,31 @@ def main(args):
     if backend_name == "aer_simulator":
         if args.use_VQE_p1_p2:
             p1, p2 = hyperparam_dict_loaded["p1"], hyperparam_dict_loaded["p2"]
-        if p1 == 0 and p2 == 0:
-            backend = Aer.get_backend(backend_name)
-        else:
-            noise_model = NoiseModel()
-            p1_error = depolarizing_error(p1, 1)
-            p2_error = depolarizing_error(p2, 2)
-            noise_model.add_all_qubit_quantum_error(p1_error, ['h','ry'])
-            noise_model.add_all_qubit_quantum_error(p2_error, ['cx'])
-            backend = AerSimulator(noise_model = noise_model)
     else:
         assert (not args.use_VQE_p1_p2), "Can't simulate p1 and p2 value when submitting jobs to IONQ simulator/hardware"
         assert (p1 == 0 and p2 == 0), "p1 and p2 values shouldn't be set when submitting job to IONQ simulator/hardware"
-        provider = AzureQuantumProvider(resource_id = "/subscriptions/58687a6b-a9bd-4f79-b7af-1f8f76760d4b/resourceGroups/AzureQuantum/providers/Microsoft.Quantum/Workspaces/HamiltonianReconstruction",\
-                                        location = "West US")
-        backend = provider.get_backend(backend_name)
+    #built by get_backend when a measurement is not stored yet
+    backend = None
     hyperparam_dict["p1"], hyperparam_dict["p2"] = p1, p2
+    if args.exact_sampling:
+        assert backend_name == "aer_simulator" and p1 == 0 and p2 == 0, "exact sampling is only compatible with noiseless aer_simulator backend"
+    if args.reuse_VQE_counts:
+        assert not args.exact_sampling, "VQE counts can't be reused with exact sampling"
+        assert backend_name == "aer_simulator" and (p1, p2) == (hyperparam_dict_loaded["p1"], hyperparam_dict_loaded["p2"]), \
+            "VQE counts can only be reused on aer_simulator with the VQE p1 and p2 values"
+    hyperparam_dict["exact_sampling"] = args.exact_sampling
+    hyperparam_dict["reuse_VQE_counts"] = args.reuse_VQE_counts
+    if args.subsample_from is not None:
+        assert not args.exact_sampling, "exact sampling draws new shots, there is nothing to subsample"
+        assert args.subsample_from >= args.shots, "subsample_from must be at least the number of shots"
+    hyperparam_dict["subsample_from"] = args.subsample_from
+    assert args.n_replicates is None or args.subsample_from is not None, "n_replicates needs subsample_from"
+    hyperparam_dict["n_replicates"] = args.n_replicates
+    rng = np.random.default_rng(args.seed)
     np.save(os.path.join(args.input_dir, "HR_hyperparam_dict.npy"), hyperparam_dict)
+    if args.timing:
+        timing.enable(args.input_dir, f"HR_{args.shots}shots_{backend_name}")
+    sampling_profiler.start(args.input_dir, f"HR_{args.shots}shots_{backend_name}", sampling_profiler.DEFAULT_INTERVAL if args.profile else None)
 
     print("This is hyperparameter dictionary newly constructed: ", hyperparam_dict)
     #number of shots
@@ -156,14 +277,38 @@ def main(args):
     else:
         param_idx_l = list(range(len(E_hist)))
 
+    #restart the sweep exactly where it stopped
+    ledger_path = os.path.join(args.input_dir, "measurement", "ledger.jsonl")
+    ledger.update(load_ledger(ledger_path))
+    #the ledger and the measurements are not keyed by shots, so the HR distances of exact sampling (no stored
+    #measurements), of subsampled counts and of reused VQE counts (Z and X bases at the VQE shots) are kept
+    #apart from the ones of plain runs
+    HR_nm = ""
+    if args.exact_sampling:
+        HR_nm += f"_{shots}shots_exact_seed{args.seed}"
+    if args.subsample_from is not None:
+        HR_nm += f"_{shots}_of_{args.subsample_from}shots_seed{args.seed}"
+        if args.n_replicates is not None:
+            HR_nm += f"_{args.n_replicates}reps"
+    if args.reuse_VQE_counts:
+        HR_nm += "_reuseVQE"
+    HR_key, HR_dist_hist_filename = "HR" + HR_nm, f"HR_dist_hist{HR_nm}.pkl"
+
     #get every nth HR distance
     for param_idx in param_idx_l:
-        HR_dist = get_HR_distance(hyperparam_dict, param_idx, params_dir_path, backend)
+        entry = ledger.get((int(param_idx), HR_key))
+        if entry is not None and entry["status"] == "done":
+            print(f"HR distance for {param_idx}th param already in ledger: ", entry["HR_dist"])
+            continue
+        with timing.stage("get_HR_distance"):
+            HR_dist = get_HR_distance(hyperparam_dict, param_idx, params_dir_path, backend)
+        timing.count("HR_points")
         print("This is HR distance: ", HR_dist)
-        HR_dist_hist.append(HR_dist)
-        with open(os.path.join(args.input_dir, "HR_dist_hist.pkl"), "wb") as fp:
-            pickle.dump(HR_dist_hist, fp)
+        update_ledger(ledger_path, ledger, param_idx, HR_key, "done", HR_dist = HR_dist)
+    HR_dist_hist = [ledger[(int(param_idx), HR_key)]["HR_dist"] for param_idx in param_idx_l]
+    dump_atomic(os.path.join(args.input_dir, HR_dist_hist_filename), HR_dist_hist)
 
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots()
     VQE_steps = np.array(list(range(len(E_hist))))
     ax.scatter(VQE_steps, E_hist, c = 'b', alpha = 0.8, marker = ".", label = "Energy")
@@ -178,7 +323,8 @@ def main(args):
             str(round(gst_E, 3)) + '\n' + 'Estimated Ground Energy: '+ str(round(float(min(E_hist)), 3))  + '\n' "Backend name: " + backend_name
     plt.title(title, fontdict = {'fontsize' : 15})
     ax2 = ax.twinx()
-    ax2.scatter(param_idx_l, HR_dist_hist, c = 'r', alpha = 0.8, marker=".", label = "HR distance")
+    #mean over the replicates of --n_replicates
+    ax2.scatter(param_idx_l, [np.mean(HR_dist) for HR_dist in HR_dist_hist], c = 'r', alpha = 0.8, marker=".", label = "HR distance")
     ax2.set_ylabel("HR distance")
     ax2.legend(bbox_to_anchor=(1.28, 1.22), fontsize = 10)
     plt.savefig(args.input_dir+'/'+  str(n_qbts)+"qubits_"+ str(n_layers)+f"layers_shots_{shots}_HR_dist.png", dpi = 300, bbox_inches='tight')
@@ -0,0 +1,103 @@
+"""
+Multi-start VQE: runs K independent VQE_run_periodic.py optimizations on a process pool.
+Run k uses numpy seed (seed + k) and writes its E_hist.pkl, params_dir, plot, VQE_hyperparam_dict.npy
+and stdout (log.txt) to output_dir/run_{k}, so each run can be passed to HR_run_periodic.py as usual.
+Workers keep VQE_run_periodic imported, so transpiled circuit templates and ground state energies are
+shared between the runs of a worker. Every run gets its configuration as an argument, and with
+--eval_cache the workers return their evaluations, which the main process merges and writes at exit
+(pool workers never run atexit handlers).
+"""
+
+import os
+import copy
+import time
+import pickle
+import argparse
+import contextlib
+import multiprocessing as mp
+import numpy as np
+import VQE_run_periodic
+import eval_cache
+from VQE_run_periodic import get_gst_E
+from adjoint import get_zz_diag
+
+def get_multistart_args(parser):
+    parser.add_argument('--n_starts', type = int, default = 8, help = "number of independent VQE runs (default: 8)")
+    parser.add_argument('--n_workers', type = int, default = os.cpu_count(), help = "number of worker processes (default: number of cores)")
+    parser.add_argument('--seed', type = int, default = 0, help = "numpy seed of the first run, run k uses seed + k (default: 0)")
+    return VQE_run_periodic.get_args(parser)
+
+def init_worker(gst_E_cache):
+    VQE_run_periodic.gst_E_cache.update(gst_E_cache)
+
+def run_VQE(run_idx, run_args, seed):
+    """
+    Run one VQE optimization in this worker
+
+    Return:
+        summary (dict): best energy, number of energy evaluations, runtime of the run
+        cache_entries (dict): evaluation cache of this worker with --eval_cache, else empty
+    """
+    if not os.path.exists(run_args.output_dir):
+        os.makedirs(run_args.output_dir)
+    np.random.seed(seed)
+    start = time.time()
+    with open(os.path.join(run_args.output_dir, "log.txt"), "w", buffering = 1) as fp:
+        with contextlib.redirect_stdout(fp):
+            E_hist = VQE_run_periodic.main(run_args)
+    runtime = time.time() - start
+    summary = {"run": run_idx, "seed": seed, "output_dir": run_args.output_dir}
+    summary["best_E"], summary["final_E"] = float(np.min(E_hist)), float(E_hist[-1])
+    summary["n_evals"], summary["runtime"] = len(E_hist), runtime
+    summary["evals_per_sec"] = len(E_hist) / runtime
+    cache_entries = dict(eval_cache.cache) if run_args.eval_cache is not None else {}
+    return summary, cache_entries
+
+def run_VQE_star(task):
+    return run_VQE(*task)
+
+def get_summary_table(summary_l, gst_E):
+    header = f"{'run':>4} {'seed':>6} {'best E':>12} {'final E':>12} {'rel err':>10} {'evals':>7} {'runtime(s)':>11} {'evals/s':>9}"
+    line_l = [header, "-" * len(header)]
+    for summary in sorted(summary_l, key = lambda x: x["best_E"]):
+        rel_err = abs((summary["best_E"] - gst_E) / gst_E)
+        line_l.append(f"{summary['run']:>4} {summary['seed']:>6} {summary['best_E']:>12.6f} {summary['final_E']:>12.6f} {rel_err:>10.2e} "
+                      f"{summary['n_evals']:>7} {summary['runtime']:>11.1f} {summary['evals_per_sec']:>9.2f}")
+    return "\n".join(line_l)
+
+def main(args):
+    H_diag = None
+    if args.optimizer == "lbfgs-adjoint":
+        H_diag = args.J * get_zz_diag(args.n_qbts, [[i, (i+1)%args.n_qbts] for i in range(args.n_qbts)])
+    # ground state energy is computed once here and handed to every worker
+    gst_E = get_gst_E(args.n_qbts, args.J, H_diag, args.gst_E_dir)
+
+    task_l = []
+    for run_idx in range(args.n_starts):
+        run_args = copy.copy(args)
+        run_args.output_dir = os.path.join(args.output_dir, f"run_{run_idx}")
+        task_l.append((run_idx, run_args, args.seed + run_idx))
+
+    # loads --eval_cache before the workers start, and writes it with the evaluations of all workers at exit
+    eval_cache.enable(args.eval_cache_size, args.eval_cache, args.reuse_shot_evals)
+    summary_l = []
+    start = time.time()
+    with mp.Pool(min(args.n_workers, args.n_starts), initializer = init_worker, initargs = (VQE_run_periodic.gst_E_cache,)) as pool:
+        for summary, cache_entries in pool.imap_unordered(run_VQE_star, task_l):
+            eval_cache.merge(cache_entries)
+            summary_l.append(summary)
+            print(f"run {summary['run']} finished: best E {summary['best_E']:.6f}, {summary['n_evals']} evals in {summary['runtime']:.1f}s")
+    wall_time = time.time() - start
+
+    table = get_summary_table(summary_l, gst_E)
+    table += f"\n\nground state energy: {gst_E:.6f}, wall time: {wall_time:.1f}s, total evals/s: {sum(x['n_evals'] for x in summary_l) / wall_time:.2f}"
+    print(table)
+    with open(os.path.join(args.output_dir, "multistart_summary.txt"), "w") as fp:
+        fp.write(table + "\n")
+    with open(os.path.join(args.output_dir, "multistart_summary.pkl"), "wb") as fp:
+        pickle.dump(summary_l, fp)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Multi-start VQE for 1-D TFIM with periodic boundary condition")
+    args = get_multistart_args(parser)
+    main(args)
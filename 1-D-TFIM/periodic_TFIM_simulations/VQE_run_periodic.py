@@ -1,22 +1,24 @@
 import sys
-from utils_periodic import get_exp_X, get_exp_ZZ
-import qiskit
-from qiskit import QuantumCircuit, Aer
-from qiskit_aer.noise import NoiseModel, depolarizing_error
-from qiskit_aer import AerSimulator
-from qiskit.visualization import plot_histogram
-from qiskit.tools.monitor import job_monitor
-from azure.quantum.qiskit import AzureQuantumProvider
-from qiskit import transpile
+from utils_periodic import get_exp_X, get_exp_ZZ, get_param_shift_l, get_param_shift_grad
+from utils_periodic import get_HR_dist_from_counts, save_atomic, dump_atomic
+from adjoint import get_ALA_gate_l, get_zz_diag, get_ground_energy, get_adjoint_E_and_grad
+import timing
+import sampling_profiler
+import eval_cache
 import numpy as np
 import argparse
-from qiskit.algorithms.optimizers import IMFIL
+from scipy.optimize import minimize
 from functools import partial
 import pickle
-import matplotlib.pyplot as plt
 import os
 
 E_hist = []
+#(param_idx, HR distance) of the HR monitor
+HR_monitor = []
+#transpiled parameterized circuits, one per measurement basis, reused by every batched job
+circ_template_dict = {}
+#ground state energy for each (n_qbts, J), from gst_E_dict_J_{J}_periodic.npy or Lanczos
+gst_E_cache = {}
 
 def get_args(parser):
     parser.add_argument('--n_qbts', type = int, default = 6, help = "number of qubits (default: 6)")
@@ -25,13 +27,30 @@ def get_args(parser):
     parser.add_argument('--max_iter', type = int, default = 10000, help = "maximum number of iterations (default: 10000)")
     parser.add_argument('--n_layers', type = int, default = 3, help = "number of ALA ansatz layers needed (default: 3)")
     parser.add_argument('--output_dir', type = str, default = ".", help = "output directory being used (default: .)")
+    parser.add_argument('--gst_E_dir', type = str, default = None, help = "directory of gst_E_dict_J_{J}_periodic.npy (default: the directory of this script)")
     parser.add_argument('--init_param', type = str, default = "NONE", help = "parameters for initialization (default: NONE)")
     parser.add_argument('--p1', type = float, default = 0.0, help = "one-qubit gate depolarization noise (default: 0.0)")
     parser.add_argument('--p2', type = float, default = 0.0, help = "two-qubit gate depolarization noise (default: 0.0)")
+    parser.add_argument('--optimizer', type = str, default = "IMFIL", help = "optimizer (IMFIL, ADAM, L_BFGS_B, lbfgs-adjoint). ADAM and L_BFGS_B use parameter-shift gradients, lbfgs-adjoint uses exact adjoint gradients of the noiseless statevector (default: IMFIL)")
+    parser.add_argument('--lr', type = float, default = 0.05, help = "learning rate of ADAM optimizer (default: 0.05)")
+    parser.add_argument('--timing', action = 'store_true', help = "time the stages of every energy evaluation and write VQE_timing.json/csv to output_dir")
+    parser.add_argument('--profile', action = 'store_true', help = "sample the call stacks and write VQE_profile.collapsed (flamegraph/speedscope) to output_dir, also on with SAMPLING_PROFILE=1")
+    parser.add_argument('--eval_cache_size', type = int, default = 256, help = "number of energy evaluations kept by parameter vector, 0 turns the cache off. Shot-noise evaluations are only kept with --reuse_shot_evals (default: 256)")
+    parser.add_argument('--eval_cache', type = str, default = None, help = "pickle file the evaluation cache (energies and counts) is loaded from and written to at exit (default: memory only)")
+    parser.add_argument('--save_counts', action = 'store_true', help = "keep the Z and X basis counts of every energy evaluation in output_dir/measurement/VQE, \
+                                so the HR script (--reuse_VQE_counts) only runs the Hadamard basis circuits")
+    parser.add_argument('--HR_every', type = int, default = 0, help = "compute the HR distance every HR_every energy evaluations from their Z and X counts and the \
+                                Hadamard basis circuits, and stop once it plateaus (written to HR_monitor.pkl). Shot-based optimizers only, 0 turns it off (default: 0)")
+    parser.add_argument('--HR_shots', type = int, default = None, help = "shots of the Hadamard basis circuits of the HR monitor (default: --shots)")
+    parser.add_argument('--HR_patience', type = int, default = 5, help = "stop when the HR distance did not improve by HR_tol in the last HR_patience checks (default: 5)")
+    parser.add_argument('--HR_tol', type = float, default = 0.005, help = "HR distance improvement of the HR monitor (default: 0.005)")
+    parser.add_argument('--reuse_shot_evals', action = 'store_true', help = "also reuse stored shot-noise evaluations of a repeated parameter vector (its shot noise is then repeated)")
     args = parser.parse_args()
     return args
 
 def Q_Circuit(N_qubits, var_params, h_l):
+    #qiskit is imported where it is used, so the lbfgs-adjoint path and --help start without it
+    from qiskit import QuantumCircuit
     circ = QuantumCircuit(N_qubits, N_qubits)
     param_idx = 0
     for i in range(N_qubits):
@@ -48,33 +67,206 @@ def Q_Circuit(N_qubits, var_params, h_l):
     return circ
 
 def get_measurement(n_qbts, var_params, backend, shots, h_l):
-    circ = Q_Circuit(n_qbts, var_params, h_l)
-    circ.measure(list(range(n_qbts)), list(range(n_qbts)))
-    circ = transpile(circ, backend)
-    job = backend.run(circ, shots = shots)
-    result = job.result()
-    measurement = dict(result.get_counts())
+    with timing.stage("circuit"):
+        circ = Q_Circuit(n_qbts, var_params, h_l)
+        circ.measure(list(range(n_qbts)), list(range(n_qbts)))
+    with timing.stage("transpile"):
+        from qiskit import transpile
+        circ = transpile(circ, backend)
+    with timing.stage("backend.run"):
+        job = backend.run(circ, shots = shots)
+        result = job.result()
+    with timing.stage("counts"):
+        measurement = dict(result.get_counts())
+    timing.count("circuits")
     return measurement
 
-def get_E(var_params, n_qbts, shots, J, backend):
-    z_l, x_l = [], [i for i in range(n_qbts)]
-    z_m = get_measurement(n_qbts, var_params, backend, shots, z_l)
-    x_m = get_measurement(n_qbts, var_params, backend, shots, x_l)
-    # maybe save x_m and z_m for future.
-    exp_X, exp_ZZ = get_exp_X(x_m, 1), get_exp_ZZ(z_m, 1)
-    exp_X_sqr, exp_ZZ_sqr = get_exp_X(x_m, 2), get_exp_ZZ(z_m, 2)
-    E = exp_X + J * exp_ZZ
+def get_circ_template(n_qbts, h_l, backend):
+    key = tuple(h_l)
+    if key not in circ_template_dict:
+        from qiskit import transpile
+        from qiskit.circuit import ParameterVector
+        theta = ParameterVector("theta", args.n_layers * n_qbts)
+        with timing.stage("circuit"):
+            circ = Q_Circuit(n_qbts, theta, h_l)
+            circ.measure(list(range(n_qbts)), list(range(n_qbts)))
+        with timing.stage("transpile"):
+            circ_template_dict[key] = (theta, transpile(circ, backend))
+    return circ_template_dict[key]
+
+def get_measurement_batch(n_qbts, var_params_l, backend, shots, h_l_l):
+    """
+    Measure every parameter vector in var_params_l in every basis of h_l_l with a single job
+
+    Return:
+        measurement_l (List[List[dict]]): measurement_l[i][j] is the counts of var_params_l[i] in basis h_l_l[j]
+    """
+    circ_l = []
+    for var_params in var_params_l:
+        for h_l in h_l_l:
+            theta, circ = get_circ_template(n_qbts, h_l, backend)
+            with timing.stage("assign_parameters"):
+                circ_l.append(circ.assign_parameters({theta: var_params}))
+    with timing.stage("backend.run"):
+        result = backend.run(circ_l, shots = shots).result()
+    with timing.stage("counts"):
+        counts_l = [dict(result.get_counts(i)) for i in range(len(circ_l))]
+    timing.count("circuits", len(circ_l))
+    return [counts_l[i:i+len(h_l_l)] for i in range(0, len(counts_l), len(h_l_l))]
+
+def save_E(E, var_params):
     E_hist.append(E)
-    with open(os.path.join(args.output_dir, "E_hist.pkl"), "wb") as fp:
-        pickle.dump(E_hist, fp)
-    np.save(os.path.join(args.output_dir, "params_dir", f"var_params_{len(E_hist)-1}.npy"), var_params)
+    timing.count("E_evals")
+    with timing.stage("save"):
+        with open(os.path.join(args.output_dir, "E_hist.pkl"), "wb") as fp:
+            pickle.dump(E_hist, fp)
+        np.save(os.path.join(args.output_dir, "params_dir", f"var_params_{len(E_hist)-1}.npy"), var_params)
     print("This is energy: ", E)
+
+class HRPlateau(Exception):
+    """
+    Raised by the HR monitor to stop the optimizer
+    """
+    pass
+
+def save_counts(z_m, x_m, n_qbts):
+    """
+    Keep the Z and X basis counts of the last saved energy in the measurement store of the HR script
+    """
+    param_idx = len(E_hist) - 1
+    with timing.stage("save"):
+        for h_l, counts in [([], z_m), (list(range(n_qbts)), x_m)]:
+            basis = ''.join([str(e) for e in h_l])
+            save_atomic(os.path.join(args.output_dir, "measurement", "VQE", f"{param_idx}th_param_{basis}qbt_h_gate.npy"), counts)
+
+def check_HR(var_params, z_m, x_m, n_qbts, shots, J, backend):
+    """
+    HR monitor: every args.HR_every energy evaluations, HR distance of the last saved parameters from
+    their Z and X counts and the Hadamard basis circuits. Raises HRPlateau once the HR distance did not
+    improve by args.HR_tol in the last args.HR_patience checks.
+    """
+    param_idx = len(E_hist) - 1
+    if args.HR_every <= 0 or param_idx % args.HR_every != 0:
+        return
+    h_l_l = [[h_idx] for h_idx in range(n_qbts)]
+    cross_m_l = get_measurement_batch(n_qbts, [var_params], backend, args.HR_shots or shots, h_l_l)[0]
+    with timing.stage("estimators"):
+        HR_dist = get_HR_dist_from_counts(z_m, x_m, cross_m_l, J)
+    HR_monitor.append((param_idx, float(HR_dist)))
+    timing.count("HR_checks")
+    dump_atomic(os.path.join(args.output_dir, "HR_monitor.pkl"), HR_monitor)
+    print(f"HR distance at {param_idx}th param: {HR_dist}")
+    dist_l = [dist for _, dist in HR_monitor]
+    if len(dist_l) > args.HR_patience and min(dist_l[-args.HR_patience:]) > min(dist_l[:-args.HR_patience]) - args.HR_tol:
+        raise HRPlateau(f"HR distance did not improve by {args.HR_tol} in the last {args.HR_patience} checks (best: {min(dist_l)})")
+
+def get_eval_key(var_params, kind, n_qbts, shots, J):
+    return eval_cache.get_key(var_params, kind = kind, model = "TFIM_periodic", ansatz = "ALA", n_qbts = n_qbts, n_layers = args.n_layers,
+                              J = J, shots = shots, backend = "aer_simulator", p1 = args.p1, p2 = args.p2)
+
+def get_E(var_params, n_qbts, shots, J, backend):
+    key = get_eval_key(var_params, "E", n_qbts, shots, J)
+    value = eval_cache.lookup(key, deterministic = False)
+    if value is not None:
+        timing.count("eval_cache_hits")
+        E, (z_m, x_m) = value["E"], value["counts"]
+    else:
+        z_l, x_l = [], [i for i in range(n_qbts)]
+        z_m = get_measurement(n_qbts, var_params, backend, shots, z_l)
+        x_m = get_measurement(n_qbts, var_params, backend, shots, x_l)
+        with timing.stage("estimators"):
+            exp_X, exp_ZZ = get_exp_X(x_m, 1), get_exp_ZZ(z_m, 1)
+            exp_X_sqr, exp_ZZ_sqr = get_exp_X(x_m, 2), get_exp_ZZ(z_m, 2)
+        E = exp_X + J * exp_ZZ
+        eval_cache.store(key, {"E": E, "counts": [z_m, x_m]}, deterministic = False)
+    save_E(E, var_params)
+    if args.save_counts:
+        save_counts(z_m, x_m, n_qbts)
+    check_HR(var_params, z_m, x_m, n_qbts, shots, J, backend)
     return E
 
+def get_E_and_grad(var_params, n_qbts, shots, J, backend):
+    """
+    Get energy and its parameter-shift gradient. The energy circuits and the 2P shifted circuits
+    (in Z and X basis) are sent to the backend as one batched job.
+    """
+    key = get_eval_key(var_params, "E_grad", n_qbts, shots, J)
+    value = eval_cache.lookup(key, deterministic = False)
+    if value is not None:
+        timing.count("eval_cache_hits")
+        E, grad, (z_m, x_m) = value["E"], value["grad"], value["counts"]
+    else:
+        z_l, x_l = [], [i for i in range(n_qbts)]
+        var_params_l = np.concatenate([[var_params], get_param_shift_l(var_params)])
+        measurement_l = get_measurement_batch(n_qbts, var_params_l, backend, shots, [z_l, x_l])
+        with timing.stage("estimators"):
+            E_l = [get_exp_X(x_m, 1) + J * get_exp_ZZ(z_m, 1) for z_m, x_m in measurement_l]
+        E, grad = E_l[0], get_param_shift_grad(E_l[1:])
+        z_m, x_m = measurement_l[0]
+        eval_cache.store(key, {"E": E, "grad": grad, "counts": [z_m, x_m]}, deterministic = False)
+    save_E(E, var_params)
+    if args.save_counts:
+        save_counts(z_m, x_m, n_qbts)
+    check_HR(var_params, z_m, x_m, n_qbts, shots, J, backend)
+    return E, grad
+
+def get_gst_E(n_qbts, J, H_diag = None, dir_path = None):
+    """
+    Get ground state energy of n_qbts periodic TFIM. Falls back to Lanczos on the matrix-free H
+    when H_diag is given and gst_E_dict_J_{J}_periodic.npy in dir_path (default: the directory of
+    this script) has no entry.
+    """
+    key = (n_qbts, J)
+    if key not in gst_E_cache:
+        try:
+            dir_path = dir_path or os.path.dirname(os.path.realpath(__file__))
+            gst_E_cache[key] = np.load(os.path.join(dir_path, f"gst_E_dict_J_{J}_periodic.npy"), allow_pickle = True).item()[n_qbts]
+        except:
+            if H_diag is None:
+                raise ValueError(f"no corresponding index to ground state energy J value to {n_qbts} qubits")
+            gst_E_cache[key] = get_ground_energy(n_qbts, H_diag)
+    return gst_E_cache[key]
+
+def get_E_and_grad_adjoint(var_params, gate_l, n_qbts, H_diag):
+    """
+    Get exact energy and its gradient from the numpy statevector with adjoint differentiation
+    """
+    #exact, so a repeated parameter vector is always served from the cache
+    key = get_eval_key(var_params, "adjoint", n_qbts, None, args.J)
+    value = eval_cache.lookup(key, deterministic = True)
+    if value is not None:
+        timing.count("eval_cache_hits")
+        E, grad = value["E"], value["grad"]
+    else:
+        with timing.stage("adjoint"):
+            E, grad = get_adjoint_E_and_grad(var_params, gate_l, n_qbts, H_diag)
+        eval_cache.store(key, {"E": E, "grad": grad}, deterministic = True)
+    save_E(E, var_params)
+    return E, grad
+
+def init_run(run_args):
+    """
+    Set the configuration the helpers read at module level and clear the history of a previous run
+    in this process (e.g. a VQE_multistart_periodic.py worker)
+    """
+    global args
+    args = run_args
+    E_hist.clear()
+    HR_monitor.clear()
+
 def main(args):
+    """
+    Return:
+        E_hist (list): energies of all evaluations of the run
+    """
+    init_run(args)
     assert args.n_qbts % 2 == 0, "only supports even number of qubits"
     if not os.path.exists(os.path.join(args.output_dir,"params_dir")):
         os.makedirs(os.path.join(args.output_dir,"params_dir"))
+    if args.timing:
+        timing.enable(args.output_dir, "VQE")
+    sampling_profiler.start(args.output_dir, "VQE", sampling_profiler.DEFAULT_INTERVAL if args.profile else None)
+    eval_cache.enable(args.eval_cache_size, args.eval_cache, args.reuse_shot_evals)
 
     Nparams = args.n_layers * args.n_qbts
 
@@ -87,11 +279,11 @@ def main(args):
 
     bounds = np.tile(np.array([-np.pi, np.pi]), (Nparams,1))
 
-    try:
-        dir_path = os.path.dirname(os.path.realpath(__file__))
-        gst_E = np.load(os.path.join(dir_path, f"gst_E_dict_J_{args.J}_periodic.npy"), allow_pickle = True).item()[args.n_qbts]
-    except:
-        raise ValueError(f"no corresponding index to ground state energy J value to {args.n_qbts} qubits")
+    H_diag = None
+    if args.optimizer == "lbfgs-adjoint":
+        assert args.p1 == 0 and args.p2 == 0, "lbfgs-adjoint only supports noiseless simulation"
+        H_diag = args.J * get_zz_diag(args.n_qbts, [[i, (i+1)%args.n_qbts] for i in range(args.n_qbts)])
+    gst_E = get_gst_E(args.n_qbts, args.J, H_diag, args.gst_E_dir)
 
     hyperparam_dict = {}
     hyperparam_dict["n_qbts"], hyperparam_dict["J"] = args.n_qbts, args.J
@@ -99,24 +291,58 @@ def main(args):
     hyperparam_dict["gst_E"] = gst_E
     hyperparam_dict["p1"] = args.p1
     hyperparam_dict["p2"] = args.p2
+    hyperparam_dict["optimizer"] = args.optimizer
+    hyperparam_dict["save_counts"] = args.save_counts
+    if args.save_counts:
+        os.makedirs(os.path.join(args.output_dir, "measurement", "VQE"), exist_ok = True)
+    if args.HR_every > 0:
+        assert args.optimizer != "lbfgs-adjoint", "the HR monitor needs the counts of a shot-based optimizer"
 
-    if args.p1 == 0 and args.p2 == 0:
+    if args.optimizer == "lbfgs-adjoint":
+        #the adjoint path only uses the numpy statevector, qiskit_aer is not imported
+        backend = None
+    elif args.p1 == 0 and args.p2 == 0:
+        from qiskit import Aer
         backend = Aer.get_backend('aer_simulator')
-        title = "VQE 1-D "+ str(args.n_qbts) +" qubits TFIM" + "\n" + f"J: {args.J}, shots: {args.shots}" + '\n' + 'True Ground energy: ' + \
-                str(round(gst_E, 3)) + '\n'
     else:
+        from qiskit_aer import AerSimulator
+        from qiskit_aer.noise import NoiseModel, depolarizing_error
         noise_model = NoiseModel()
         p1_error = depolarizing_error(args.p1, 1)
         p2_error = depolarizing_error(args.p2, 2)
         noise_model.add_all_qubit_quantum_error(p1_error, ['h','ry'])
         noise_model.add_all_qubit_quantum_error(p2_error, ['cx'])
         backend = AerSimulator(noise_model = noise_model)
+    if args.p1 == 0 and args.p2 == 0:
+        title = "VQE 1-D "+ str(args.n_qbts) +" qubits TFIM" + "\n" + f"J: {args.J}, shots: {args.shots}" + '\n' + 'True Ground energy: ' + \
+                str(round(gst_E, 3)) + '\n'
+    else:
         title = "VQE 1-D "+ str(args.n_qbts) +" qubits TFIM" + "\n" + f"J: {args.J}, shots: {args.shots}" + '\n' + f"p1: {args.p1}, p2: {args.p2}" + '\n' + 'True Ground energy: ' + \
                 str(round(gst_E, 3)) + '\n'
 
-    imfil = IMFIL(maxiter = args.max_iter)
     get_E_func = partial(get_E, n_qbts = args.n_qbts, shots = args.shots, J = args.J, backend = backend)
-    result = imfil.minimize(get_E_func, x0 = var_params, bounds = bounds)
+    get_E_and_grad_func = partial(get_E_and_grad, n_qbts = args.n_qbts, shots = args.shots, J = args.J, backend = backend)
+    #the HR monitor (--HR_every) stops the optimizer by raising HRPlateau
+    try:
+        if args.optimizer == "IMFIL":
+            from qiskit.algorithms.optimizers import IMFIL
+            imfil = IMFIL(maxiter = args.max_iter)
+            result = imfil.minimize(get_E_func, x0 = var_params, bounds = bounds)
+        elif args.optimizer == "ADAM":
+            #ADAM only calls the gradient every iteration, which also records the energy
+            from qiskit.algorithms.optimizers import ADAM
+            adam = ADAM(maxiter = args.max_iter, lr = args.lr)
+            result = adam.minimize(get_E_func, x0 = var_params, jac = lambda x: get_E_and_grad_func(x)[1])
+        elif args.optimizer == "L_BFGS_B":
+            result = minimize(get_E_and_grad_func, x0 = var_params, jac = True, method = "L-BFGS-B", bounds = bounds, options = {"maxiter": args.max_iter})
+        elif args.optimizer == "lbfgs-adjoint":
+            get_E_and_grad_adjoint_func = partial(get_E_and_grad_adjoint, gate_l = get_ALA_gate_l(args.n_qbts, args.n_layers), n_qbts = args.n_qbts, H_diag = H_diag)
+            result = minimize(get_E_and_grad_adjoint_func, x0 = var_params, jac = True, method = "L-BFGS-B", bounds = bounds, options = {"maxiter": args.max_iter})
+        else:
+            raise ValueError("please type the correct optimizer")
+    except HRPlateau as err:
+        print(err)
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots()
     VQE_steps = np.array(list(range(len(E_hist))))
     title += 'Estimated Ground Energy: '+ str(round(float(min(E_hist)), 3))
@@ -126,8 +352,10 @@ def main(args):
     ax.legend(bbox_to_anchor=(1.28, 1.30), fontsize = 10)
     plt.title(title, fontdict = {'fontsize' : 15})
     plt.savefig(args.output_dir+'/'+  str(args.n_qbts)+"qubits_"+ str(args.n_layers)+f"layers_shots_{args.shots}.png", dpi = 300, bbox_inches='tight')
+    plt.close(fig)
     # Save hyperparam_dict for Hamiltonian Reconstruction
     np.save(os.path.join(args.output_dir, "VQE_hyperparam_dict.npy"), hyperparam_dict)
+    return list(E_hist)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description = "VQE for 1-D TFIM with periodic boundary condition")
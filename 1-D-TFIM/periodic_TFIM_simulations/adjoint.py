@@ -0,0 +1,150 @@
+"""
+Statevector simulation and adjoint differentiation of the ALA ansatz.
+
+Gates are stored as a gate list of (name, qubits, param_idx) tuples, where param_idx is
+the index of the gate's parameter in var_params (None for fixed gates). Qubit i is bit i of
+the statevector index, the same ordering as qiskit and get_Hamiltonian in utils_periodic.py.
+"""
+
+import numpy as np
+from scipy.sparse.linalg import LinearOperator, eigsh
+
+def get_ALA_gate_l(N_qubits, n_layers):
+    """
+    Gate list of Q_Circuit(N_qubits, var_params, []) in VQE_run_periodic.py
+    """
+    gate_l = []
+    param_idx = 0
+    for i in range(N_qubits):
+        gate_l.append(("h", [i], None))
+    for layer in range(n_layers):
+        for j in range(layer%2, N_qubits, 2):
+            gate_l.append(("cx", [j%N_qubits, (j+1)%N_qubits], None))
+            gate_l.append(("ry", [j%N_qubits], param_idx))
+            param_idx += 1
+            gate_l.append(("ry", [(j+1)%N_qubits], param_idx))
+            param_idx += 1
+    return gate_l
+
+def get_bit_slices(N_qubits, bit_dict):
+    """
+    Index of the statevector reshaped to [2]*N_qubits, fixing qubit q to bit_dict[q]
+    """
+    idx = [slice(None)] * N_qubits
+    for q, bit in bit_dict.items():
+        idx[N_qubits - 1 - q] = bit
+    return tuple(idx)
+
+def apply_1q(psi, mat, q, N_qubits):
+    """
+    Apply 2x2 matrix mat to qubit q of psi in place
+    """
+    v = psi.reshape([2] * N_qubits)
+    a, b = v[get_bit_slices(N_qubits, {q: 0})], v[get_bit_slices(N_qubits, {q: 1})]
+    a_old = a.copy()
+    a *= mat[0, 0]
+    a += mat[0, 1] * b
+    b *= mat[1, 1]
+    b += mat[1, 0] * a_old
+    return psi
+
+def apply_cx(psi, ctrl, tgt, N_qubits):
+    """
+    Apply CNOT to psi in place
+    """
+    v = psi.reshape([2] * N_qubits)
+    idx0 = get_bit_slices(N_qubits, {ctrl: 1, tgt: 0})
+    idx1 = get_bit_slices(N_qubits, {ctrl: 1, tgt: 1})
+    tmp = v[idx0].copy()
+    v[idx0] = v[idx1]
+    v[idx1] = tmp
+    return psi
+
+def get_ry(theta):
+    c, s = np.cos(theta/2), np.sin(theta/2)
+    return np.array([[c, -s], [s, c]])
+
+H_GATE = (1/np.sqrt(2))*np.array([[1., 1.], [1., -1.]])
+
+def apply_gate(psi, gate, var_params, N_qubits, inverse = False):
+    name, qubits, param_idx = gate
+    if name == "h":
+        return apply_1q(psi, H_GATE, qubits[0], N_qubits)
+    elif name == "cx":
+        return apply_cx(psi, qubits[0], qubits[1], N_qubits)
+    elif name == "ry":
+        theta = -var_params[param_idx] if inverse else var_params[param_idx]
+        return apply_1q(psi, get_ry(theta), qubits[0], N_qubits)
+    else:
+        raise ValueError(f"gate {name} is not supported")
+
+def get_ry_grad(phi, lam, q, N_qubits):
+    """
+    2 Re<lam| -i/2 Y_q |phi>, derivative of the energy w.r.t. the angle of RY on qubit q.
+    -i/2 Y = [[0, -1/2], [1/2, 0]] only swaps the q = 0 and q = 1 halves, so no copy of phi is needed
+    """
+    phi_v, lam_v = phi.reshape([2] * N_qubits), lam.reshape([2] * N_qubits)
+    idx0, idx1 = get_bit_slices(N_qubits, {q: 0}), get_bit_slices(N_qubits, {q: 1})
+    return np.vdot(lam_v[idx1], phi_v[idx0]) - np.vdot(lam_v[idx0], phi_v[idx1])
+
+def get_statevector(gate_l, var_params, N_qubits):
+    psi = np.zeros(2**N_qubits)
+    psi[0] = 1.
+    for gate in gate_l:
+        apply_gate(psi, gate, var_params, N_qubits)
+    return psi
+
+def get_zz_diag(N_qubits, index_l):
+    """
+    Diagonal of sum of Z_i Z_j over [i, j] in index_l
+    """
+    basis = np.arange(2**N_qubits)
+    zz_diag = np.zeros(2**N_qubits)
+    for i, j in index_l:
+        zz_diag += 1 - 2*(((basis >> i) ^ (basis >> j)) & 1)
+    return zz_diag
+
+def apply_H(psi, N_qubits, H_diag):
+    """
+    Returns H psi for H = X + diag(H_diag), without building the matrix of H
+    """
+    v = psi.reshape([2] * N_qubits)
+    H_psi = H_diag * psi
+    for axis in range(N_qubits):
+        H_psi += np.flip(v, axis = axis).reshape(-1)
+    return H_psi
+
+def get_ground_energy(N_qubits, H_diag):
+    """
+    Ground state energy of H = X + diag(H_diag) from Lanczos iterations
+    """
+    dim = 2**N_qubits
+    H = LinearOperator((dim, dim), matvec = lambda v: apply_H(np.ascontiguousarray(v).reshape(-1), N_qubits, H_diag), dtype = float)
+    val = eigsh(H, k = 1, which = "SA", return_eigenvectors = False)
+    return val[0]
+
+def get_adjoint_E_and_grad(var_params, gate_l, N_qubits, H_diag):
+    """
+    Get energy and its gradient with respect to all var_params with adjoint differentiation,
+    i.e. one forward and two backward statevector passes over gate_l
+
+    Args:
+        var_params (numpy 1d vector): parameters of the circuit
+        gate_l (list): gate list of the ansatz (e.g. get_ALA_gate_l)
+        N_qubits (int): number of qubits
+        H_diag (numpy 1d vector): diagonal part of H, H = X + diag(H_diag)
+
+    Return:
+        energy, gradient
+    """
+    phi = get_statevector(gate_l, var_params, N_qubits)
+    lam = apply_H(phi, N_qubits, H_diag)
+    E = np.dot(phi, lam)
+    grad = np.zeros(len(var_params))
+    for gate in reversed(gate_l):
+        name, qubits, param_idx = gate
+        if param_idx is not None:
+            grad[param_idx] += get_ry_grad(phi, lam, qubits[0], N_qubits)
+        apply_gate(phi, gate, var_params, N_qubits, inverse = True)
+        apply_gate(lam, gate, var_params, N_qubits, inverse = True)
+    return E, grad
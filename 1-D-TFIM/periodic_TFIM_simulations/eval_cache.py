@@ -0,0 +1,106 @@
+"""
+Memoized energy evaluations of the VQE scripts.
+
+IMFIL and the other bounded optimizers often evaluate the same parameter vector again (e.g. stencil
+points clipped to the bounds), and later scripts measure parameter vectors the VQE already measured.
+Evaluations are stored under a hash of the parameter vector rounded to DECIMALS decimals and the
+configuration of the evaluation (kind, model, ansatz, shots, backend, noise):
+
+    key = eval_cache.get_key(var_params, kind = "E", n_qbts = 6, J = 0.5, shots = 10000, p1 = 0.0, p2 = 0.0)
+    value = eval_cache.lookup(key, deterministic = False)
+    if value is None:
+        value = {"E": get_E(...), "counts": [z_m, x_m]}
+        eval_cache.store(key, value, deterministic = False)
+
+Only the max_size most recently used evaluations are kept. lookup returns a stored evaluation if it is
+deterministic (exact statevector energies and gradients), or if the reuse of shot-noise evaluations
+was allowed by enable(reuse = True). A reused shot-noise evaluation repeats the shot noise
+of the first one instead of drawing new shots. store skips the evaluations lookup would never return,
+so a shot-noise run without reuse leaves the cache as it is. With a path, enable() loads the cache
+from it and the cache is written back at exit.
+"""
+
+import os
+import atexit
+import pickle
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+DECIMALS = 10
+enabled = False
+reuse_stochastic = False
+max_size = 0
+cache_path = None
+cache = OrderedDict()
+
+def enable(size, path = None, reuse = False):
+    """
+    Turn the cache on (size > 0)
+
+    Args:
+        size (int): maximum number of stored evaluations, least recently used ones are evicted
+        path (str): pickle file the cache is loaded from and written to at exit, None to keep it in memory
+        reuse (bool): also return stored shot-noise evaluations
+    """
+    global enabled, reuse_stochastic, max_size, cache_path
+    if size <= 0:
+        return
+    if not enabled:
+        atexit.register(save)
+    enabled, reuse_stochastic, max_size = True, reuse, size
+    if path is not None and path != cache_path:
+        cache_path = path
+        if os.path.isfile(path):
+            with open(path, "rb") as fp:
+                cache.update(pickle.load(fp))
+    evict()
+
+def get_key(var_params, **config):
+    #+ 0.0 turns -0.0 into 0.0, so both hash the same
+    rounded = np.round(np.asarray(var_params, dtype = float), DECIMALS) + 0.0
+    digest = hashlib.sha1(rounded.tobytes())
+    digest.update(repr(sorted(config.items())).encode())
+    return digest.hexdigest()
+
+def lookup(key, deterministic):
+    """
+    Stored evaluation of key, None if there is none or it may not be reused
+    """
+    if not enabled or not (deterministic or reuse_stochastic):
+        return None
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+def store(key, value, deterministic):
+    if not enabled or not (deterministic or reuse_stochastic):
+        return
+    cache[key] = value
+    cache.move_to_end(key)
+    evict()
+
+def merge(entries):
+    """
+    Add the evaluations of another process, e.g. returned by a pool worker, whose cache is never saved
+    """
+    if not enabled:
+        return
+    cache.update(entries)
+    evict()
+
+def evict():
+    while len(cache) > max_size:
+        cache.popitem(last = False)
+
+def save():
+    """
+    Write the cache to its path through a temporary file, so the path never holds a partial cache
+    """
+    if cache_path is None:
+        return
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "wb") as fp:
+        pickle.dump(cache, fp)
+    os.replace(tmp_path, cache_path)
@@ -1,21 +1,16 @@
 import sys
-import qiskit
-from qiskit import QuantumCircuit, Aer
-from qiskit_aer.noise import NoiseModel, depolarizing_error
-from qiskit_aer import AerSimulator
-from qiskit.visualization import plot_histogram
-from qiskit.tools.monitor import job_monitor
-from azure.quantum.qiskit import AzureQuantumProvider
-from qiskit import transpile
 import numpy as np
 import argparse
 import pickle
-import matplotlib.pyplot as plt
 import os
-from utils_periodic import distanceVecFromSubspace, get_exp_cross, get_exp_X, get_exp_ZZ, get_fidelity, get_Hamiltonian
+from utils_periodic import distanceVecFromSubspace, get_exp_cross, get_exp_X, get_exp_ZZ, get_fidelity
+from symmetry import get_sector_gst, get_sector_fst
+from state_store import save_state, load_state
 
 
 def Q_Circuit(N_qubits, var_params, h_l, n_layers):
+    #qiskit is only needed for the fidelity circuits, the noisy energies are read from the stored measurements
+    from qiskit import QuantumCircuit
     circ = QuantumCircuit(N_qubits, N_qubits)
     param_idx = 0
     for i in range(N_qubits):
@@ -85,20 +80,6 @@ def get_noisy_E(hyperparam_dict, param_idx, params_dir_path, backend):
     print("This is noisy energy: ", E)
     return E
 
-def get_gst(eigen_values, eigen_vectors):
-    Ground_energy = np.amin(eigen_values)
-    index = np.argwhere(eigen_values == Ground_energy)[0][0]
-    #Obtain ground state's wavefunction
-    ground_wf = eigen_vectors[:, index]
-    ground_wf = (1./np.linalg.norm(ground_wf))*ground_wf
-    return ground_wf
-
-def get_first_excited_state(eigen_values, eigen_vectors):
-    indices = np.argsort(eigen_values)
-    excited_wf = eigen_vectors[:, indices[1]]
-    excited_wf = (1./np.linalg.norm(excited_wf))*excited_wf
-    return excited_wf
-
 def main(args):
     HR_hyperparam_dict_path = os.path.join(args.input_dir, "HR_hyperparam_dict.npy")
     if not os.path.exists(HR_hyperparam_dict_path):
@@ -146,28 +127,25 @@ def main(args):
             pickle.dump(noisy_E_hist, fp)
 
     #calculate fidelity
-    #get_gst
-    gst_path = os.path.join(args.input_dir, "gst.npy")
-    if os.path.isfile(gst_path):
-        gst = np.load(gst_path, allow_pickle = True)
-        if args.get_first_excited_state:
-            Ham = get_Hamiltonian(n_qbts, J)
-            eigen_values, eigen_vectors = np.linalg.eig(Ham)
-            fst_path = os.path.join(args.input_dir, "fst.npy")
-            fst = get_first_excited_state(eigen_values, eigen_vectors)
+    #get_gst from the translation and parity blocks, the full 2^N vector is only built for the fidelity
+    #cached in a memory mapped store, so the fidelity loop reads the ground state without loading a copy
+    gst_path = os.path.join(args.input_dir, "gst.stvec")
+    if os.path.isfile(os.path.join(args.input_dir, "gst.npy")):
+        gst = np.load(os.path.join(args.input_dir, "gst.npy"), mmap_mode = "r")
     else:
-        Ham = get_Hamiltonian(n_qbts, J)
-        eigen_values, eigen_vectors = np.linalg.eig(Ham)
-        gst = get_gst(eigen_values, eigen_vectors)
-        if args.get_first_excited_state:
-            fst_path = os.path.join(args.input_dir, "fst.npy")
-            fst = get_first_excited_state(eigen_values, eigen_vectors)
-        np.save(gst_path, gst)
+        if not os.path.isfile(gst_path):
+            _, gst = get_sector_gst(n_qbts, J)
+            save_state(gst_path, gst, metadata = {"n_qbts": n_qbts, "J": J})
+        gst = load_state(gst_path)
+    if args.get_first_excited_state:
+        _, fst = get_sector_fst(n_qbts, J)
 
     #backend initialization for fidelity
+    from qiskit_aer import AerSimulator
     if p1 == 0 and p2 == 0:
         fid_backend = AerSimulator()
     else:
+        from qiskit_aer.noise import NoiseModel, depolarizing_error
         noise_model = NoiseModel()
         p1_error = depolarizing_error(hyperparam_dict["p1"], 1)
         p2_error = depolarizing_error(hyperparam_dict["p2"], 2)
@@ -192,6 +170,7 @@ def main(args):
                 pickle.dump(fst_fid_hist, fp)
 
     #create plots
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots()
     ax.scatter(param_idx_l, noisy_E_hist, c = 'b', alpha = 0.8, marker = ".", label = "Energy")
     ax.set_xlabel('VQE Iterations')
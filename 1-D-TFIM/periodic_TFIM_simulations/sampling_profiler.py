@@ -0,0 +1,115 @@
+"""
+Low-overhead sampling profiler for long VQE and HR runs.
+
+A daemon thread wakes up every interval seconds, reads the current stack of the main thread with
+sys._current_frames() and counts it. The instrumented code is not traced, so the overhead is the
+sampling only (about 1% at the default 100 Hz). Time spent in C extensions (Aer, numpy, scipy) is
+attributed to the Python function that called them.
+
+The counts are written in the collapsed stack format ("outer;inner;leaf count" per line) to
+{prefix}_profile.collapsed in the output directory every dump_interval seconds and at exit, so a
+run that is still going (or was killed) can be inspected. The file can be opened directly in
+speedscope (https://www.speedscope.app) or turned into an svg with flamegraph.pl.
+
+It is turned on by the --profile flag of the scripts or by the environment variable
+SAMPLING_PROFILE (any value except 0, false, no or off turns it on, a number other than 1 is the
+sampling interval in seconds), e.g. SAMPLING_PROFILE=0.005 python HR_run_periodic.py ...
+"""
+
+import os
+import sys
+import time
+import atexit
+import threading
+
+ENV_VAR = "SAMPLING_PROFILE"
+DEFAULT_INTERVAL = 0.01
+DEFAULT_DUMP_INTERVAL = 60.0
+stack_counts = {}
+profiler_thread = None
+
+def get_frame_nm(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def get_collapsed_stack(frame):
+    frame_nm_l = []
+    while frame is not None:
+        frame_nm_l.append(get_frame_nm(frame))
+        frame = frame.f_back
+    return ";".join(reversed(frame_nm_l))
+
+def write_collapsed(path):
+    """
+    Write the stack counts to path, through a temporary file so readers never see a partial file
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as fp:
+        for stack, n in sorted(stack_counts.items(), key = lambda item: -item[1]):
+            fp.write(f"{stack} {n}\n")
+    os.replace(tmp_path, path)
+
+class SamplingThread(threading.Thread):
+    def __init__(self, target_thread_id, interval, dump_interval, path):
+        super().__init__(name = "sampling_profiler", daemon = True)
+        self.target_thread_id = target_thread_id
+        self.interval = interval
+        self.dump_interval = dump_interval
+        self.path = path
+        self.stop_event = threading.Event()
+
+    def run(self):
+        last_dump = time.monotonic()
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.target_thread_id)
+            if frame is None:
+                continue
+            stack = get_collapsed_stack(frame)
+            stack_counts[stack] = stack_counts.get(stack, 0) + 1
+            if time.monotonic() - last_dump > self.dump_interval:
+                write_collapsed(self.path)
+                last_dump = time.monotonic()
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+        write_collapsed(self.path)
+
+def get_env_interval():
+    """
+    Sampling interval requested by SAMPLING_PROFILE, None if profiling is not requested
+    """
+    value = os.environ.get(ENV_VAR, "0").strip().lower()
+    if value in ("", "0", "false", "no", "off"):
+        return None
+    if value == "1":
+        return DEFAULT_INTERVAL
+    try:
+        interval = float(value)
+    except ValueError:
+        #a non-numeric value like true or yes turns it on with the default interval
+        return DEFAULT_INTERVAL
+    return interval if interval > 0 else None
+
+def start(output_dir, prefix, interval = None, dump_interval = DEFAULT_DUMP_INTERVAL):
+    """
+    Start sampling the calling thread if --profile (interval given) or SAMPLING_PROFILE asks for it
+
+    Args:
+        output_dir (str): directory of {prefix}_profile.collapsed
+        prefix (str): file name prefix, e.g. "VQE"
+        interval (float): sampling interval in seconds, None to use SAMPLING_PROFILE only
+
+    Return:
+        path of the collapsed stack file, None if profiling is off
+    """
+    global profiler_thread
+    if interval is None:
+        interval = get_env_interval()
+    if interval is None or profiler_thread is not None:
+        return None
+    path = os.path.join(output_dir, f"{prefix}_profile.collapsed")
+    profiler_thread = SamplingThread(threading.get_ident(), interval, dump_interval, path)
+    profiler_thread.start()
+    atexit.register(profiler_thread.stop)
+    return path
@@ -0,0 +1,98 @@
+"""
+On-disk store for stacks of state vectors.
+
+A store is one binary file: a HEADER_SIZE byte header (magic string followed by a JSON dict with
+n_qubits, dtype, n_states and user metadata, padded with spaces) and then n_states state vectors of
+length 2^n_qubits stored back to back. The data starts at a page-aligned offset, so the file can be
+opened with np.memmap and states are read without unpickling or copying the whole file.
+"""
+
+import os
+import json
+import numpy as np
+
+MAGIC = b"STVEC001"
+HEADER_SIZE = 4096
+
+def read_header(path):
+    with open(path, "rb") as fp:
+        raw = fp.read(HEADER_SIZE)
+    if raw[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a state vector store")
+    return json.loads(raw[len(MAGIC):].decode())
+
+def write_header(fp, header):
+    raw = MAGIC + json.dumps(header).encode()
+    if len(raw) > HEADER_SIZE:
+        raise ValueError("metadata of the state vector store is too large")
+    fp.seek(0)
+    fp.write(raw.ljust(HEADER_SIZE, b" "))
+
+def create_state_store(path, n_qubits, dtype = np.complex128, metadata = None):
+    """
+    Create an empty store, overwriting path if it exists
+
+    Args:
+        path (str): path of the store
+        n_qubits (int): number of qubits of every state
+        dtype: dtype of the states (default: complex128)
+        metadata (dict): json serializable metadata kept in the header
+    """
+    header = {"n_qubits": int(n_qubits), "dtype": np.dtype(dtype).str, "n_states": 0, "metadata": metadata or {}}
+    with open(path, "wb") as fp:
+        write_header(fp, header)
+    return header
+
+def append_states(path, states):
+    """
+    Append one state or a stack of states (2d array, one state per row) to the store.
+    The header is only updated after the data is on disk, so an interrupted append leaves the
+    store with the previous n_states.
+    """
+    header = read_header(path)
+    states = np.asarray(states, dtype = header["dtype"]).reshape(-1, 2**header["n_qubits"])
+    state_bytes = states.shape[1] * states.itemsize
+    with open(path, "r+b") as fp:
+        fp.seek(HEADER_SIZE + header["n_states"] * state_bytes)
+        fp.write(np.ascontiguousarray(states).tobytes())
+        fp.truncate()
+        fp.flush()
+        os.fsync(fp.fileno())
+        header["n_states"] += len(states)
+        write_header(fp, header)
+    return header["n_states"]
+
+def open_state_store(path, mode = "r"):
+    """
+    Open the store as a memory map
+
+    Args:
+        path (str): path of the store
+        mode (str): "r" for read only, "r+" to modify states in place
+
+    Return:
+        states (np.memmap of shape (n_states, 2^n_qubits)), header (dict)
+    """
+    header = read_header(path)
+    shape = (header["n_states"], 2**header["n_qubits"])
+    if header["n_states"] == 0:
+        return np.zeros(shape, dtype = header["dtype"]), header
+    states = np.memmap(path, dtype = header["dtype"], mode = mode, offset = HEADER_SIZE, shape = shape)
+    return states, header
+
+def save_state(path, state, metadata = None):
+    """
+    Save a single state (e.g. a ground state) as a store of one state
+    """
+    state = np.asarray(state)
+    n_qubits = int(np.log2(len(state)))
+    dtype = np.complex128 if np.iscomplexobj(state) else np.float64
+    create_state_store(path, n_qubits, dtype, metadata)
+    append_states(path, state)
+
+def load_state(path, idx = 0):
+    """
+    Memory mapped view of the idx-th state of the store
+    """
+    states, _ = open_state_store(path)
+    return states[idx]
@@ -0,0 +1,170 @@
+"""
+Symmetry-resolved exact diagonalization of the periodic 1-D TFIM, H = X + J*ZZ.
+
+H commutes with the translation T (qubit i -> i+1 mod N) and the global spin flip F = prod X_i.
+Basis states are grouped into orbits of the group {T^j F^f}, and H is diagonalized in one
+momentum k = 2*pi*k_idx/N and parity p = +1/-1 block of dimension ~2^N/(2N). Qubit i is bit i of
+the statevector index, the same ordering as get_Hamiltonian in utils_periodic.py.
+
+Conjugating H by prod Z_i gives H' = -X + J*ZZ, which has non-positive off-diagonal elements. Its
+ground state is positive and invariant under T and F, so the ground state of H is in the block
+k = 0, p = (-1)^N.
+"""
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.linalg import eigsh
+from adjoint import get_zz_diag
+
+#blocks up to this dimension are diagonalized with dense eigh
+DENSE_DIM = 2000
+
+def get_translation_parity_group(N_qubits):
+    """
+    Elements T^j F^f of the group as (perm, flip), perm[i] is the qubit that qubit i is moved to.
+    The identity is the first element.
+    """
+    group_l = []
+    for j in range(N_qubits):
+        for f in range(2):
+            group_l.append(([(i + j) % N_qubits for i in range(N_qubits)], f == 1))
+    return group_l
+
+def get_character(N_qubits, k_idx, p):
+    """
+    Character of the momentum k = 2*pi*k_idx/N, parity p block on the elements of get_translation_parity_group
+    """
+    character = []
+    for j in range(N_qubits):
+        for f in range(2):
+            character.append(np.exp(2j*np.pi*k_idx*j/N_qubits) * p**f)
+    return np.array(character)
+
+def get_image(basis, perm, flip, N_qubits):
+    image = np.zeros_like(basis)
+    for i in range(N_qubits):
+        image |= ((basis >> i) & 1) << perm[i]
+    if flip:
+        image ^= (1 << N_qubits) - 1
+    return image
+
+def get_orbits(N_qubits, group_l):
+    """
+    Orbits of all 2^N basis states under the group
+
+    Return:
+        orbits (dict): rep (smallest state of the orbit of every basis state), g_idx (index of the
+        element g with g(s) = rep(s)), stab_mask (bit g is set if g(s) = s), orbit_size
+    """
+    basis = np.arange(2**N_qubits, dtype = np.int64)
+    rep, g_idx = basis.copy(), np.zeros(2**N_qubits, dtype = np.int64)
+    stab_mask = np.zeros(2**N_qubits, dtype = np.int64)
+    for idx, (perm, flip) in enumerate(group_l):
+        image = get_image(basis, perm, flip, N_qubits)
+        smaller = image < rep
+        rep[smaller], g_idx[smaller] = image[smaller], idx
+        stab_mask |= (image == basis).astype(np.int64) << idx
+    stab_size = np.zeros(2**N_qubits, dtype = np.int64)
+    for idx in range(len(group_l)):
+        stab_size += (stab_mask >> idx) & 1
+    return {"rep": rep, "g_idx": g_idx, "stab_mask": stab_mask, "orbit_size": len(group_l) // stab_size}
+
+def get_sector(orbits, character):
+    """
+    Basis of one symmetry block: |r> = 1/sqrt(orbit size) sum_{s in orbit of r} phase(s) |s>.
+    Orbits whose stabilizer has a character != 1 have no state in the block.
+    """
+    bad_mask = 0
+    for idx, chi in enumerate(character):
+        if not np.isclose(chi, 1):
+            bad_mask |= 1 << idx
+    compatible = (orbits["stab_mask"] & bad_mask) == 0
+    basis = np.arange(len(orbits["rep"]), dtype = np.int64)
+    rep_l = basis[compatible & (orbits["rep"] == basis)]
+    col = np.full(len(basis), -1, dtype = np.int64)
+    col[rep_l] = np.arange(len(rep_l))
+    state_col = np.where(compatible, col[orbits["rep"]], -1)
+    phase = np.conj(character[orbits["g_idx"]])
+    return {"rep_l": rep_l, "state_col": state_col, "phase": phase, "orbit_size": orbits["orbit_size"]}
+
+def get_sector_Hamiltonian(sector, N_qubits, H_diag):
+    """
+    Block of H = X + diag(H_diag) in the sector basis as a sparse matrix
+    """
+    rep_l, state_col, phase, orbit_size = sector["rep_l"], sector["state_col"], sector["phase"], sector["orbit_size"]
+    dim = len(rep_l)
+    row_l, col_l, val_l = [np.arange(dim)], [np.arange(dim)], [H_diag[rep_l].astype(complex)]
+    for i in range(N_qubits):
+        s = rep_l ^ (1 << i)
+        row = state_col[s]
+        connected = row >= 0
+        s = s[connected]
+        row_l.append(row[connected])
+        col_l.append(np.arange(dim)[connected])
+        val_l.append(phase[s] * np.sqrt(orbit_size[rep_l[connected]] / orbit_size[s]))
+    H_block = coo_matrix((np.concatenate(val_l), (np.concatenate(row_l), np.concatenate(col_l))), shape = (dim, dim)).tocsr()
+    if np.allclose(H_block.data.imag, 0):
+        H_block = H_block.real
+    return H_block
+
+def get_sector_eigh(H_block, n_states):
+    """
+    Lowest n_states eigenvalues and eigenvectors of the block
+    """
+    dim = H_block.shape[0]
+    n_states = min(n_states, dim)
+    if dim <= DENSE_DIM:
+        val, vec = np.linalg.eigh(H_block.toarray())
+    else:
+        val, vec = eigsh(H_block, k = n_states, which = "SA")
+        order = np.argsort(val)
+        val, vec = val[order], vec[:, order]
+    return val[:n_states], vec[:, :n_states]
+
+def get_full_state(sector, vec):
+    """
+    Rebuild the 2^N statevector from a vector of the block
+    """
+    state_col, phase, orbit_size = sector["state_col"], sector["phase"], sector["orbit_size"]
+    full_state = np.where(state_col >= 0, vec[state_col] * np.conj(phase) / np.sqrt(orbit_size), 0)
+    if np.isrealobj(vec) and np.allclose(full_state.imag, 0):
+        full_state = full_state.real
+    return full_state / np.linalg.norm(full_state)
+
+def get_sector_gst(n_qbts, J, orbits = None):
+    """
+    Ground state energy and ground state of the periodic 1-D TFIM from the k = 0, p = (-1)^N block
+
+    Return:
+        gst_E, gst (numpy 1d vector of length 2^N)
+    """
+    if orbits is None:
+        orbits = get_orbits(n_qbts, get_translation_parity_group(n_qbts))
+    H_diag = J * get_zz_diag(n_qbts, [[i, (i+1)%n_qbts] for i in range(n_qbts)])
+    sector = get_sector(orbits, get_character(n_qbts, 0, (-1)**n_qbts))
+    val, vec = get_sector_eigh(get_sector_Hamiltonian(sector, n_qbts, H_diag), 1)
+    return val[0], get_full_state(sector, vec[:, 0])
+
+def get_sector_fst(n_qbts, J, orbits = None):
+    """
+    First excited state energy and first excited state of the periodic 1-D TFIM.
+    Takes the second state of the ground state block and the lowest state of every other block.
+
+    Return:
+        fst_E, fst (numpy 1d vector of length 2^N)
+    """
+    if orbits is None:
+        orbits = get_orbits(n_qbts, get_translation_parity_group(n_qbts))
+    H_diag = J * get_zz_diag(n_qbts, [[i, (i+1)%n_qbts] for i in range(n_qbts)])
+    fst_E, fst = np.inf, None
+    for k_idx in range(n_qbts):
+        for p in [1, -1]:
+            sector = get_sector(orbits, get_character(n_qbts, k_idx, p))
+            if len(sector["rep_l"]) == 0:
+                continue
+            is_gst_sector = (k_idx == 0 and p == (-1)**n_qbts)
+            val, vec = get_sector_eigh(get_sector_Hamiltonian(sector, n_qbts, H_diag), 2 if is_gst_sector else 1)
+            state_idx = 1 if is_gst_sector else 0
+            if state_idx < len(val) and val[state_idx] < fst_E:
+                fst_E, fst = val[state_idx], get_full_state(sector, vec[:, state_idx])
+    return fst_E, fst
@@ -1,5 +1,12 @@
 import numpy as np
 from functools import reduce
+import os
+import sys
+import json
+import pickle
+#the sparse matrix builder is shared by all models, in model_spec.py at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+from model_spec import get_sparse_X_plus_diag
 
 def get_exp_cross(cross_m, indices):
     tot_val, tot_count = 0, 0
@@ -69,6 +76,20 @@ def get_Hamiltonian(N_qubits, J):
     Hz = get_Hzz(N_qubits)
     return Hx + J*Hz
 
+def get_sparse_Hamiltonian(N_qubits, J):
+    """
+    Same matrix as get_Hamiltonian(N_qubits, J) in CSR format, built from bit operations on all
+    2^N basis states at once instead of kron products. The ZZ energy of basis state s is
+    (number of bonds) - 2*(number of bonds [i, j] with bit i of s XOR bit j of s = 1).
+    """
+    basis = np.arange(2**N_qubits, dtype = np.int32)
+    bit_l = [((basis >> i) & 1).astype(np.int8) for i in range(N_qubits)]
+    #number of anti-aligned bonds of every basis state
+    n_anti = np.zeros(2**N_qubits, dtype = np.int16)
+    for i in range(N_qubits):
+        n_anti += bit_l[i] ^ bit_l[(i+1)%N_qubits]
+    return get_sparse_X_plus_diag(N_qubits, J * (N_qubits - 2*n_anti))
+
 def get_fidelity(wf, mat):
     fid = np.matmul(np.conj(wf),np.matmul(mat, wf))
     return fid.real
@@ -90,3 +111,200 @@ def distanceVecFromSubspace(w, A):
     for i in range(len(Q[0])):
         r += np.dot(w, Q[:,i])*Q[:,i]
     return np.linalg.norm(r-w)
+
+def get_HR_dist_from_counts(z_m, x_m, cross_m_l, J):
+    """
+    HR distance of the periodic TFIM from measurement counts
+
+    Args:
+        z_m, x_m: counts of the Z and X basis
+        cross_m_l: counts of the basis with a Hadamard gate on qubit h only, for every qubit h
+        J: ZZ coupling
+
+    Return:
+        HR distance of (1, J) from the lowest eigenvector of the covariance matrix
+    """
+    cov_mat = np.zeros((2,2))
+    n_qbts = len(cross_m_l)
+    exp_X, exp_ZZ = get_exp_X(x_m, 1),  get_exp_ZZ(z_m, 1)
+    cov_mat[0, 0] =  get_exp_X(x_m, 2) - exp_X**2
+    cov_mat[1, 1] = get_exp_ZZ(z_m, 2) - exp_ZZ**2
+    cross_val = 0
+    z_indices = [[i%n_qbts, (i+1)%n_qbts] for i in range(n_qbts)]
+    for h_idx, cross_m in enumerate(cross_m_l):
+        for z_ind in z_indices:
+            if h_idx not in z_ind:
+                cross_val += get_exp_cross(cross_m, [h_idx] + z_ind)
+    cov_mat[0,1] = cross_val - exp_X*exp_ZZ
+    cov_mat[1,0] = cov_mat[0,1]
+    val, vec = np.linalg.eigh(cov_mat)
+    argsort = np.argsort(val)
+    val, vec = val[argsort], vec[:, argsort]
+    orig_H = np.array([1, J])
+    orig_H = orig_H/np.linalg.norm(orig_H)
+    return distanceVecFromSubspace(orig_H, vec[:, :1])
+
+def get_basis_probs(wf, h_l, N_qubits):
+    """
+    Exact measurement probabilities of wf after a Hadamard gate on every qubit in h_l,
+    computed with fast Walsh-Hadamard butterflies. Qubit i is bit i of the statevector index.
+
+    Args:
+        wf (numpy 1d vector): statevector of length 2^N_qubits
+        h_l (list): qubits measured in the X basis
+        N_qubits (int): number of qubits
+
+    Return:
+        probs (numpy 1d vector): probability of every basis state
+    """
+    wf = np.array(wf, dtype = complex)
+    for q in h_l:
+        v = wf.reshape(2**(N_qubits-1-q), 2, 2**q)
+        a = v[:, 0, :].copy()
+        v[:, 0, :] += v[:, 1, :]
+        v[:, 1, :] *= -1
+        v[:, 1, :] += a
+    probs = np.abs(wf)**2
+    return probs / 2**len(h_l)
+
+def sample_counts(probs, shots, rng):
+    """
+    Draw shots from the exact distribution probs with a single multinomial draw
+
+    Return:
+        counts (dict): same format as result.get_counts(), the bitstring lists qubit N-1 first
+    """
+    N_qubits = int(np.log2(len(probs)))
+    counts = rng.multinomial(shots, probs / probs.sum())
+    return {format(idx, f"0{N_qubits}b"): int(counts[idx]) for idx in np.flatnonzero(counts)}
+
+def subsample_counts(counts, shots, rng, n_replicates = None):
+    """
+    Draw shots of the measured shots in counts without replacement (multivariate hypergeometric),
+    i.e. the counts of a run with fewer shots, without running the circuit again
+
+    Args:
+        counts (dict): measured counts, at least shots in total
+        shots (int): number of shots of the subsample
+        rng (numpy Generator): random number generator
+        n_replicates (int): number of independent subsamples drawn in one call, None for a single one
+
+    Return:
+        counts (dict) of the subsample in the format of counts, or a list of n_replicates of them
+    """
+    keys = list(counts.keys())
+    colors = np.fromiter(counts.values(), dtype = np.int64, count = len(keys))
+    assert shots <= colors.sum(), f"can't draw {shots} shots from {colors.sum()} measured shots"
+    #the count method costs O(measured shots) per replicate, much less than the marginals method for many distinct bitstrings
+    sub_counts = rng.multivariate_hypergeometric(colors, shots, size = n_replicates, method = "count")
+    if n_replicates is None:
+        return {keys[idx]: int(sub_counts[idx]) for idx in np.flatnonzero(sub_counts)}
+    sub_counts_l = []
+    for row in sub_counts:
+        nonzero = np.flatnonzero(row)
+        sub_counts_l.append(dict(zip([keys[idx] for idx in nonzero], row[nonzero].tolist())))
+    return sub_counts_l
+
+def load_ledger(ledger_path):
+    """
+    Replay the checkpoint ledger of a sweep.
+    The ledger is an append-only file with one JSON entry per line, each entry recording
+    the status ("submitted", "done" or "failed") of a (param_idx, basis) pair.
+
+    Args:
+        ledger_path (str): path to the ledger file
+
+    Return:
+        ledger (dict): latest entry of every (param_idx, basis) pair
+    """
+    ledger = {}
+    if not os.path.isfile(ledger_path):
+        return ledger
+    with open(ledger_path, "r+") as fp:
+        content = fp.read()
+        #drop a partially written last line, left over if the sweep was killed mid-write
+        if not content.endswith("\n"):
+            content = content[:content.rfind("\n") + 1]
+            fp.seek(0)
+            fp.truncate()
+            fp.write(content)
+    for line in content.splitlines():
+        entry = json.loads(line)
+        ledger[(entry["param_idx"], entry["basis"])] = entry
+    return ledger
+
+def update_ledger(ledger_path, ledger, param_idx, basis, status, **fields):
+    """
+    Append an entry to the ledger. Costs O(1) per call regardless of the sweep length.
+
+    Args:
+        ledger_path (str): path to the ledger file
+        ledger (dict): ledger loaded by load_ledger, updated in place
+        param_idx (int): parameter index
+        basis (str): measurement basis ("HR" for the HR distance of param_idx)
+        status (str): "submitted", "done" or "failed"
+        fields: extra fields to record (e.g. job_id, path, HR_dist)
+    """
+    entry = {"param_idx": int(param_idx), "basis": basis, "status": status}
+    entry.update(fields)
+    with open(ledger_path, "a") as fp:
+        fp.write(json.dumps(entry) + "\n")
+        fp.flush()
+        os.fsync(fp.fileno())
+    ledger[(entry["param_idx"], basis)] = entry
+    return entry
+
+def is_job_failed(job):
+    """
+    True if job reports a terminal ERROR or CANCELLED status. A job whose status can't be read (e.g. a
+    network error) may still finish, so it is not failed and its ledger entry stays "submitted".
+    """
+    try:
+        status = job.status()
+    except Exception:
+        return False
+    return getattr(status, "name", str(status)) in ("ERROR", "CANCELLED")
+
+def save_atomic(path, obj):
+    """
+    np.save obj to path through a temporary file, so that path never holds a partial result
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as fp:
+        np.save(fp, obj, allow_pickle = True)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, path)
+
+def dump_atomic(path, obj):
+    """
+    pickle.dump obj to path through a temporary file, so that path never holds a partial result
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as fp:
+        pickle.dump(obj, fp)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, path)
+
+def get_param_shift_l(var_params):
+    """
+    Get the 2P shifted parameter vectors of the parameter-shift rule.
+    The rule is exact when every parameter enters the circuit through a single
+    Pauli rotation exp(-i*theta*P/2), e.g. the RY gates of the ALA ansatz.
+
+    Args:
+        var_params (numpy 1d vector): parameters of the circuit (length P)
+
+    Return:
+        numpy 2d matrix whose first P rows are var_params + pi/2 e_k and last P rows are var_params - pi/2 e_k
+    """
+    shift = (np.pi/2)*np.eye(len(var_params))
+    return np.concatenate([var_params + shift, var_params - shift])
+
+def get_param_shift_grad(E_shift_l):
+    """
+    Get the gradient from the energies of the parameter vectors returned by get_param_shift_l
+    """
+    E_plus, E_minus = np.split(np.asarray(E_shift_l), 2)
+    return (E_plus - E_minus)/2
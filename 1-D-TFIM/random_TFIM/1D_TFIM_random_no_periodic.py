@@ -1,15 +1,18 @@
 import numpy as np
 import pickle
 import os
-import random
 import argparse
 import time
-from utils import normalize, diagonalize, get_fidelity, expected_op, get_operator_cache, get_noisy_energy
+from utils import normalize, diagonalize, get_fidelity, expected_op, get_operator_cache, get_noisy_energy, get_perturbed_wf_batch
+from state_store import create_state_store, append_states
 
 parser = argparse.ArgumentParser(description = "Make set of perturbed ground state wavefunctions for VQE")
 parser.add_argument('--save_dir', type = str, default = ".", help= "directory to save created wavefunctions (default: '.')")
 parser.add_argument('--n_qbts', type = int, help = "number of qubits")
 parser.add_argument('--J', type = float, help = "J value that indicates nearest neighbor connection")
+parser.add_argument('--n_states', type = int, default = 100, help = "number of perturbed wavefunctions to create (default: 100)")
+parser.add_argument('--batch_size', type = int, default = 256, help = "number of perturbed wavefunctions generated at once (default: 256)")
+parser.add_argument('--seed', type = int, default = None, help = "seed of the perturbations (default: None)")
 args = parser.parse_args()
 
 def get_Hamiltonian(N_qubits, J):
@@ -56,8 +59,6 @@ def main():
     ground_wf = (1./np.linalg.norm(ground_wf))*ground_wf
     print("J : ", J)
     print("True ground energy : ", round(Gnd_E, 6))
-    indices = [ind for ind in range(len(ground_wf))]
-    #for loop is from PRAVEEN's code block (modified slightly)
     maxFid = 0
     minFid = 100
     wf_count = 0
@@ -69,29 +70,25 @@ def main():
     props = {"system": "1-D TFIM",
              "N_qubits": N_qubits,
              "J":J,
-             "Ground Energy": round(Gnd_E, 6)}
+             "Ground Energy": round(Gnd_E, 6),
+             "seed": args.seed}
     pickle.dump(props, open(PATH+"/props.dat", "w+b"))
-    while wf_count < 100:
-        #copy the ground state wavefunction to obtain perturbed ground state
-        wf = np.copy(ground_wf)
-        shuffled_indices = indices.copy()
-        #obtain random sequence of indices
-        random.shuffle(shuffled_indices)
-        indicesRange = random.randrange(1, len(wf))
-        for ind in range(0, indicesRange, 2):
-            r = random.random()
-            k = shuffled_indices[ind]
-            wf[k] =  (1-r) * wf[k]
-        wf = normalize(wf)
-        fidelity = 100*get_fidelity(wf, ground_wf)**2
-        if fidelity >= 80:
-            print("This is fidelity: ", fidelity)
-            maxFid = max(fidelity, maxFid)
-            minFid = min(fidelity, minFid)
-            pickle.dump(np.array(wf),open(PATH+'/'+'wf_'+str(wf_count)+'_.dat', "w+b"))
-            wf_count += 1
-        else:
-            pass
+    #perturbed wavefunctions are appended to one memory mapped store instead of one pickle per wavefunction
+    store_path = os.path.join(PATH, "wf_store.stvec")
+    create_state_store(store_path, N_qubits, ground_wf.dtype, metadata = props)
+    rng = np.random.default_rng(args.seed)
+    while wf_count < args.n_states:
+        wf_batch = get_perturbed_wf_batch(ground_wf, args.batch_size, rng)
+        #fidelities of the whole batch with one matmul
+        fidelity = 100*get_fidelity(wf_batch, ground_wf)**2
+        accepted_idx = np.flatnonzero(fidelity >= 80)[:args.n_states - wf_count]
+        if len(accepted_idx) == 0:
+            continue
+        append_states(store_path, wf_batch[accepted_idx])
+        wf_count += len(accepted_idx)
+        maxFid = max(np.amax(fidelity[accepted_idx]), maxFid)
+        minFid = min(np.amin(fidelity[accepted_idx]), minFid)
+        print(f"accepted {len(accepted_idx)} of {args.batch_size} wavefunctions, {wf_count} / {args.n_states} done")
     print("This is maximum fidelity obtained: ", maxFid)
     print("This is minimum fidelity obtained: ", minFid)
 
@@ -6,6 +6,8 @@ import os
 import sys
 import random
 import argparse
+import multiprocessing as mp
+from state_store import open_state_store
 
 parser = argparse.ArgumentParser(description = "Get Hamiltonian Reconstruction Distance")
 parser.add_argument('--n_qbts',type = int, help = "number of qubits")
@@ -13,15 +15,22 @@ parser.add_argument('--load_dir', type = str, help = "loading directory with ran
 parser.add_argument('--num_eig', type = int, help = "number of eigen vectors during Hamiltonian reconstruction")
 parser.add_argument('--ops', type = str, help = "operators used during reconstruction. Operators separated by spaces. Possible operators are: \
                                                         'x', 'y', 'z', 'xx', 'yy', 'zz', 'x_x', 'y_y', 'z_z'")
-parser.add_argument('--gpu', type = int, default = -1, help = " -1 when not using GPU. Otherwise, value of this argument indicates device id number")
+parser.add_argument('--gpu', type = int, default = -1, help = " -1 when not using GPU (multi-threaded CPU backend). Otherwise, value of this argument indicates device id number")
+parser.add_argument('--n_threads', type = int, default = os.cpu_count(), help = "number of threads of the CPU backend (default: number of cores)")
 parser.add_argument('--save_dir', type = str, help = "save directory")
+parser.add_argument('--batch', action = 'store_true', help = "analyze all states as one matrix with batched linear algebra (CPU only)")
+parser.add_argument('--chunk_size', type = int, default = 256, help = "number of states analyzed at once with --batch (default: 256)")
+parser.add_argument('--n_workers', type = int, default = 1, help = "number of processes the chunks are split across with --batch, \
+                                                        1 spreads the chunks across the threads of the CPU backend (default: 1)")
 
 args = parser.parse_args()
 
 LOAD_DIR = args.load_dir
 
 if args.gpu == -1:
-    from utils import Si, SiSi, SiSi_NN, get_Hamiltonian, getExactGroundWf, get_fidelity, distanceVecFromSubspace, diagonalize, expected_op, cov_mat
+    from utils_cpu import Si, SiSi, SiSi_NN, get_Hamiltonian, getExactGroundWf, get_fidelity, distanceVecFromSubspace, diagonalize, expected_op, cov_mat
+    from utils_cpu import set_num_threads, map_chunks
+    set_num_threads(args.n_threads)
 else:
     import cupy as cp
     from utils_gpu import Si, SiSi, SiSi_NN, get_Hamiltonian, getExactGroundWf, get_fidelity, distanceVecFromSubspace, diagonalize, expected_op, cov_mat
@@ -70,11 +79,56 @@ def match_op_name(op_name):
     else:
         raise ValueError('wrong operator notations')
 
+#operators, Hamiltonian and reference vectors shared with the worker processes of the batched analysis
+batch_ctx = {}
+
+def init_batch_worker(ctx):
+    batch_ctx.update(ctx)
+
+def get_batch_analysis(state_batch):
+    """
+    HR distances, fidelities and energies of a batch of states with batched linear algebra.
+    Same quantities as cov_mat, distanceVecFromSubspace, get_fidelity and expected_op of every state.
+
+    Args:
+        state_batch (2-D np array): states, one state per row
+
+    Returns:
+        dists, fidelities, energies (1-D np arrays)
+    """
+    operators, Ham = batch_ctx["operators"], batch_ctx["Ham"]
+    true_gnd_wf, true_ham_vec = batch_ctx["true_gnd_wf"], batch_ctx["true_ham_vec"]
+    state_batch = np.asarray(state_batch)
+    #O_k|psi> of every operator k and state, shape (n_states, n_ops, 2^N)
+    op_states = np.stack([state_batch @ op.T for op in operators], axis = 1)
+    exp_ops = np.einsum('sd,skd->sk', state_batch.conj(), op_states).real
+    #1/2 <{O_k, O_l}> = Re<O_k psi|O_l psi> for hermitian operators
+    cov = np.einsum('skd,sld->skl', op_states.conj(), op_states).real - exp_ops[:, :, None] * exp_ops[:, None, :]
+    _, hr_eig_vecs = np.linalg.eigh(cov)
+    sub_vecs = hr_eig_vecs[:, :, :args.num_eig]
+    proj = np.einsum('skn,k->sn', sub_vecs, true_ham_vec)
+    dists = np.linalg.norm(true_ham_vec - np.einsum('skn,sn->sk', sub_vecs, proj), axis = 1)
+    fidelities = ((state_batch @ true_gnd_wf.conj())**2).real
+    energies = np.einsum('sd,sd->s', state_batch.conj(), state_batch @ Ham.T).real
+    return dists, fidelities, energies
+
+def load_states(entries):
+    """
+    All states as one matrix, the memory mapped store is used as is
+    """
+    if isinstance(entries, np.ndarray):
+        return entries
+    return np.array([pickle.load(open(entry, "rb+")) for entry in entries])
+
 def main():
     title = "1-D TFIM " +str(int(args.n_qbts)) + " spins"
     #entries contain all the directories inside LOAD_DIR
     entries = list(os.scandir(LOAD_DIR))
     entries = [os.path.join(LOAD_DIR,entry.name) for entry in entries if (entry.name != "props.dat")]
+    #wavefunctions are streamed from the memory mapped store, directories of pickled wf_{i}_.dat files are still supported
+    store_path = os.path.join(LOAD_DIR, "wf_store.stvec")
+    if os.path.isfile(store_path):
+        entries, _ = open_state_store(store_path)
     if not os.path.isdir(args.save_dir):
         os.mkdir(args.save_dir)
     # get list of operators' names
@@ -105,33 +159,50 @@ def main():
         operators = cp.array(list(map(match_op_name, op_name_l)))
         true_ham_vec = cp.asarray(true_ham_vec)
     dists, fidelities, energies = [], [], []
-    GST_E = 0
-    for idx, entry in enumerate(entries):
-        state_f = pickle.load(open(entry, "rb+"))
-        if args.gpu != -1:
-            state_f = cp.asarray(state_f)
-        #FROM PROPERTY FILE WE CHECK NUMBER OF QUBITS
-        N = int(np.log2(len(state_f)))
-        assert N == args.n_qbts, "number of qubits is wrong"
-        GST_E = VQE_init_props["Ground Energy"]
-        Ham = get_Hamiltonian(N, J)
-        hr_variances, hr_eig_vecs,  = diagonalize(cov_mat(operators, state_f))
-        #sys.stdout = default_stdout
-        #SUBSPACE IS 6 DIMENSIONAL
-        print("These are varainces of Q matrix", hr_variances)
-        dist = distanceVecFromSubspace(true_ham_vec, hr_eig_vecs[:, :args.num_eig])
-        fidelity = get_fidelity(true_gnd_wf, state_f)
-        energy = expected_op(Ham, state_f).real
-        print("This is HR distance: ", dist)
-        print("This is fidelity: ", fidelity)
-        print("This is energy: ", energy)
-        energies.append(energy)
-        if args.gpu == -1:
-            dists.append(dist)
-            fidelities.append(fidelity)
+    GST_E = VQE_init_props["Ground Energy"]
+    #the Hamiltonian is the same for every state
+    Ham = get_Hamiltonian(args.n_qbts, J)
+    if args.batch:
+        assert args.gpu == -1, "batched analysis only runs on CPU"
+        states = load_states(entries)
+        assert states.shape[1] == 2**args.n_qbts, "number of qubits is wrong"
+        ctx = {"operators": operators, "Ham": Ham, "true_gnd_wf": true_gnd_wf, "true_ham_vec": true_ham_vec}
+        chunks = [states[start:start + args.chunk_size] for start in range(0, len(states), args.chunk_size)]
+        if args.n_workers > 1:
+            with mp.Pool(args.n_workers, initializer = init_batch_worker, initargs = (ctx,)) as pool:
+                results = pool.map(get_batch_analysis, [np.asarray(chunk) for chunk in chunks])
         else:
-            dists.append(dist.get())
-            fidelities.append(fidelity.get())
+            init_batch_worker(ctx)
+            results = map_chunks(get_batch_analysis, chunks)
+        dists = np.concatenate([result[0] for result in results])
+        fidelities = np.concatenate([result[1] for result in results])
+        energies = np.concatenate([result[2] for result in results])
+        print(f"Analyzed {len(states)} states, mean HR distance: {np.mean(dists)}, mean fidelity: {np.mean(fidelities)}")
+    else:
+        for idx, entry in enumerate(entries):
+            state_f = entry if isinstance(entry, np.ndarray) else pickle.load(open(entry, "rb+"))
+            if args.gpu != -1:
+                state_f = cp.asarray(state_f)
+            #FROM PROPERTY FILE WE CHECK NUMBER OF QUBITS
+            N = int(np.log2(len(state_f)))
+            assert N == args.n_qbts, "number of qubits is wrong"
+            hr_variances, hr_eig_vecs,  = diagonalize(cov_mat(operators, state_f))
+            #sys.stdout = default_stdout
+            #SUBSPACE IS 6 DIMENSIONAL
+            print("These are varainces of Q matrix", hr_variances)
+            dist = distanceVecFromSubspace(true_ham_vec, hr_eig_vecs[:, :args.num_eig])
+            fidelity = get_fidelity(true_gnd_wf, state_f)
+            energy = expected_op(Ham, state_f).real
+            print("This is HR distance: ", dist)
+            print("This is fidelity: ", fidelity)
+            print("This is energy: ", energy)
+            energies.append(energy)
+            if args.gpu == -1:
+                dists.append(dist)
+                fidelities.append(fidelity)
+            else:
+                dists.append(dist.get())
+                fidelities.append(fidelity.get())
     #NOW START PLOTTING
     colors = [[random.uniform(0, 1),random.uniform(0, 1),col] for col in np.linspace(0, 1, len(entries))]
     plt.figure(figsize=(10, 10), dpi=300)
@@ -285,3 +285,28 @@ def get_noisy_energy(state_f, X_i_cache, ZZ_i_cache, shots, J):
         ZZ_i_noise = noisy_partial_energy(ZZ_i_exact, shots)
         E_noise += J*ZZ_i_noise
     return E_noise
+
+def get_perturbed_wf_batch(ground_wf, batch_size, rng):
+    """
+    Batch of randomly perturbed ground states, vectorized version of the perturbation of
+    1D_TFIM_random_no_periodic.py: for a random R in [1, 2^N), the amplitudes at the even
+    positions 0, 2, ... < R of a random permutation are multiplied by (1 - r) with r ~ U[0, 1)
+
+    Args:
+        ground_wf (1-D numpy array): ground state wavefunction
+        batch_size (int): number of perturbed states B
+        rng (np.random.Generator): random number generator
+
+    Returns:
+        wf_batch (2-D numpy array): normalized perturbed states of shape (B, 2^N)
+    """
+    dim = len(ground_wf)
+    #even positions of a random permutation of the indices for every state of the batch
+    perm = np.argsort(rng.random((batch_size, dim)), axis = 1)[:, ::2]
+    n_perturbed = (rng.integers(1, dim, size = batch_size) + 1) // 2
+    factor = 1 - rng.random(perm.shape)
+    factor[np.arange(perm.shape[1]) >= n_perturbed[:, None]] = 1
+    scale = np.ones((batch_size, dim))
+    np.put_along_axis(scale, perm, factor, axis = 1)
+    wf_batch = scale * ground_wf
+    return wf_batch / np.linalg.norm(wf_batch, axis = 1, keepdims = True)
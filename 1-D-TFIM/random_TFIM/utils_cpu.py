@@ -0,0 +1,78 @@
+"""
+Multi-threaded CPU backend with the same API as utils.py and utils_gpu.py.
+
+Operators are the dense matrices of utils.py. Single products (op @ wf) are parallelized by the
+multi-threaded BLAS of numpy. map_chunks spreads independent chunks (stacks of states) across a
+thread pool; numpy releases the GIL inside matmul, einsum and eigh, so the threads run on separate
+cores, with BLAS limited to one thread per chunk by threadpoolctl so the cores are not oversubscribed.
+Without threadpoolctl the BLAS threads can't be limited at run time, and the chunks run one after
+the other on the BLAS threads instead. cov_mat applies every operator to the state once instead of
+multiplying pairs of 2^N x 2^N operators.
+"""
+
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+from utils import Si, SiSi, SiSi_NN, get_Hamiltonian, getExactGroundWf, get_fidelity, distanceVecFromSubspace, diagonalize
+
+n_threads = os.cpu_count()
+executor = None
+
+def set_num_threads(num_threads):
+    """
+    Set the number of threads of the backend (default: number of cores), i.e. of the chunk pool and,
+    with threadpoolctl, of BLAS
+    """
+    global n_threads, executor
+    n_threads = max(1, int(num_threads))
+    if threadpool_limits is not None:
+        threadpool_limits(limits = n_threads, user_api = "blas")
+    if executor is not None:
+        executor.shutdown()
+        executor = None
+
+def get_executor():
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(n_threads)
+    return executor
+
+def map_chunks(func, chunks):
+    """
+    list(map(func, chunks)) with the chunks spread across the threads, each with a single-threaded BLAS
+    """
+    if n_threads == 1 or len(chunks) == 1 or threadpool_limits is None:
+        return [func(chunk) for chunk in chunks]
+    with threadpool_limits(limits = 1, user_api = "blas"):
+        return list(get_executor().map(func, chunks))
+
+def expected_op(op, wf):
+    """
+    Returns expected value of operator op, given a wavefunction wf
+
+    Args:
+        op (2-D np array): matrix that corresponds to an operator
+        wf (1-D np array): array that corresponds to wave vector
+    """
+    return np.vdot(wf, op @ wf).real
+
+def cov_mat(ops_l, wf):
+    """
+    ops_l: list of hermitian operators
+    wf: wave function used to calculate expected value of operators in ops_l
+
+    1/2 <O1 O2 + O2 O1> is Re<O1 wf|O2 wf>, so every operator is applied to wf only once
+    """
+    ops_n = len(ops_l)
+    op_wf_l = [op @ wf for op in ops_l]
+    exp_l = [np.vdot(wf, op_wf).real for op_wf in op_wf_l]
+    Q = np.zeros((ops_n, ops_n), dtype=float)
+    for i1 in range(ops_n):
+        for i2 in range(i1, ops_n):
+            Q[i1, i2] = np.vdot(op_wf_l[i1], op_wf_l[i2]).real - exp_l[i1]*exp_l[i2]
+            Q[i2, i1] = Q[i1, i2]
+    return Q
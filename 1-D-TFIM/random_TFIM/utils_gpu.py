@@ -0,0 +1,61 @@
+"""
+cupy backend with the same API as utils.py and utils_cpu.py.
+Operators are built with utils.py and moved to the current cupy device once.
+"""
+
+import cupy as cp
+import utils
+
+def Si(ops, N_qbts):
+    return cp.asarray(utils.Si(ops, N_qbts))
+
+def SiSi(ops, N_qbts):
+    return cp.asarray(utils.SiSi(ops, N_qbts))
+
+def SiSi_NN(ops, N_qbts):
+    return cp.asarray(utils.SiSi_NN(ops, N_qbts))
+
+def get_Hamiltonian(N_qubits, J):
+    return cp.asarray(utils.get_Hamiltonian(N_qubits, J))
+
+def getExactGroundWf(N_qubits, J):
+    return cp.asarray(utils.getExactGroundWf(N_qubits, J))
+
+def get_fidelity(wf1, wf2):
+    fid = cp.matmul(cp.conj(wf1), wf2)**2
+    return fid.real
+
+def distanceVecFromSubspace(w, A):
+    """
+    Get L2 norm of distance from w to subspace spanned by columns of A
+    """
+    Q, _ = cp.linalg.qr(A)
+    r = Q @ (Q.T @ w)
+    return cp.linalg.norm(r-w)
+
+def diagonalize(mat):
+    """
+    diagonalize matrix
+    return sorted eigenvalues and eigen vectors
+    """
+    val, vec = cp.linalg.eigh(cp.asarray(mat))
+    argsort = cp.argsort(val)
+    return val[argsort], vec[:, argsort]
+
+def expected_op(op, wf):
+    return cp.vdot(wf, op @ wf).real
+
+def cov_mat(ops_l, wf):
+    """
+    ops_l: list of hermitian operators
+    wf: wave function used to calculate expected value of operators in ops_l
+    """
+    ops_n = len(ops_l)
+    op_wf_l = [op @ wf for op in ops_l]
+    exp_l = [cp.vdot(wf, op_wf).real for op_wf in op_wf_l]
+    Q = cp.zeros((ops_n, ops_n), dtype=float)
+    for i1 in range(ops_n):
+        for i2 in range(i1, ops_n):
+            Q[i1, i2] = cp.vdot(op_wf_l[i1], op_wf_l[i2]).real - exp_l[i1]*exp_l[i2]
+            Q[i2, i1] = Q[i1, i2]
+    return Q
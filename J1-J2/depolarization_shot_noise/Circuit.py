@@ -1,7 +1,5 @@
 import sys
 sys.path.insert(0, "../")
-import qiskit
-from qiskit import QuantumCircuit, Aer
 import numpy as np
 from depolarization_shot_noise.utils import get_nearest_neighbors, flatten_neighbor_l
 
@@ -42,6 +40,8 @@ def ALA(circ, N_qubits, var_params, h_l, n_layers):
     return circ
 
 def Q_Circuit(m, n, var_params, h_l, n_layers, ansatz_type):
+    #qiskit is imported on the first circuit, so the scripts that only read stored measurements start without it
+    from qiskit import QuantumCircuit
     N_qubits = m * n
     circ = QuantumCircuit(N_qubits, N_qubits)
     if ansatz_type == "ALA":
@@ -1,24 +1,21 @@
 import sys
 sys.path.insert(0, "../")
-import qiskit
-from qiskit import QuantumCircuit, Aer
-from qiskit_aer.noise import NoiseModel, depolarizing_error
-from qiskit_aer import AerSimulator
-from qiskit.visualization import plot_histogram
-from qiskit.tools.monitor import job_monitor
-from azure.quantum.qiskit import AzureQuantumProvider
-from qiskit import transpile
 import numpy as np
 import argparse
 import pickle
-import matplotlib.pyplot as plt
 import os
 from depolarization_shot_noise.Circuit import Q_Circuit
-from depolarization_shot_noise.utils import expectation_X, get_NN_coupling, get_nNN_coupling, get_exp_cross
-from depolarization_shot_noise.utils import flatten_neighbor_l, get_nearest_neighbors, get_next_nearest_neighbors
-from depolarization_shot_noise.utils import distanceVecFromSubspace, get_Hamiltonian, get_fidelity
+from depolarization_shot_noise.utils import get_HR_dist_from_counts, get_fidelity
+from depolarization_shot_noise.symmetry import get_sector_gst
+from depolarization_shot_noise.utils import load_ledger, update_ledger, is_job_failed, save_atomic, dump_atomic, subsample_counts
+from depolarization_shot_noise import timing, sampling_profiler
 
 HR_dist_hist = []
+#checkpoint ledger of the sweep: (param_idx, basis) -> latest ledger entry
+ledger = {}
+#backends by (backend name, p1, p2), built on the first circuit run
+backend_cache = {}
+rng = np.random.default_rng()
 
 def get_args(parser):
     parser.add_argument('--input_dir', type = str, help = "directory where VQE_hyperparam_dict.npy exists. HR distances and plots will be stored in the input_dir")
@@ -29,42 +26,122 @@ def get_args(parser):
                                 to load the parameter index list to measure corresponding HR distances")
     parser.add_argument('--p1', type = float, default = 0.0, help = "one-qubit gate depolarization noise (default: 0.0)")
     parser.add_argument('--p2', type = float, default = 0.0, help = "two-qubit gate depolarization noise (default: 0.0)")
+    parser.add_argument('--subsample_from', type = int, default = None, help = "draw the shots without replacement from the stored measurements with SUBSAMPLE_FROM shots \
+                                (run once if they are not stored yet) instead of running the circuits with --shots, e.g. for shot convergence studies")
+    parser.add_argument('--seed', type = int, default = None, help = "seed of the shot sampling with --subsample_from (default: None)")
+    parser.add_argument('--n_replicates', type = int, default = None, help = "with --subsample_from, draw N_REPLICATES independent subsamples of every basis in one call \
+                                and record one HR distance per replicate (default: None, a single subsample)")
+    parser.add_argument('--reuse_VQE_counts', action = 'store_true', help = "read the Z and X basis counts from input_dir/measurement/VQE (VQE --save_counts) \
+                                and only run the Hadamard basis circuits. Only compatible with aer_simulator backend and the VQE p1 and p2")
+    parser.add_argument('--timing', action = 'store_true', help = "time the stages of every HR point and fidelity and write HR_{shots}shots_{backend}_p1_{p1}_p2_{p2}_timing.json/csv to input_dir")
+    parser.add_argument('--profile', action = 'store_true', help = "sample the call stacks and write HR_{shots}shots_{backend}_p1_{p1}_p2_{p2}_profile.collapsed (flamegraph/speedscope) to input_dir, also on with SAMPLING_PROFILE=1")
     args = parser.parse_args()
     return args
 
+def get_noise_model(p1, p2):
+    from qiskit_aer.noise import NoiseModel, depolarizing_error
+    noise_model = NoiseModel()
+    p1_error = depolarizing_error(p1, 1)
+    p2_error = depolarizing_error(p2, 2)
+    noise_model.add_all_qubit_quantum_error(p1_error, ['h','ry'])
+    noise_model.add_all_qubit_quantum_error(p2_error, ['cx'])
+    return noise_model
+
+def get_backend(backend_name, p1, p2):
+    """
+    qiskit_aer and the Azure SDK are only imported here, so a sweep whose measurements are all stored
+    does not load them before the fidelity
+    """
+    key = (backend_name, p1, p2)
+    if key not in backend_cache:
+        if backend_name == "aer_simulator":
+            from qiskit_aer import AerSimulator
+            if p1 == 0 and p2 == 0:
+                backend_cache[key] = AerSimulator()
+            else:
+                backend_cache[key] = AerSimulator(noise_model = get_noise_model(p1, p2))
+        else:
+            from azure.quantum.qiskit import AzureQuantumProvider
+            provider = AzureQuantumProvider(resource_id = "/subscriptions/58687a6b-a9bd-4f79-b7af-1f8f76760d4b/resourceGroups/AzureQuantum/providers/Microsoft.Quantum/Workspaces/HamiltonianReconstruction",\
+                                            location = "West US")
+            backend_cache[key] = provider.get_backend(backend_name)
+    return backend_cache[key]
+
 def get_measurement(n_qbts, var_params, backend, h_l, hyperparam_dict, param_idx):
     num_shots = hyperparam_dict["shots"]
     backendnm = hyperparam_dict["backend"]
     p1, p2 = hyperparam_dict["p1"], hyperparam_dict["p2"]
-    measurement_path = os.path.join(args.input_dir, "measurement",f"{num_shots}_shots_{backendnm}_p1_{p1}_p2_{p2}", f"{param_idx}th_param_{''.join([str(e) for e in h_l])}qbt_h_gate.npy")
+    basis = ''.join([str(e) for e in h_l])
+    if hyperparam_dict["subsample_from"] is not None:
+        #shots drawn without replacement from the measurement with subsample_from shots, which is run once and stored
+        measurement = get_measurement(n_qbts, var_params, backend, h_l, {**hyperparam_dict, "shots": hyperparam_dict["subsample_from"], "subsample_from": None}, param_idx)
+        with timing.stage("subsample"):
+            measurement = subsample_counts(measurement, hyperparam_dict["shots"], rng, hyperparam_dict["n_replicates"])
+        timing.count("subsampled_counts")
+        return measurement
+    if args.reuse_VQE_counts and len(h_l) in (0, n_qbts):
+        #Z and X basis counts of the VQE energy evaluation of this param_idx (VQE shots)
+        VQE_path = os.path.join(args.input_dir, "measurement", "VQE", f"{param_idx}th_param_{basis}qbt_h_gate.npy")
+        if os.path.exists(VQE_path):
+            with timing.stage("load"):
+                measurement = np.load(VQE_path, allow_pickle = True).item()
+            timing.count("reused_VQE_counts")
+            return measurement
+    measurement_path = os.path.join(args.input_dir, "measurement",f"{num_shots}_shots_{backendnm}_p1_{p1}_p2_{p2}", f"{param_idx}th_param_{basis}qbt_h_gate.npy")
+    ledger_path = os.path.join(os.path.dirname(measurement_path), "ledger.jsonl")
+    entry = ledger.get((int(param_idx), basis))
     if os.path.exists(measurement_path):
         #no need to save as it is already saved
-        measurement = np.load(measurement_path, allow_pickle = "True").item()
+        with timing.stage("load"):
+            measurement = np.load(measurement_path, allow_pickle = "True").item()
+        if entry is None or entry["status"] != "done":
+            update_ledger(ledger_path, ledger, param_idx, basis, "done", path = measurement_path)
+        return measurement
+    if backend is None:
+        backend = get_backend(backendnm, p1, p2)
+    if entry is not None and entry["status"] == "submitted":
+        #job is already submitted (and paid for), so retrieve it instead of resubmitting
+        try:
+            job = backend.retrieve_job(entry["job_id"])
+        except Exception as err:
+            #the job stays "submitted" with the error, so the next run retries the retrieve
+            update_ledger(ledger_path, ledger, param_idx, basis, "submitted", job_id = entry["job_id"], error = str(err))
+            raise
     else:
         m, n = hyperparam_dict["m"], hyperparam_dict["n"]
-        circ = Q_Circuit(m, n, var_params, h_l, hyperparam_dict["n_layers"], hyperparam_dict["ansatz_type"])
-        circ.measure(list(range(n_qbts)), list(range(n_qbts)))
-        circ = transpile(circ, backend)
-        job = backend.run(circ, shots = num_shots)
+        with timing.stage("circuit"):
+            circ = Q_Circuit(m, n, var_params, h_l, hyperparam_dict["n_layers"], hyperparam_dict["ansatz_type"])
+            circ.measure(list(range(n_qbts)), list(range(n_qbts)))
+        with timing.stage("transpile"):
+            from qiskit import transpile
+            circ = transpile(circ, backend)
+        with timing.stage("backend.run"):
+            job = backend.run(circ, shots = num_shots)
+        timing.count("circuits")
         if backendnm != "aer_simulator":
-            job_id = job.id()
-            job_monitor(job)
-        result = job.result()
+            entry = update_ledger(ledger_path, ledger, param_idx, basis, "submitted", job_id = job.id())
+    try:
+        with timing.stage("backend.run"):
+            if backendnm != "aer_simulator":
+                from qiskit.tools.monitor import job_monitor
+                job_monitor(job)
+            result = job.result()
+    except Exception as err:
+        #a submitted (paid) job stays "submitted" after a polling or network error, so the next run retrieves it again
+        if entry is None or entry["status"] != "submitted" or is_job_failed(job):
+            update_ledger(ledger_path, ledger, param_idx, basis, "failed", job_id = None if entry is None else entry.get("job_id"), error = str(err))
+        raise
+    with timing.stage("counts"):
         measurement = dict(result.get_counts())
-        np.save(measurement_path, measurement)
+    with timing.stage("save"):
+        save_atomic(measurement_path, measurement)
+        update_ledger(ledger_path, ledger, param_idx, basis, "done", path = measurement_path)
     return measurement
 
 def get_params(params_dir_path, param_idx):
     var_params = np.load(os.path.join(params_dir_path, f"var_params_{param_idx}.npy"))
     return var_params
 
-def get_measurement_index_l(h_idx, z_indices):
-    m_index_l = []
-    for zi, zj in z_indices:
-        if h_idx != zi and h_idx != zj:
-            m_index_l.append([h_idx, zi, zj])
-    return m_index_l
-
 def get_fid(hyperparam_dict, param_idx, params_dir_path, ground_state, backend):
     var_params = get_params(params_dir_path, param_idx)
     m, n = hyperparam_dict["m"], hyperparam_dict["n"]
@@ -83,55 +160,23 @@ def get_fid(hyperparam_dict, param_idx, params_dir_path, ground_state, backend):
     return fid.real
 
 def get_HR_distance(hyperparam_dict, param_idx, params_dir_path, backend):
-    cov_mat = np.zeros((3,3))
     m, n = hyperparam_dict["m"],  hyperparam_dict["n"]
     n_qbts = m * n
     z_l, x_l = [], [i for i in range(n_qbts)]
     var_params = get_params(params_dir_path, param_idx)
     z_m = get_measurement(n_qbts, var_params, backend, z_l, hyperparam_dict, param_idx)
     x_m = get_measurement(n_qbts, var_params, backend, x_l, hyperparam_dict, param_idx)
-    exp_X, exp_NN, exp_nNN = expectation_X(x_m, 1), get_NN_coupling(z_m, m, n, 1), get_nNN_coupling(z_m, m, n, 1)
-
-    #diagonal terms
-    cov_mat[0, 0] = expectation_X(x_m, 2) - exp_X**2
-    cov_mat[1, 1] = get_NN_coupling(z_m, m, n, 2) - exp_NN**2
-    cov_mat[2, 2] = get_nNN_coupling(z_m, m, n, 2) - exp_nNN**2
-
-    #cross terms
-    NN_index_l = flatten_neighbor_l(get_nearest_neighbors(m, n), m, n)
-    nNN_index_l = flatten_neighbor_l(get_next_nearest_neighbors(m, n), m, n)
-    NN_nNN_val = - (exp_NN * exp_nNN)
-
-    for NN_indices in NN_index_l:
-        for nNN_indices in nNN_index_l:
-            indices = NN_indices + nNN_indices
-            NN_nNN_val += get_exp_cross(z_m, indices)
-
-    cov_mat[1, 2], cov_mat[2, 1]= NN_nNN_val, NN_nNN_val
-    X_NN_val = -(exp_X * exp_NN)
-    X_nNN_val = -(exp_X * exp_nNN)
-
-    for h_idx in range(n_qbts):
-        h_l = [h_idx]
-        cross_m = get_measurement(n_qbts, var_params, backend, h_l, hyperparam_dict, param_idx)
-        X_NN_index_l = get_measurement_index_l(h_idx, NN_index_l)
-        X_nNN_index_l = get_measurement_index_l(h_idx, nNN_index_l)
-        for indices in X_NN_index_l:
-            X_NN_val += get_exp_cross(cross_m, indices)
-        for indices in X_nNN_index_l:
-            X_nNN_val += get_exp_cross(cross_m, indices)
-    cov_mat[0, 1] = X_NN_val
-    cov_mat[0, 2] = X_nNN_val
-    cov_mat[2, 0], cov_mat[1, 0] = cov_mat[0, 2], cov_mat[0, 1]
-    val, vec = np.linalg.eigh(cov_mat)
-    argsort = np.argsort(val)
-    val, vec = val[argsort], vec[:, argsort]
-    orig_H = np.array([1, hyperparam_dict["J1"], hyperparam_dict["J2"]])
-    orig_H = orig_H/np.linalg.norm(orig_H)
-    HR_dist = distanceVecFromSubspace(orig_H, vec[:, :1])
+    cross_m_l = [get_measurement(n_qbts, var_params, backend, [h_idx], hyperparam_dict, param_idx) for h_idx in range(n_qbts)]
+    with timing.stage("estimators"):
+        if hyperparam_dict["n_replicates"] is not None:
+            #every basis holds n_replicates subsamples, one HR distance per replicate
+            return [float(get_HR_dist_from_counts(z_m[r], x_m[r], [cross_m[r] for cross_m in cross_m_l], m, n, hyperparam_dict["J1"], hyperparam_dict["J2"]))
+                    for r in range(hyperparam_dict["n_replicates"])]
+        HR_dist = get_HR_dist_from_counts(z_m, x_m, cross_m_l, m, n, hyperparam_dict["J1"], hyperparam_dict["J2"])
     return HR_dist
 
 def main(args):
+    global rng
     if not os.path.exists(os.path.join(args.input_dir,"VQE_hyperparam_dict.npy")):
         raise ValueError( "input directory must be a valid input path that contains VQE_hyperparam_dict.npy")
     if not os.path.isdir(os.path.join(args.input_dir, "HR_dist_hist")):
@@ -157,58 +202,59 @@ def main(args):
 
     if args.use_VQE_p1_p2:
         hyperparam_dict["p1"], hyperparam_dict["p2"] = VQE_hyperparam_dict["p1"], VQE_hyperparam_dict["p2"]
-
+    if args.reuse_VQE_counts:
+        assert args.backend == "aer_simulator" and (hyperparam_dict["p1"], hyperparam_dict["p2"]) == (VQE_hyperparam_dict["p1"], VQE_hyperparam_dict["p2"]), \
+            "VQE counts can only be reused on aer_simulator with the VQE p1 and p2 values"
+    hyperparam_dict["reuse_VQE_counts"] = args.reuse_VQE_counts
+    if args.subsample_from is not None:
+        assert args.subsample_from >= args.shots, "subsample_from must be at least the number of shots"
+    hyperparam_dict["subsample_from"] = args.subsample_from
+    assert args.n_replicates is None or args.subsample_from is not None, "n_replicates needs subsample_from"
+    hyperparam_dict["n_replicates"] = args.n_replicates
+    rng = np.random.default_rng(args.seed)
 
     print("This is hyperparameter dictionary newly constructed: ", hyperparam_dict)
     #set the most updated p1 and p2 for updated purposes
     p1, p2 = hyperparam_dict["p1"], hyperparam_dict["p2"]
-    #create noise_model to use it when simulating fidelity
-    noise_model = NoiseModel()
-    p1_error = depolarizing_error(p1, 1)
-    p2_error = depolarizing_error(p2, 2)
-    noise_model.add_all_qubit_quantum_error(p1_error, ['h','ry'])
-    noise_model.add_all_qubit_quantum_error(p2_error, ['cx'])
-
-    if args.backend == "aer_simulator":
-        if hyperparam_dict["p1"] == 0 and hyperparam_dict["p2"] == 0:
-            backend = AerSimulator()
-        else:
-            backend = AerSimulator(noise_model = noise_model)
-    else:
-        provider = AzureQuantumProvider(resource_id = "/subscriptions/58687a6b-a9bd-4f79-b7af-1f8f76760d4b/resourceGroups/AzureQuantum/providers/Microsoft.Quantum/Workspaces/HamiltonianReconstruction",\
-                                        location = "West US")
-        backend = provider.get_backend(args.backend)
-
-    if not os.path.isdir(os.path.join(args.input_dir, "measurement", f"{args.shots}_shots_{args.backend}_p1_{p1}_p2_{p2}")):
-        os.makedirs(os.path.join(args.input_dir, "measurement", f"{args.shots}_shots_{args.backend}_p1_{p1}_p2_{p2}"))
-
-    np.save(os.path.join(args.input_dir, "HR_hyperparam_dict", f"{args.shots}_shots_{args.backend}_p1_{p1}_p2_{p2}.npy"), hyperparam_dict)
+    #built by get_backend when a measurement is not stored yet
+    backend = None
+
+    #subsampled measurements are not stored, the circuits only run (and are stored) with subsample_from shots
+    measurement_shots = args.shots if args.subsample_from is None else args.subsample_from
+    measurement_dir = os.path.join(args.input_dir, "measurement", f"{measurement_shots}_shots_{args.backend}_p1_{p1}_p2_{p2}")
+    if not os.path.isdir(measurement_dir):
+        os.makedirs(measurement_dir)
+    shots_nm = f"{args.shots}" if args.subsample_from is None else f"{args.shots}_of_{args.subsample_from}"
+    #reused VQE counts carry the VQE shots in the Z and X bases, so their HR distances are kept apart from the ones of plain runs
+    reuse_nm = "_reuseVQE" if args.reuse_VQE_counts else ""
+    #subsampled HR distances depend on the seed and the number of replicates
+    subsample_nm = "" if args.subsample_from is None else f"_seed{args.seed}" + ("" if args.n_replicates is None else f"_{args.n_replicates}reps")
+
+    np.save(os.path.join(args.input_dir, "HR_hyperparam_dict", f"{shots_nm}_shots{subsample_nm}{reuse_nm}_{args.backend}_p1_{p1}_p2_{p2}.npy"), hyperparam_dict)
+    if args.timing:
+        timing.enable(args.input_dir, f"HR_{args.shots}shots_{args.backend}_p1_{p1}_p2_{p2}")
+    sampling_profiler.start(args.input_dir, f"HR_{args.shots}shots_{args.backend}_p1_{p1}_p2_{p2}", sampling_profiler.DEFAULT_INTERVAL if args.profile else None)
 
     with open(os.path.join(args.input_dir, "E_hist.pkl"), "rb") as fp:
         E_hist = pickle.load(fp)
 
     if args.param_idx_l:
         fid_hist_filename = f"fid_param_idx_l_p1_{p1}_p2_{p2}.pkl"
-        HR_dist_hist_filename =  f"HR_param_idx_l_{args.shots}shots_{args.backend}_p1_{p1}_p2_{p2}.pkl"
-        img_name = f"layers_shots_param_idx_l_{args.shots}_p1_{p1}_p2_{p2}_HR_dist.png"
+        HR_dist_hist_filename =  f"HR_param_idx_l_{shots_nm}shots{subsample_nm}{reuse_nm}_{args.backend}_p1_{p1}_p2_{p2}.pkl"
+        img_name = f"layers_shots_param_idx_l_{shots_nm}{subsample_nm}{reuse_nm}_p1_{p1}_p2_{p2}_HR_dist.png"
     else:
         fid_hist_filename = f"fid_p1_{p1}_p2_{p2}.pkl"
-        HR_dist_hist_filename =  f"HR_{args.shots}shots_{args.backend}_p1_{p1}_p2_{p2}.pkl"
-        img_name = f"layers_shots_{args.shots}_p1_{p1}_p2_{p2}_HR_dist.png"
+        HR_dist_hist_filename =  f"HR_{shots_nm}shots{subsample_nm}{reuse_nm}_{args.backend}_p1_{p1}_p2_{p2}.pkl"
+        img_name = f"layers_shots_{shots_nm}{subsample_nm}{reuse_nm}_p1_{p1}_p2_{p2}_HR_dist.png"
 
     gst_E = hyperparam_dict["gst_E"]
     m, n = hyperparam_dict["m"], hyperparam_dict["n"]
     J1, J2 = hyperparam_dict["J1"], hyperparam_dict["J2"]
     n_layers = hyperparam_dict["n_layers"]
 
-    #get ground state NEED TO DELETE THIS LINE THO --> PROBABLY JUST GET IT WHEN VQE
-    Hamiltonian = get_Hamiltonian(m, n, J1, J2)
-    eigen_vals, eigen_vecs = np.linalg.eig(Hamiltonian)
-    argmin_idx = np.argmin(eigen_vals)
-    gst_E, ground_state = np.real(eigen_vals[argmin_idx]), eigen_vecs[:, argmin_idx]
+    #get ground state from the reflection and parity block
+    gst_E, ground_state = get_sector_gst(m, n, J1, J2)
 
-    NN_index_l= flatten_neighbor_l(get_nearest_neighbors(m, n), m, n)
-    nNN_index_l= flatten_neighbor_l(get_next_nearest_neighbors(m, n), m, n)
 
     HR_dist_hist = []
     fid_hist = []
@@ -220,30 +266,45 @@ def main(args):
     else:
         param_idx_l = list(range(len(E_hist)))
 
+    #restart the sweep exactly where it stopped
+    ledger_path = os.path.join(measurement_dir, "ledger.jsonl")
+    ledger.update(load_ledger(ledger_path))
+    HR_key = "HR" if args.subsample_from is None and not args.reuse_VQE_counts else f"HR_{shots_nm}shots{subsample_nm}{reuse_nm}"
+
     for param_idx in param_idx_l:
-        HR_dist = get_HR_distance(hyperparam_dict, param_idx, params_dir_path, backend)
+        entry = ledger.get((int(param_idx), HR_key))
+        if entry is not None and entry["status"] == "done":
+            print(f"HR distance for {param_idx}th param already in ledger: ", entry["HR_dist"])
+            continue
+        with timing.stage("get_HR_distance"):
+            HR_dist = get_HR_distance(hyperparam_dict, param_idx, params_dir_path, backend)
+        timing.count("HR_points")
         print(f"This is HR distance: {HR_dist} for {param_idx}th param")
-        HR_dist_hist.append(HR_dist)
-        with open(os.path.join(args.input_dir, f"HR_dist_hist", HR_dist_hist_filename), "wb") as fp:
-            pickle.dump(HR_dist_hist, fp)
+        update_ledger(ledger_path, ledger, param_idx, HR_key, "done", HR_dist = HR_dist)
+    HR_dist_hist = [ledger[(int(param_idx), HR_key)]["HR_dist"] for param_idx in param_idx_l]
+    dump_atomic(os.path.join(args.input_dir, f"HR_dist_hist", HR_dist_hist_filename), HR_dist_hist)
 
     #fid_hist
     if not os.path.isdir(os.path.join(args.input_dir, "fid_hist")):
         os.makedirs(os.path.join(args.input_dir, "fid_hist"))
 
     #backend initialization for fidelity
+    from qiskit_aer import AerSimulator
     if p1 == 0 and p2 == 0:
         fid_backend = AerSimulator()
     else:
-        fid_backend = AerSimulator(method = 'density_matrix', noise_model = noise_model)
+        fid_backend = AerSimulator(method = 'density_matrix', noise_model = get_noise_model(p1, p2))
 
     for param_idx in param_idx_l:
-        fid  = get_fid(hyperparam_dict, param_idx, params_dir_path, ground_state, fid_backend)
+        with timing.stage("get_fid"):
+            fid  = get_fid(hyperparam_dict, param_idx, params_dir_path, ground_state, fid_backend)
+        timing.count("fid_points")
         print(f"This is fidelity: {fid} for {param_idx}th param")
         fid_hist.append(fid)
         with open(os.path.join(args.input_dir, "fid_hist", fid_hist_filename), "wb") as fp:
             pickle.dump(fid_hist, fp)
 
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots()
     VQE_steps = np.array(list(range(len(E_hist))))
     ax.scatter(VQE_steps, E_hist, c = 'b', alpha = 0.8, marker = ".", label = "Energy")
@@ -256,7 +317,8 @@ def main(args):
         title = title + '\n' + f"p1: {p1}, p2: {p2}"
     plt.title(title, fontdict = {'fontsize' : 15})
     ax2 = ax.twinx()
-    ax2.scatter(param_idx_l, HR_dist_hist, c = 'r', alpha = 0.8, marker=".", label = "HR distance")
+    #mean over the replicates of --n_replicates
+    ax2.scatter(param_idx_l, [np.mean(HR_dist) for HR_dist in HR_dist_hist], c = 'r', alpha = 0.8, marker=".", label = "HR distance")
     ax2.scatter(param_idx_l, fid_hist, c = 'g', alpha = 0.8, marker=".", label = "Fidelity")
     ax2.set_ylabel("HR distance | Fidelity")
     ax2.legend(bbox_to_anchor=(1.28, 1.22), fontsize = 10)
@@ -2,21 +2,22 @@ import sys
 sys.path.insert(0, "../")
 import numpy as np
 import os
-from qiskit import QuantumCircuit
-from qiskit.algorithms.optimizers import IMFIL
-from qiskit_aer.noise import NoiseModel, depolarizing_error
-from qiskit_aer import AerSimulator
-from qiskit import transpile
-from qiskit.tools.monitor import job_monitor
+from scipy.optimize import minimize
 import argparse
 from functools import partial
 import pickle
-import matplotlib.pyplot as plt
-from depolarization_shot_noise.utils import get_Hamiltonian, expectation_X, get_NN_coupling, get_nNN_coupling
-from depolarization_shot_noise.utils import get_nearest_neighbors
+from depolarization_shot_noise.utils import expectation_X, get_NN_coupling, get_nNN_coupling
+from depolarization_shot_noise.utils import get_nearest_neighbors, get_param_shift_l, get_param_shift_grad
+from depolarization_shot_noise.utils import get_HR_dist_from_counts, save_atomic, dump_atomic
 from depolarization_shot_noise.Circuit import Q_Circuit
+from depolarization_shot_noise.symmetry import get_sector_gst
+from depolarization_shot_noise import timing, sampling_profiler, eval_cache
 
 E_hist = []
+#(param_idx, HR distance) of the HR monitor
+HR_monitor = []
+#transpiled parameterized circuits, one per measurement basis, reused by every batched job
+circ_template_dict = {}
 
 def get_args(parser):
     parser.add_argument('--m', type = int, help = "number of qubits in a row")
@@ -31,44 +32,192 @@ def get_args(parser):
     parser.add_argument('--init_param', type = str, default = "NONE", help = "parameters for initialization (default: NONE)")
     parser.add_argument('--p1', type = float, default = 0.0, help = "1 qubit gate depolarization noise (default: 0.0)")
     parser.add_argument('--p2', type = float, default = 0.0, help = "2 qubit gate depolarization noise (default: 0.0)")
+    parser.add_argument('--optimizer', type = str, default = "IMFIL", help = "optimizer (IMFIL, ADAM, L_BFGS_B). ADAM and L_BFGS_B use parameter-shift gradients (default: IMFIL)")
+    parser.add_argument('--lr', type = float, default = 0.05, help = "learning rate of ADAM optimizer (default: 0.05)")
+    parser.add_argument('--timing', action = 'store_true', help = "time the stages of every energy evaluation and write VQE_timing.json/csv to output_dir")
+    parser.add_argument('--profile', action = 'store_true', help = "sample the call stacks and write VQE_profile.collapsed (flamegraph/speedscope) to output_dir, also on with SAMPLING_PROFILE=1")
+    parser.add_argument('--eval_cache_size', type = int, default = 256, help = "number of energy evaluations kept by parameter vector, 0 turns the cache off. Shot-noise evaluations are only kept with --reuse_shot_evals (default: 256)")
+    parser.add_argument('--eval_cache', type = str, default = None, help = "pickle file the evaluation cache (energies and counts) is loaded from and written to at exit (default: memory only)")
+    parser.add_argument('--save_counts', action = 'store_true', help = "keep the Z and X basis counts of every energy evaluation in output_dir/measurement/VQE, \
+                                so the HR script (--reuse_VQE_counts) only runs the Hadamard basis circuits")
+    parser.add_argument('--HR_every', type = int, default = 0, help = "compute the HR distance every HR_every energy evaluations from their Z and X counts and the \
+                                Hadamard basis circuits, and stop once it plateaus (written to HR_monitor.pkl). 0 turns it off (default: 0)")
+    parser.add_argument('--HR_shots', type = int, default = None, help = "shots of the Hadamard basis circuits of the HR monitor (default: --shots)")
+    parser.add_argument('--HR_patience', type = int, default = 5, help = "stop when the HR distance did not improve by HR_tol in the last HR_patience checks (default: 5)")
+    parser.add_argument('--HR_tol', type = float, default = 0.005, help = "HR distance improvement of the HR monitor (default: 0.005)")
+    parser.add_argument('--reuse_shot_evals', action = 'store_true', help = "also reuse stored shot-noise evaluations of a repeated parameter vector (its shot noise is then repeated)")
     args = parser.parse_args()
     return args
 
 def get_measurement(h_dict, var_params, backend_noise, h_l):
     m, n = h_dict["m"], h_dict["n"]
     n_qbts = m * n
-    circ = Q_Circuit(m, n, var_params, h_l, h_dict["n_layers"], h_dict["ansatz_type"])
-    circ.measure(list(range(n_qbts)), list(range(n_qbts)))
-    circ = transpile(circ, backend_noise)
-    job = backend_noise.run(circ, shots = h_dict["shots"])
-    result = job.result()
-    measurement = dict(result.get_counts())
+    with timing.stage("circuit"):
+        circ = Q_Circuit(m, n, var_params, h_l, h_dict["n_layers"], h_dict["ansatz_type"])
+        circ.measure(list(range(n_qbts)), list(range(n_qbts)))
+    with timing.stage("transpile"):
+        from qiskit import transpile
+        circ = transpile(circ, backend_noise)
+    with timing.stage("backend.run"):
+        job = backend_noise.run(circ, shots = h_dict["shots"])
+        result = job.result()
+    with timing.stage("counts"):
+        measurement = dict(result.get_counts())
+    timing.count("circuits")
     return measurement
 
+def get_circ_template(h_dict, h_l, backend_noise, Nparams):
+    key = tuple(h_l)
+    if key not in circ_template_dict:
+        m, n = h_dict["m"], h_dict["n"]
+        n_qbts = m * n
+        from qiskit import transpile
+        from qiskit.circuit import ParameterVector
+        theta = ParameterVector("theta", Nparams)
+        with timing.stage("circuit"):
+            circ = Q_Circuit(m, n, theta, h_l, h_dict["n_layers"], h_dict["ansatz_type"])
+            circ.measure(list(range(n_qbts)), list(range(n_qbts)))
+        with timing.stage("transpile"):
+            circ_template_dict[key] = (theta, transpile(circ, backend_noise))
+    return circ_template_dict[key]
+
+def get_measurement_batch(h_dict, var_params_l, backend_noise, h_l_l):
+    """
+    Measure every parameter vector in var_params_l in every basis of h_l_l with a single job
+
+    Return:
+        measurement_l (List[List[dict]]): measurement_l[i][j] is the counts of var_params_l[i] in basis h_l_l[j]
+    """
+    circ_l = []
+    for var_params in var_params_l:
+        for h_l in h_l_l:
+            theta, circ = get_circ_template(h_dict, h_l, backend_noise, len(var_params))
+            with timing.stage("assign_parameters"):
+                circ_l.append(circ.assign_parameters({theta: var_params}))
+    with timing.stage("backend.run"):
+        result = backend_noise.run(circ_l, shots = h_dict["shots"]).result()
+    with timing.stage("counts"):
+        counts_l = [dict(result.get_counts(i)) for i in range(len(circ_l))]
+    timing.count("circuits", len(circ_l))
+    return [counts_l[i:i+len(h_l_l)] for i in range(0, len(counts_l), len(h_l_l))]
+
+def save_E(E, var_params):
+    E_hist.append(E)
+    timing.count("E_evals")
+    with timing.stage("save"):
+        with open(os.path.join(args.output_dir, "E_hist.pkl"), "wb") as fp:
+            pickle.dump(E_hist, fp)
+        np.save(os.path.join(args.output_dir, "params_dir", f"var_params_{len(E_hist)-1}.npy"), var_params)
+    print("This is energy: ", E)
+
+class HRPlateau(Exception):
+    """
+    Raised by the HR monitor to stop the optimizer
+    """
+    pass
+
+def save_counts(z_m, x_m, n_qbts):
+    """
+    Keep the Z and X basis counts of the last saved energy in the measurement store of the HR script
+    """
+    param_idx = len(E_hist) - 1
+    with timing.stage("save"):
+        for h_l, counts in [([], z_m), (list(range(n_qbts)), x_m)]:
+            basis = ''.join([str(e) for e in h_l])
+            save_atomic(os.path.join(args.output_dir, "measurement", "VQE", f"{param_idx}th_param_{basis}qbt_h_gate.npy"), counts)
+
+def check_HR(var_params, z_m, x_m, hyperparam_dict, backend_noise):
+    """
+    HR monitor: every args.HR_every energy evaluations, HR distance of the last saved parameters from
+    their Z and X counts and the Hadamard basis circuits. Raises HRPlateau once the HR distance did not
+    improve by args.HR_tol in the last args.HR_patience checks.
+    """
+    param_idx = len(E_hist) - 1
+    if args.HR_every <= 0 or param_idx % args.HR_every != 0:
+        return
+    m, n = hyperparam_dict["m"], hyperparam_dict["n"]
+    h_l_l = [[h_idx] for h_idx in range(m * n)]
+    HR_dict = {**hyperparam_dict, "shots": args.HR_shots or hyperparam_dict["shots"]}
+    cross_m_l = get_measurement_batch(HR_dict, [var_params], backend_noise, h_l_l)[0]
+    with timing.stage("estimators"):
+        HR_dist = get_HR_dist_from_counts(z_m, x_m, cross_m_l, m, n, hyperparam_dict["J1"], hyperparam_dict["J2"])
+    HR_monitor.append((param_idx, float(HR_dist)))
+    timing.count("HR_checks")
+    dump_atomic(os.path.join(args.output_dir, "HR_monitor.pkl"), HR_monitor)
+    print(f"HR distance at {param_idx}th param: {HR_dist}")
+    dist_l = [dist for _, dist in HR_monitor]
+    if len(dist_l) > args.HR_patience and min(dist_l[-args.HR_patience:]) > min(dist_l[:-args.HR_patience]) - args.HR_tol:
+        raise HRPlateau(f"HR distance did not improve by {args.HR_tol} in the last {args.HR_patience} checks (best: {min(dist_l)})")
+
+def get_eval_key(var_params, kind, hyperparam_dict):
+    config = {key: hyperparam_dict[key] for key in ["m", "n", "J1", "J2", "n_layers", "ansatz_type", "shots", "p1", "p2"]}
+    return eval_cache.get_key(var_params, kind = kind, model = "J1_J2", backend = "aer_simulator", **config)
+
 def get_E(var_params, hyperparam_dict, backend_noise):
     """
     Get energy
     """
+    key = get_eval_key(var_params, "E", hyperparam_dict)
+    value = eval_cache.lookup(key, deterministic = False)
     m, n = hyperparam_dict["m"], hyperparam_dict["n"]
     n_qbts = m * n
-    z_l, x_l = [], [i for i in range(n_qbts)]
-    z_m = get_measurement(hyperparam_dict, var_params, backend_noise, z_l)
-    x_m = get_measurement(hyperparam_dict, var_params, backend_noise, x_l)
-    # Need to save energy here
-    Hx, Hzz, Hz_z = expectation_X(x_m, 1), get_NN_coupling(z_m, m, n, 1), get_nNN_coupling(z_m, m, n, 1)
-    # exp_X_sqr, exp_ZZ_sqr = get_exp_X(x_m, 2), get_exp_ZZ(z_m, 2)
-    E = Hx + hyperparam_dict["J1"]*Hzz + hyperparam_dict["J2"]*Hz_z
-    E_hist.append(E)
-    with open(os.path.join(args.output_dir, "E_hist.pkl"), "wb") as fp:
-        pickle.dump(E_hist, fp)
-    np.save(os.path.join(args.output_dir, "params_dir", f"var_params_{len(E_hist)-1}.npy"), var_params)
-    print("This is energy: ", E)
+    if value is not None:
+        timing.count("eval_cache_hits")
+        E, (z_m, x_m) = value["E"], value["counts"]
+    else:
+        z_l, x_l = [], [i for i in range(n_qbts)]
+        z_m = get_measurement(hyperparam_dict, var_params, backend_noise, z_l)
+        x_m = get_measurement(hyperparam_dict, var_params, backend_noise, x_l)
+        # Need to save energy here
+        with timing.stage("estimators"):
+            Hx, Hzz, Hz_z = expectation_X(x_m, 1), get_NN_coupling(z_m, m, n, 1), get_nNN_coupling(z_m, m, n, 1)
+        # exp_X_sqr, exp_ZZ_sqr = get_exp_X(x_m, 2), get_exp_ZZ(z_m, 2)
+        E = Hx + hyperparam_dict["J1"]*Hzz + hyperparam_dict["J2"]*Hz_z
+        eval_cache.store(key, {"E": E, "counts": [z_m, x_m]}, deterministic = False)
+    save_E(E, var_params)
+    if args.save_counts:
+        save_counts(z_m, x_m, n_qbts)
+    check_HR(var_params, z_m, x_m, hyperparam_dict, backend_noise)
     return E
 
+def get_E_and_grad(var_params, hyperparam_dict, backend_noise):
+    """
+    Get energy and its parameter-shift gradient. The energy circuits and the 2P shifted circuits
+    (in Z and X basis) are sent to the backend as one batched job.
+    """
+    key = get_eval_key(var_params, "E_grad", hyperparam_dict)
+    value = eval_cache.lookup(key, deterministic = False)
+    m, n = hyperparam_dict["m"], hyperparam_dict["n"]
+    n_qbts = m * n
+    if value is not None:
+        timing.count("eval_cache_hits")
+        E, grad, (z_m, x_m) = value["E"], value["grad"], value["counts"]
+    else:
+        z_l, x_l = [], [i for i in range(n_qbts)]
+        var_params_l = np.concatenate([[var_params], get_param_shift_l(var_params)])
+        measurement_l = get_measurement_batch(hyperparam_dict, var_params_l, backend_noise, [z_l, x_l])
+        E_l = []
+        for z_m, x_m in measurement_l:
+            with timing.stage("estimators"):
+                Hx, Hzz, Hz_z = expectation_X(x_m, 1), get_NN_coupling(z_m, m, n, 1), get_nNN_coupling(z_m, m, n, 1)
+            E_l.append(Hx + hyperparam_dict["J1"]*Hzz + hyperparam_dict["J2"]*Hz_z)
+        E, grad = E_l[0], get_param_shift_grad(E_l[1:])
+        z_m, x_m = measurement_l[0]
+        eval_cache.store(key, {"E": E, "grad": grad, "counts": [z_m, x_m]}, deterministic = False)
+    save_E(E, var_params)
+    if args.save_counts:
+        save_counts(z_m, x_m, n_qbts)
+    check_HR(var_params, z_m, x_m, hyperparam_dict, backend_noise)
+    return E, grad
+
 def main(args):
     # Dont save params yet
     if not os.path.exists(os.path.join(args.output_dir,"params_dir")):
         os.makedirs(os.path.join(args.output_dir,"params_dir"))
+    if args.timing:
+        timing.enable(args.output_dir, "VQE")
+    sampling_profiler.start(args.output_dir, "VQE", sampling_profiler.DEFAULT_INTERVAL if args.profile else None)
+    eval_cache.enable(args.eval_cache_size, args.eval_cache, args.reuse_shot_evals)
     n_qbts = args.m * args.n
     Nparams = 0
     if args.ansatz_type == "ALA":
@@ -86,10 +235,7 @@ def main(args):
     else:
         raise ValueError("please type the correct ansatz type")
 
-    Hamiltonian = get_Hamiltonian(args.m, args.n, args.J1, args.J2)
-    eigen_vals, eigen_vecs = np.linalg.eig(Hamiltonian)
-    argmin_idx = np.argmin(eigen_vals)
-    gst_E, ground_state = np.real(eigen_vals[argmin_idx]), eigen_vecs[:, argmin_idx]
+    gst_E, ground_state = get_sector_gst(args.m, args.n, args.J1, args.J2)
     print("This ground state energy: ", gst_E)
     # Create hyperparam_dict for Hamiltonian Reconstruction
     hyperparam_dict = {}
@@ -98,7 +244,11 @@ def main(args):
     hyperparam_dict["shots"], hyperparam_dict["n_layers"] = args.shots, args.n_layers
     hyperparam_dict["p1"], hyperparam_dict["p2"] = args.p1, args.p2
     hyperparam_dict["ansatz_type"] = args.ansatz_type
+    hyperparam_dict["optimizer"] = args.optimizer
     hyperparam_dict["gst_E"] = gst_E
+    hyperparam_dict["save_counts"] = args.save_counts
+    if args.save_counts:
+        os.makedirs(os.path.join(args.output_dir, "measurement", "VQE"), exist_ok = True)
     np.save(os.path.join(args.output_dir, "VQE_hyperparam_dict.npy"), hyperparam_dict)
 
     # Sets parameter initialization here.
@@ -112,9 +262,11 @@ def main(args):
     bounds = np.tile(np.array([-np.pi, np.pi]), (Nparams,1))
 
     #add noise
+    from qiskit_aer import AerSimulator
     if hyperparam_dict["p1"] == 0 and hyperparam_dict["p2"] == 0:
         backend_noise = AerSimulator()
     else:
+        from qiskit_aer.noise import NoiseModel, depolarizing_error
         noise_model = NoiseModel()
         p1_error = depolarizing_error(hyperparam_dict["p1"], 1)
         p2_error = depolarizing_error(hyperparam_dict["p2"], 2)
@@ -122,9 +274,26 @@ def main(args):
         noise_model.add_all_qubit_quantum_error(p2_error, ['cx'])
         backend_noise = AerSimulator(noise_model = noise_model)
 
-    imfil = IMFIL(maxiter = args.max_iter)
     get_E_func = partial(get_E, hyperparam_dict= hyperparam_dict, backend_noise = backend_noise)
-    result = imfil.minimize(get_E_func, x0 = var_params, bounds = bounds)
+    get_E_and_grad_func = partial(get_E_and_grad, hyperparam_dict= hyperparam_dict, backend_noise = backend_noise)
+    #the HR monitor (--HR_every) stops the optimizer by raising HRPlateau
+    try:
+        if args.optimizer == "IMFIL":
+            from qiskit.algorithms.optimizers import IMFIL
+            imfil = IMFIL(maxiter = args.max_iter)
+            result = imfil.minimize(get_E_func, x0 = var_params, bounds = bounds)
+        elif args.optimizer == "ADAM":
+            #ADAM only calls the gradient every iteration, which also records the energy
+            from qiskit.algorithms.optimizers import ADAM
+            adam = ADAM(maxiter = args.max_iter, lr = args.lr)
+            result = adam.minimize(get_E_func, x0 = var_params, jac = lambda x: get_E_and_grad_func(x)[1])
+        elif args.optimizer == "L_BFGS_B":
+            result = minimize(get_E_and_grad_func, x0 = var_params, jac = True, method = "L-BFGS-B", bounds = bounds, options = {"maxiter": args.max_iter})
+        else:
+            raise ValueError("please type the correct optimizer")
+    except HRPlateau as err:
+        print(err)
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots()
     VQE_steps = np.array(list(range(len(E_hist))))
     ax.scatter(VQE_steps, E_hist, c = 'b', alpha = 0.8, marker = ".", label = "Energy")
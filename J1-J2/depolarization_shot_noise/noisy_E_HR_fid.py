@@ -1,19 +1,9 @@
 import sys
 sys.path.insert(0, "../")
-import qiskit
-from qiskit import QuantumCircuit, Aer
-from qiskit_aer.noise import NoiseModel, depolarizing_error
-from qiskit_aer import AerSimulator
-from qiskit.visualization import plot_histogram
-from qiskit.tools.monitor import job_monitor
-from azure.quantum.qiskit import AzureQuantumProvider
-from qiskit import transpile
 import numpy as np
 import argparse
 import pickle
-import matplotlib.pyplot as plt
 import os
-from depolarization_shot_noise.Circuit import Q_Circuit
 from depolarization_shot_noise.utils import expectation_X, get_NN_coupling, get_nNN_coupling, get_exp_cross
 from depolarization_shot_noise.utils import flatten_neighbor_l, get_nearest_neighbors, get_next_nearest_neighbors
 from depolarization_shot_noise.utils import distanceVecFromSubspace, get_Hamiltonian
@@ -122,6 +112,7 @@ def main(args):
         fid_hist = pickle.load(fp)
 
     #create plots
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots()
     ax.scatter(param_idx_l, noisy_E_hist, c = 'b', alpha = 0.8, marker = ".", label = "Energy")
     ax.set_xlabel('VQE Iterations')
@@ -0,0 +1,109 @@
+"""
+Per-stage timers and counters of the VQE and HR scripts.
+
+    with timing.stage("transpile"):
+        circ = transpile(circ, backend)
+    timing.count("circuits", len(circ_l))
+
+Timing is off unless enable() is called (the --timing flag of the scripts). When it is off, stage()
+returns one shared context manager that does nothing and count() returns immediately, so the
+instrumented code does not read the clock or allocate.
+
+When it is on, every stage keeps its number of calls, total, min and max time and a histogram
+of call times in decade bins. Stages can be nested, and a stage's time includes its nested
+stages. At exit, the stages and counters are written to {prefix}_timing.json and
+{prefix}_timing.csv in the output directory. A one-line summary is printed, with the rate of
+every counter and the share of the slowest stages.
+"""
+
+import os
+import csv
+import json
+import math
+import time
+import atexit
+
+#decade bins of the call time histogram: bin i counts calls in [10^(i + HIST_MIN_EXP), 10^(i + HIST_MIN_EXP + 1)) seconds
+HIST_MIN_EXP, HIST_MAX_EXP = -6, 3
+enabled = False
+stage_dict = {}
+counter_dict = {}
+start_time = None
+
+class NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_STAGE = NullStage()
+
+class Stage:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+def record(name, elapsed):
+    if name not in stage_dict:
+        stage_dict[name] = {"calls": 0, "total_s": 0.0, "min_s": math.inf, "max_s": 0.0, "hist": [0] * (HIST_MAX_EXP - HIST_MIN_EXP)}
+    entry = stage_dict[name]
+    entry["calls"] += 1
+    entry["total_s"] += elapsed
+    entry["min_s"] = min(entry["min_s"], elapsed)
+    entry["max_s"] = max(entry["max_s"], elapsed)
+    exp = math.floor(math.log10(elapsed)) if elapsed > 0 else HIST_MIN_EXP
+    entry["hist"][min(max(exp, HIST_MIN_EXP), HIST_MAX_EXP - 1) - HIST_MIN_EXP] += 1
+
+def stage(name):
+    """
+    Context manager timing one call of stage name (no-op unless timing is enabled)
+    """
+    if not enabled:
+        return NULL_STAGE
+    return Stage(name)
+
+def count(name, n = 1):
+    """
+    Add n to counter name (no-op unless timing is enabled)
+    """
+    if enabled:
+        counter_dict[name] = counter_dict.get(name, 0) + n
+
+def enable(output_dir, prefix):
+    """
+    Turn timing on. The report is written to output_dir when the script exits.
+    """
+    global enabled, start_time
+    enabled = True
+    start_time = time.perf_counter()
+    atexit.register(write_report, output_dir, prefix)
+
+def get_report():
+    wall_s = time.perf_counter() - start_time
+    stage_l = []
+    for name, entry in sorted(stage_dict.items(), key = lambda item: -item[1]["total_s"]):
+        stage_l.append({"stage": name, **entry, "mean_s": entry["total_s"] / entry["calls"], "share": entry["total_s"] / wall_s})
+    hist_edges = [10.0**exp for exp in range(HIST_MIN_EXP, HIST_MAX_EXP + 1)]
+    return {"wall_s": wall_s, "hist_edges_s": hist_edges, "stages": stage_l,
+            "counters": {name: {"count": n, "per_s": n / wall_s} for name, n in counter_dict.items()}}
+
+def write_report(output_dir, prefix):
+    report = get_report()
+    with open(os.path.join(output_dir, f"{prefix}_timing.json"), "w") as fp:
+        json.dump(report, fp, indent = 1)
+    with open(os.path.join(output_dir, f"{prefix}_timing.csv"), "w", newline = "") as fp:
+        writer = csv.writer(fp)
+        writer.writerow(["stage", "calls", "total_s", "mean_s", "min_s", "max_s", "share"])
+        for entry in report["stages"]:
+            writer.writerow([entry["stage"], entry["calls"], entry["total_s"], entry["mean_s"], entry["min_s"], entry["max_s"], entry["share"]])
+    counter_l = [f"{entry['count']} {name} ({entry['per_s']:.3g}/s)" for name, entry in report["counters"].items()]
+    stage_l = [f"{entry['stage']} {100 * entry['share']:.0f}%" for entry in report["stages"][:4]]
+    print(f"{prefix} timing: {report['wall_s']:.1f}s, " + ", ".join(counter_l) + " | " + ", ".join(stage_l))
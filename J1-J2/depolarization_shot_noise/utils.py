@@ -1,4 +1,7 @@
 import numpy as np
+import os
+import json
+import pickle
 
 def get_num_mt(mt):
     num_mt_l = list(map(lambda x: 1 if x == '0' else -1, mt))
@@ -107,6 +110,80 @@ def flatten_neighbor_l(neighbor_l, m, n):
         flat_neighbor_l.append([n1, n2])
     return flat_neighbor_l
 
+#memoized lattice geometry: (m, n, periodic) -> lattice dict of get_lattice
+lattice_cache = {}
+
+def get_periodic_neighbors(m, n, offset_l):
+    """
+    Flattened bonds (i, j) - (i + di mod m, j + dj mod n) for (di, dj) in offset_l, without
+    self loops and duplicates (which appear when m or n <= 2)
+    """
+    flat_neighbor_l, seen = [], set()
+    for i in range(m):
+        for j in range(n):
+            for di, dj in offset_l:
+                n1, n2 = n*i + j, n*((i+di) % m) + (j+dj) % n
+                if n1 != n2 and (min(n1, n2), max(n1, n2)) not in seen:
+                    seen.add((min(n1, n2), max(n1, n2)))
+                    flat_neighbor_l.append([n1, n2])
+    return flat_neighbor_l
+
+def get_edge_coloring(index_l):
+    """
+    Greedy coloring of the bonds, bonds of one color share no qubit (gate layers of HVA)
+    """
+    nn_l = [indices.copy() for indices in index_l]
+    dict_idx = 0
+    nn_dict = {}
+    while len(nn_l) > 0:
+        seen_l = nn_l.pop(0)
+        nn_dict[dict_idx] = [seen_l.copy()]
+        new_nn_l = []
+        for nn in nn_l:
+            q1, q2 = nn
+            if q1 in seen_l or q2 in seen_l:
+                new_nn_l.append(nn)
+            else:
+                nn_dict[dict_idx].append(nn)
+                seen_l.append(q1)
+                seen_l.append(q2)
+        nn_l = new_nn_l
+        dict_idx += 1
+    return nn_dict
+
+def get_lattice(m, n, periodic = False):
+    """
+    Geometry of the m x n grid, built once per (m, n, periodic) and shared by all estimators.
+    Open boundary lists are in the same order as flatten_neighbor_l(get_nearest_neighbors(m, n), m, n).
+
+    Return:
+        lattice (dict):
+            NN_index_l, nNN_index_l: flattened neighbor lists
+            NN_index, nNN_index: the same as (n_bonds, 2) int arrays
+            NN_mask, nNN_mask: bit mask (1 << i) | (1 << j) of every bond
+            nn_dict: edge coloring of the NN bonds (get_nn_dict of Circuit.py)
+            X_NN_index_l, X_nNN_index_l: [h_idx] -> [[h_idx, i, j] for bonds [i, j] without h_idx],
+                the X ZZ cross terms measured in the basis with a Hadamard gate on h_idx
+    """
+    key = (m, n, periodic)
+    if key in lattice_cache:
+        return lattice_cache[key]
+    if periodic:
+        NN_index_l = get_periodic_neighbors(m, n, [(1, 0), (0, 1)])
+        nNN_index_l = get_periodic_neighbors(m, n, [(1, 1), (1, -1)])
+    else:
+        NN_index_l = flatten_neighbor_l(get_nearest_neighbors(m, n), m, n)
+        nNN_index_l = flatten_neighbor_l(get_next_nearest_neighbors(m, n), m, n)
+    lattice = {"m": m, "n": n, "periodic": periodic, "NN_index_l": NN_index_l, "nNN_index_l": nNN_index_l}
+    for name, index_l in [("NN", NN_index_l), ("nNN", nNN_index_l)]:
+        index = np.array(index_l, dtype = np.int64).reshape(-1, 2)
+        lattice[f"{name}_index"] = index
+        lattice[f"{name}_mask"] = (1 << index[:, 0]) | (1 << index[:, 1])
+        lattice[f"X_{name}_index_l"] = [[[h_idx, zi, zj] for zi, zj in index_l if h_idx != zi and h_idx != zj] for h_idx in range(m*n)]
+    lattice["nn_dict"] = get_edge_coloring(NN_index_l)
+    lattice_cache[key] = lattice
+    return lattice
+
 def expectation_X(x_m, expo):
     tot_val, tot_count = 0, 0
     for x_mt, m_count in x_m.items():
@@ -118,7 +195,7 @@ def expectation_X(x_m, expo):
 
 def get_NN_coupling(z_m, m, n, expo):
     tot_val, tot_count = 0, 0
-    NN_l = flatten_neighbor_l(get_nearest_neighbors(m, n), m , n)
+    NN_l = get_lattice(m, n)["NN_index_l"]
     for z_mt, m_count in z_m.items():
         z_mt = get_num_mt(z_mt)
         sum_zz = 0
@@ -135,7 +212,7 @@ def get_fidelity(wf, mat):
 
 def get_nNN_coupling(z_m, m, n, expo):
     tot_val, tot_count = 0, 0
-    nNN_l = flatten_neighbor_l(get_next_nearest_neighbors(m, n), m , n)
+    nNN_l = get_lattice(m, n)["nNN_index_l"]
     for z_mt, m_count in z_m.items():
         z_mt = get_num_mt(z_mt)
         sum_zz = 0
@@ -146,6 +223,51 @@ def get_nNN_coupling(z_m, m, n, expo):
     exp_val = tot_val / tot_count
     return exp_val
 
+def get_HR_dist_from_counts(z_m, x_m, cross_m_l, m, n, J1, J2):
+    """
+    HR distance of the J1-J2 model from measurement counts
+
+    Args:
+        z_m, x_m: counts of the Z and X basis
+        cross_m_l: counts of the basis with a Hadamard gate on qubit h only, for every qubit h
+
+    Return:
+        HR distance of (1, J1, J2) from the lowest eigenvector of the covariance matrix
+    """
+    cov_mat = np.zeros((3,3))
+    exp_X, exp_NN, exp_nNN = expectation_X(x_m, 1), get_NN_coupling(z_m, m, n, 1), get_nNN_coupling(z_m, m, n, 1)
+
+    #diagonal terms
+    cov_mat[0, 0] = expectation_X(x_m, 2) - exp_X**2
+    cov_mat[1, 1] = get_NN_coupling(z_m, m, n, 2) - exp_NN**2
+    cov_mat[2, 2] = get_nNN_coupling(z_m, m, n, 2) - exp_nNN**2
+
+    #cross terms
+    lattice = get_lattice(m, n)
+    NN_index_l, nNN_index_l = lattice["NN_index_l"], lattice["nNN_index_l"]
+    NN_nNN_val = - (exp_NN * exp_nNN)
+    for NN_indices in NN_index_l:
+        for nNN_indices in nNN_index_l:
+            NN_nNN_val += get_exp_cross(z_m, NN_indices + nNN_indices)
+    cov_mat[1, 2], cov_mat[2, 1]= NN_nNN_val, NN_nNN_val
+
+    X_NN_val = -(exp_X * exp_NN)
+    X_nNN_val = -(exp_X * exp_nNN)
+    for h_idx, cross_m in enumerate(cross_m_l):
+        for indices in lattice["X_NN_index_l"][h_idx]:
+            X_NN_val += get_exp_cross(cross_m, indices)
+        for indices in lattice["X_nNN_index_l"][h_idx]:
+            X_nNN_val += get_exp_cross(cross_m, indices)
+    cov_mat[0, 1] = X_NN_val
+    cov_mat[0, 2] = X_nNN_val
+    cov_mat[2, 0], cov_mat[1, 0] = cov_mat[0, 2], cov_mat[0, 1]
+    val, vec = np.linalg.eigh(cov_mat)
+    argsort = np.argsort(val)
+    val, vec = val[argsort], vec[:, argsort]
+    orig_H = np.array([1, J1, J2])
+    orig_H = orig_H/np.linalg.norm(orig_H)
+    return distanceVecFromSubspace(orig_H, vec[:, :1])
+
 def get_Hamiltonian(m, n, J1, J2):
     """
     Returns J1-J2 Hamiltonian. Total number of qubits: m x n
@@ -174,3 +296,134 @@ def get_Hamiltonian(m, n, J1, J2):
     nNN_coord_l = get_next_nearest_neighbors(m, n)
     Hzz_J2 = create_partial_Hamiltonian(nNN_coord_l, m, n)
     return Hx + J1*Hzz_J1 + J2*Hzz_J2
+
+def subsample_counts(counts, shots, rng, n_replicates = None):
+    """
+    Draw shots of the measured shots in counts without replacement (multivariate hypergeometric),
+    i.e. the counts of a run with fewer shots, without running the circuit again
+
+    Args:
+        counts (dict): measured counts, at least shots in total
+        shots (int): number of shots of the subsample
+        rng (numpy Generator): random number generator
+        n_replicates (int): number of independent subsamples drawn in one call, None for a single one
+
+    Return:
+        counts (dict) of the subsample in the format of counts, or a list of n_replicates of them
+    """
+    keys = list(counts.keys())
+    colors = np.fromiter(counts.values(), dtype = np.int64, count = len(keys))
+    assert shots <= colors.sum(), f"can't draw {shots} shots from {colors.sum()} measured shots"
+    #the count method costs O(measured shots) per replicate, much less than the marginals method for many distinct bitstrings
+    sub_counts = rng.multivariate_hypergeometric(colors, shots, size = n_replicates, method = "count")
+    if n_replicates is None:
+        return {keys[idx]: int(sub_counts[idx]) for idx in np.flatnonzero(sub_counts)}
+    sub_counts_l = []
+    for row in sub_counts:
+        nonzero = np.flatnonzero(row)
+        sub_counts_l.append(dict(zip([keys[idx] for idx in nonzero], row[nonzero].tolist())))
+    return sub_counts_l
+
+def load_ledger(ledger_path):
+    """
+    Replay the checkpoint ledger of a sweep.
+    The ledger is an append-only file with one JSON entry per line, each entry recording
+    the status ("submitted", "done" or "failed") of a (param_idx, basis) pair.
+
+    Args:
+        ledger_path (str): path to the ledger file
+
+    Return:
+        ledger (dict): latest entry of every (param_idx, basis) pair
+    """
+    ledger = {}
+    if not os.path.isfile(ledger_path):
+        return ledger
+    with open(ledger_path, "r+") as fp:
+        content = fp.read()
+        #drop a partially written last line, left over if the sweep was killed mid-write
+        if not content.endswith("\n"):
+            content = content[:content.rfind("\n") + 1]
+            fp.seek(0)
+            fp.truncate()
+            fp.write(content)
+    for line in content.splitlines():
+        entry = json.loads(line)
+        ledger[(entry["param_idx"], entry["basis"])] = entry
+    return ledger
+
+def update_ledger(ledger_path, ledger, param_idx, basis, status, **fields):
+    """
+    Append an entry to the ledger. Costs O(1) per call regardless of the sweep length.
+
+    Args:
+        ledger_path (str): path to the ledger file
+        ledger (dict): ledger loaded by load_ledger, updated in place
+        param_idx (int): parameter index
+        basis (str): measurement basis ("HR" for the HR distance of param_idx)
+        status (str): "submitted", "done" or "failed"
+        fields: extra fields to record (e.g. job_id, path, HR_dist)
+    """
+    entry = {"param_idx": int(param_idx), "basis": basis, "status": status}
+    entry.update(fields)
+    with open(ledger_path, "a") as fp:
+        fp.write(json.dumps(entry) + "\n")
+        fp.flush()
+        os.fsync(fp.fileno())
+    ledger[(entry["param_idx"], basis)] = entry
+    return entry
+
+def is_job_failed(job):
+    """
+    True if job reports a terminal ERROR or CANCELLED status. A job whose status can't be read (e.g. a
+    network error) may still finish, so it is not failed and its ledger entry stays "submitted".
+    """
+    try:
+        status = job.status()
+    except Exception:
+        return False
+    return getattr(status, "name", str(status)) in ("ERROR", "CANCELLED")
+
+def save_atomic(path, obj):
+    """
+    np.save obj to path through a temporary file, so that path never holds a partial result
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as fp:
+        np.save(fp, obj, allow_pickle = True)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, path)
+
+def dump_atomic(path, obj):
+    """
+    pickle.dump obj to path through a temporary file, so that path never holds a partial result
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as fp:
+        pickle.dump(obj, fp)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, path)
+
+def get_param_shift_l(var_params):
+    """
+    Get the 2P shifted parameter vectors of the parameter-shift rule.
+    The rule is exact when every parameter enters the circuit through a single
+    Pauli rotation exp(-i*theta*P/2), e.g. the RY gates of the ALA ansatz or the RX and RZZ gates of the HVA ansatz.
+
+    Args:
+        var_params (numpy 1d vector): parameters of the circuit (length P)
+
+    Return:
+        numpy 2d matrix whose first P rows are var_params + pi/2 e_k and last P rows are var_params - pi/2 e_k
+    """
+    shift = (np.pi/2)*np.eye(len(var_params))
+    return np.concatenate([var_params + shift, var_params - shift])
+
+def get_param_shift_grad(E_shift_l):
+    """
+    Get the gradient from the energies of the parameter vectors returned by get_param_shift_l
+    """
+    E_plus, E_minus = np.split(np.asarray(E_shift_l), 2)
+    return (E_plus - E_minus)/2
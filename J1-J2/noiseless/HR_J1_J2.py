@@ -7,15 +7,17 @@ from qiskit.tools.monitor import job_monitor
 from azure.quantum.qiskit import AzureQuantumProvider
 from qiskit import transpile
 import numpy as np
+from scipy.sparse.linalg import eigsh
 import argparse
 import pickle
 import matplotlib.pyplot as plt
 import os
 # Reference https://stackoverflow.com/questions/52988881/modulenotfounderror-on-a-submodule-that-imports-a-submodule
 # to understand why there is a dot before the package name
-from noiseless.utils import get_nearest_neighbors, get_next_nearest_neighbors
-from noiseless.utils import get_Hx, create_partial_Hamiltonian, get_Hamiltonian
-from noiseless.utils import distanceVecFromSubspace, expected_op1_op2, expected_op
+from noiseless.utils import get_nearest_neighbors, get_next_nearest_neighbors, flatten_neighbor_l
+from noiseless.utils import get_Hx, create_partial_Hamiltonian, get_sparse_Hamiltonian, get_X_moments
+from noiseless.utils import distanceVecFromSubspace
+from noiseless.adjoint import get_zz_diag, apply_H
 from noiseless.Circuit import Q_Circuit
 
 HR_dist_hist = []
@@ -29,6 +31,14 @@ def get_operations_l(m, n):
     ops_l.append(create_partial_Hamiltonian(nNN_index_l, m, n))
     return ops_l
 
+def get_zz_diag_l(m, n):
+    """
+    Diagonals of the nearest and next-nearest neighbor ZZ terms
+    """
+    NN_index_l = flatten_neighbor_l(get_nearest_neighbors(m, n), m, n)
+    nNN_index_l = flatten_neighbor_l(get_next_nearest_neighbors(m, n), m, n)
+    return [get_zz_diag(m*n, NN_index_l), get_zz_diag(m*n, nNN_index_l)]
+
 def get_args(parser):
     parser.add_argument('--input_dir', type = str, help = "directory where VQE_hyperparam_dict.npy exists and HR distances and plots will be stored")
     args = parser.parse_args()
@@ -38,16 +48,27 @@ def get_params(params_dir_path, param_idx):
     var_params = np.load(os.path.join(params_dir_path, f"var_params_{param_idx}.npy"))
     return var_params
 
-def get_HR_distance(hyperparam_dict, wf, ops_l):
-    ops_n = len(ops_l)
+def get_HR_distance(hyperparam_dict, wf, zz_diag_l):
+    """
+    HR distance from the covariance matrix of (Hx, ZZ_NN, ZZ_nNN). Hx moments come from the X basis
+    probabilities (fast Walsh-Hadamard transform), ZZ moments from the Z basis probabilities and the
+    Hx-ZZ cross terms from Re<Hx wf|ZZ wf>, so no 2^N x 2^N operator is built.
+    """
+    N_qubits = hyperparam_dict["m"] * hyperparam_dict["n"]
+    wf = np.asarray(wf)
+    ops_n = len(zz_diag_l) + 1
+    _, exp_Hx, exp_Hx_sqr = get_X_moments(wf, N_qubits)
+    Z_probs = np.abs(wf)**2
+    Hx_wf = apply_H(wf.astype(complex), N_qubits, np.zeros(2**N_qubits))
+    exp_l = [exp_Hx] + [np.dot(Z_probs, zz_diag) for zz_diag in zz_diag_l]
     #intialize covariance matrix, with all its entries being zeros.
     cov_mat = np.zeros((ops_n, ops_n), dtype=float)
-    for i1 in range(ops_n):
+    cov_mat[0, 0] = exp_Hx_sqr - exp_Hx**2
+    for i1 in range(1, ops_n):
+        cov_mat[0, i1] = np.vdot(Hx_wf, zz_diag_l[i1-1] * wf).real - exp_l[0]*exp_l[i1]
+        cov_mat[i1, 0] = cov_mat[0, i1]
         for i2 in range(i1, ops_n):
-            O1_O2 = 1/2 * (expected_op1_op2(ops_l[i1], ops_l[i2], wf) + expected_op1_op2(ops_l[i2], ops_l[i1], wf) )
-            O1 = expected_op(ops_l[i1], wf)
-            O2 = expected_op(ops_l[i2], wf)
-            cov_mat[i1, i2] = O1_O2 - O1*O2
+            cov_mat[i1, i2] = np.dot(Z_probs, zz_diag_l[i1-1] * zz_diag_l[i2-1]) - exp_l[i1]*exp_l[i2]
             cov_mat[i2, i1] = cov_mat[i1, i2]
 
     val, vec = np.linalg.eigh(cov_mat)
@@ -85,13 +106,12 @@ def main(args):
     J1, J2 = hyperparam_dict["J1"], hyperparam_dict["J2"]
     n_layers = hyperparam_dict["n_layers"]
 
-    Hamiltonian = get_Hamiltonian(m, n, J1, J2)
-    eigen_vals, eigen_vecs = np.linalg.eig(Hamiltonian)
-    argmin_idx = np.argmin(eigen_vals)
-    gst_E, ground_state = np.real(eigen_vals[argmin_idx]), eigen_vecs[:, argmin_idx]
+    Hamiltonian = get_sparse_Hamiltonian(m, n, J1, J2)
+    eigen_vals, eigen_vecs = eigsh(Hamiltonian, k = 1, which = "SA")
+    gst_E, ground_state = eigen_vals[0], eigen_vecs[:, 0]
 
-    #create operation list
-    ops_l = get_operations_l(m, n)
+    #diagonals of the ZZ terms, Hx is handled by get_HR_distance
+    zz_diag_l = get_zz_diag_l(m, n)
 
     HR_dist_hist = []
     fid_hist = []
@@ -102,7 +122,7 @@ def main(args):
         circ.save_statevector()
         result = backend.run(circ).result()
         statevector = result.get_statevector(circ)
-        HR_dist = get_HR_distance(hyperparam_dict, statevector, ops_l)
+        HR_dist = get_HR_distance(hyperparam_dict, statevector, zz_diag_l)
         print(f"This is HR distance: {HR_dist} for {param_idx}th param")
         HR_dist_hist.append(HR_dist)
         fid_sqrt = np.vdot(statevector, ground_state)
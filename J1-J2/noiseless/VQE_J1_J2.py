@@ -1,6 +1,7 @@
 import sys
 sys.path.insert(0, "../")
 import numpy as np
+from scipy.sparse.linalg import eigsh
 import os
 from qiskit import QuantumCircuit, Aer
 from qiskit.algorithms.optimizers import IMFIL
@@ -8,13 +9,16 @@ from qiskit import transpile
 from qiskit.tools.monitor import job_monitor
 import argparse
 from functools import partial
+from scipy.optimize import minimize
 import pickle
 import matplotlib.pyplot as plt
 # Reference https://stackoverflow.com/questions/52988881/modulenotfounderror-on-a-submodule-that-imports-a-submodule
 # to understand why there is a dot before the package name
 from noiseless.Circuit import Q_Circuit
-from noiseless.utils import get_Hamiltonian, expected_op
+from noiseless.utils import get_sparse_Hamiltonian, expected_op
 from noiseless.utils import get_nearest_neighbors, create_identity
+from noiseless.utils import get_next_nearest_neighbors, flatten_neighbor_l
+from noiseless.adjoint import get_ALA_gate_l, get_zz_diag, get_ground_energy, get_adjoint_E_and_grad
 
 
 E_hist = []
@@ -29,6 +33,7 @@ def get_args(parser):
     parser.add_argument('--n_layers', type = int, default = 3, help = "number of ALA ansatz layers needed (default: 3)")
     parser.add_argument('--output_dir', type = str, default = ".", help = "output directory being used (default: .)")
     parser.add_argument('--init_param', type = str, default = "NONE", help = "parameters for initialization (default: NONE)")
+    parser.add_argument('--optimizer', type = str, default = "IMFIL", help = "optimizer: IMFIL or lbfgs-adjoint (default: IMFIL)")
     args = parser.parse_args()
     return args
 
@@ -42,12 +47,35 @@ def get_E(var_params, m, n, H, J1, J2, n_layers, ansatz_type, backend):
     result = backend.run(circ).result()
     statevector = np.array(result.get_statevector(circ))
     E = expected_op(H, statevector)
+    save_E(E, var_params)
+    return E
+
+def save_E(E, var_params):
+    """
+    Log energy and parameters of one VQE step
+    """
     E_hist.append(E)
     with open(os.path.join(args.output_dir, "E_hist.pkl"), "wb") as fp:
         pickle.dump(E_hist, fp)
     np.save(os.path.join(args.output_dir, "params_dir", f"var_params_{len(E_hist)-1}.npy"), var_params)
     print("This is energy: ", E)
-    return E
+
+def get_E_and_grad_adjoint(var_params, gate_l, n_qbts, H_diag):
+    """
+    Get energy and its gradient from the numpy statevector with adjoint differentiation
+    """
+    E, grad = get_adjoint_E_and_grad(var_params, gate_l, n_qbts, H_diag)
+    save_E(E, var_params)
+    return E, grad
+
+def get_H_diag(m, n, J1, J2):
+    """
+    Diagonal of J1*ZZ_<i,j> + J2*ZZ_<<i,j>> of get_Hamiltonian
+    """
+    n_qbts = m * n
+    NN_index_l = flatten_neighbor_l(get_nearest_neighbors(m, n), m, n)
+    nNN_index_l = flatten_neighbor_l(get_next_nearest_neighbors(m, n), m, n)
+    return J1*get_zz_diag(n_qbts, NN_index_l) + J2*get_zz_diag(n_qbts, nNN_index_l)
 
 def main(args):
     # Dont save params yet
@@ -70,10 +98,15 @@ def main(args):
     else:
         raise ValueError("please type the correct ansatz type")
 
-    Hamiltonian = get_Hamiltonian(args.m, args.n, args.J1, args.J2)
-    eigen_vals, eigen_vecs = np.linalg.eig(Hamiltonian)
-    argmin_idx = np.argmin(eigen_vals)
-    gst_E, ground_state = np.real(eigen_vals[argmin_idx]), eigen_vecs[:, argmin_idx]
+    if args.optimizer == "lbfgs-adjoint":
+        # Matrix-free H, the dense Hamiltonian does not fit in memory for ~20 qubits
+        assert args.ansatz_type == "ALA", "lbfgs-adjoint only supports the ALA ansatz"
+        H_diag = get_H_diag(args.m, args.n, args.J1, args.J2)
+        gst_E = get_ground_energy(n_qbts, H_diag)
+    else:
+        Hamiltonian = get_sparse_Hamiltonian(args.m, args.n, args.J1, args.J2)
+        eigen_vals, eigen_vecs = eigsh(Hamiltonian, k = 1, which = "SA")
+        gst_E, ground_state = eigen_vals[0], eigen_vecs[:, 0]
     print("This ground state energy: ", gst_E)
 
     # Sets parameter initialization here.
@@ -85,10 +118,17 @@ def main(args):
         assert len(var_params) == Nparams, "loaded params needs to have the same length as the Nparams"
 
     bounds = np.tile(np.array([-np.pi, np.pi]), (Nparams,1))
-    backend = Aer.get_backend('aer_simulator')
-    imfil = IMFIL(maxiter = args.max_iter)
-    get_E_func = partial(get_E, m = args.m, n = args.n, H = Hamiltonian, J1 = args.J1, J2 = args.J2, n_layers = args.n_layers, ansatz_type = args.ansatz_type, backend = backend)
-    result = imfil.minimize(get_E_func, x0 = var_params, bounds = bounds)
+    if args.optimizer == "IMFIL":
+        backend = Aer.get_backend('aer_simulator')
+        imfil = IMFIL(maxiter = args.max_iter)
+        get_E_func = partial(get_E, m = args.m, n = args.n, H = Hamiltonian, J1 = args.J1, J2 = args.J2, n_layers = args.n_layers, ansatz_type = args.ansatz_type, backend = backend)
+        result = imfil.minimize(get_E_func, x0 = var_params, bounds = bounds)
+    elif args.optimizer == "lbfgs-adjoint":
+        gate_l = get_ALA_gate_l(n_qbts, args.n_layers)
+        get_E_and_grad_func = partial(get_E_and_grad_adjoint, gate_l = gate_l, n_qbts = n_qbts, H_diag = H_diag)
+        result = minimize(get_E_and_grad_func, x0 = var_params, jac = True, method = "L-BFGS-B", bounds = bounds, options = {"maxiter": args.max_iter})
+    else:
+        raise ValueError("please type the correct optimizer")
     fig, ax = plt.subplots()
     VQE_steps = np.array(list(range(len(E_hist))))
     ax.scatter(VQE_steps, E_hist, c = 'b', alpha = 0.8, marker = ".", label = "Energy")
@@ -105,6 +145,7 @@ def main(args):
     hyperparam_dict["J1"], hyperparam_dict["J2"] = args.J1, args.J2
     hyperparam_dict["n_layers"] = args.n_layers
     hyperparam_dict["ansatz_type"] = args.ansatz_type
+    hyperparam_dict["optimizer"] = args.optimizer
     hyperparam_dict["gst_E"] = gst_E
     np.save(os.path.join(args.output_dir, "VQE_hyperparam_dict.npy"), hyperparam_dict)
 
@@ -1,6 +1,5 @@
-from HR_J1_J2 import get_HR_distance
-from utils import get_Hamiltonian, create_partial_Hamiltonian, get_Hx
-from utils import get_nearest_neighbors, get_next_nearest_neighbors
+from HR_J1_J2 import get_HR_distance, get_zz_diag_l
+from utils import get_Hamiltonian
 import numpy as np
 
 def test1():
@@ -12,16 +11,11 @@ def test1():
     Hamiltonian = get_Hamiltonian(m, n, J1, J2)
     hyperparam_dict = {}
     hyperparam_dict["J1"], hyperparam_dict["J2"] = J1, J2
+    hyperparam_dict["m"], hyperparam_dict["n"] = m, n
     eigen_vals, eigen_vecs = np.linalg.eig(Hamiltonian)
     argmin_idx = np.argmin(eigen_vals)
     gst_E, ground_state = np.real(eigen_vals[argmin_idx]), eigen_vecs[:, argmin_idx]
-    NN_index_l= get_nearest_neighbors(m, n)
-    nNN_index_l= get_next_nearest_neighbors(m, n)
-    ops_l = []
-    ops_l.append(get_Hx(m*n))
-    ops_l.append(create_partial_Hamiltonian(NN_index_l, m, n))
-    ops_l.append(create_partial_Hamiltonian(nNN_index_l, m, n))
-    HR_dist = get_HR_distance(hyperparam_dict, ground_state, ops_l)
+    HR_dist = get_HR_distance(hyperparam_dict, ground_state, get_zz_diag_l(m, n))
     print("This is HR distance of the ground state: ", HR_dist)
     assert abs(HR_dist) <= 1e-12
 
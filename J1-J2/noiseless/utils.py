@@ -1,4 +1,9 @@
 import numpy as np
+import os
+import sys
+#the sparse matrix builder is shared by all models, in model_spec.py at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+from model_spec import get_sparse_X_plus_diag
 
 def create_identity(m, n):
     row = [np.eye(2)]*n
@@ -36,12 +41,61 @@ def flatten_neighbor_l(neighbor_l, m, n):
     return flat_neighbor_l
 
 def expected_op(op, wf):
-    return np.vdot(wf, np.matmul(op, wf)).real
+    return np.vdot(wf, op @ wf).real
 
 def expected_op1_op2(op1, op2, wf):
 
     return np.vdot(wf, np.matmul(op1, np.matmul(op2, wf))).real
 
+def get_basis_probs(wf, h_l, N_qubits):
+    """
+    Measurement probabilities of wf after a Hadamard gate on every qubit in h_l, computed with
+    the butterflies of the fast Walsh-Hadamard transform (O(len(h_l) * 2^N), no circuit simulation).
+    h_l = [] gives the Z basis, h_l = all qubits gives the X basis and anything in between the mixed
+    X/Z bases used for HR. Qubit i is bit i of the statevector index.
+
+    Args:
+        wf (numpy 1d vector): statevector of length 2^N_qubits
+        h_l (list): qubits measured in the X basis
+        N_qubits (int): number of qubits
+
+    Return:
+        probs (numpy 1d vector): probability of every basis state
+    """
+    wf = np.array(wf, dtype = complex)
+    for q in h_l:
+        v = wf.reshape(2**(N_qubits-1-q), 2, 2**q)
+        a = v[:, 0, :].copy()
+        v[:, 0, :] += v[:, 1, :]
+        v[:, 1, :] *= -1
+        v[:, 1, :] += a
+    probs = np.abs(wf)**2
+    return probs / 2**len(h_l)
+
+def get_spin_sum(N_qubits, qubit_l = None):
+    """
+    sum of (1 - 2*bit_i) over qubit i in qubit_l (default: all qubits) for every basis state
+    """
+    if qubit_l is None:
+        qubit_l = range(N_qubits)
+    basis = np.arange(2**N_qubits)
+    spin_sum = np.zeros(2**N_qubits)
+    for i in qubit_l:
+        spin_sum += 1 - 2*((basis >> i) & 1)
+    return spin_sum
+
+def get_X_moments(wf, N_qubits):
+    """
+    X basis statistics of wf from one fast Walsh-Hadamard transform
+
+    Return:
+        X_probs (numpy 1d vector): X basis probability distribution
+        exp_Hx, exp_Hx_sqr: <Hx> and <Hx^2> for Hx = sum_i X_i
+    """
+    X_probs = get_basis_probs(wf, list(range(N_qubits)), N_qubits)
+    Hx_diag = get_spin_sum(N_qubits)
+    return X_probs, np.dot(X_probs, Hx_diag), np.dot(X_probs, Hx_diag**2)
+
 def create_partial_Hamiltonian(neighbor_l, m, n):
     """
     Returns neighbor-coupling Hamiltonian, using neighbor_l.
@@ -119,3 +173,22 @@ def get_Hamiltonian(m, n, J1, J2):
     nNN_coord_l = get_next_nearest_neighbors(m, n)
     Hzz_J2 = create_partial_Hamiltonian(nNN_coord_l, m, n)
     return Hx + J1*Hzz_J1 + J2*Hzz_J2
+
+def get_sparse_Hamiltonian(m, n, J1, J2):
+    """
+    Same matrix as get_Hamiltonian(m, n, J1, J2) in CSR format, built from bit operations on all
+    2^N basis states at once instead of kron products. The ZZ energy of basis state s is
+    (number of bonds) - 2*(number of bonds [i, j] with bit i of s XOR bit j of s = 1).
+    """
+    N_qubits = m * n
+    basis = np.arange(2**N_qubits, dtype = np.int32)
+    bit_l = [((basis >> i) & 1).astype(np.int8) for i in range(N_qubits)]
+    H_diag = np.zeros(2**N_qubits)
+    for J, neighbor_l in [(J1, get_nearest_neighbors(m, n)), (J2, get_next_nearest_neighbors(m, n))]:
+        index_l = flatten_neighbor_l(neighbor_l, m, n)
+        #number of anti-aligned bonds of every basis state
+        n_anti = np.zeros(2**N_qubits, dtype = np.int16)
+        for i, j in index_l:
+            n_anti += bit_l[i] ^ bit_l[j]
+        H_diag += J * (len(index_l) - 2*n_anti)
+    return get_sparse_X_plus_diag(N_qubits, H_diag)
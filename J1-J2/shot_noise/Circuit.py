@@ -3,7 +3,7 @@ sys.path.insert(0, "../")
 import qiskit
 from qiskit import QuantumCircuit, Aer
 import numpy as np
-from shot_noise.utils import get_nearest_neighbors, flatten_neighbor_l
+from shot_noise.utils import get_lattice
 
 def ALA(circ, N_qubits, var_params, h_l, n_layers):
     param_idx = 0
@@ -42,24 +42,7 @@ def ALA(circ, N_qubits, var_params, h_l, n_layers):
     return circ
 
 def get_nn_dict(m, n):
-    nn_l = flatten_neighbor_l(get_nearest_neighbors(m, n), m, n)
-    dict_idx = 0
-    nn_dict = {}
-    while len(nn_l) > 0:
-        seen_l = nn_l.pop(0)
-        nn_dict[dict_idx] = [seen_l.copy()]
-        new_nn_l = []
-        for nn in nn_l:
-            q1, q2 = nn
-            if q1 in seen_l or q2 in seen_l:
-                new_nn_l.append(nn)
-            else:
-                nn_dict[dict_idx].append(nn)
-                seen_l.append(q1)
-                seen_l.append(q2)
-        nn_l = new_nn_l
-        dict_idx += 1
-    return nn_dict
+    return get_lattice(m, n)["nn_dict"]
 
 def HVA(circ, m, n, var_params, h_l, n_layers):
     #NEED SOME CODE HERE
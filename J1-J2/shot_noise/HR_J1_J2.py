@@ -7,16 +7,25 @@ from qiskit.tools.monitor import job_monitor
 from azure.quantum.qiskit import AzureQuantumProvider
 from qiskit import transpile
 import numpy as np
+from scipy.sparse.linalg import eigsh
 import argparse
 import pickle
 import matplotlib.pyplot as plt
 import os
 from shot_noise.Circuit import Q_Circuit
 from shot_noise.utils import expectation_X, get_NN_coupling, get_nNN_coupling, get_exp_cross
-from shot_noise.utils import flatten_neighbor_l, get_nearest_neighbors, get_next_nearest_neighbors
-from shot_noise.utils import distanceVecFromSubspace, get_Hamiltonian
+from shot_noise.utils import get_lattice
+from shot_noise.utils import distanceVecFromSubspace, get_sparse_Hamiltonian
+from shot_noise.utils import load_ledger, update_ledger, is_job_failed, save_atomic, dump_atomic
+from shot_noise.utils import get_basis_probs, sample_counts
 
 HR_dist_hist = []
+#checkpoint ledger of the sweep: (param_idx, basis) -> latest ledger entry
+ledger = {}
+#exact output distributions for --exact_sampling: (param_idx, basis) -> probabilities, kept for the latest param_idx only
+probs_cache = {}
+statevector_cache = {}
+rng = np.random.default_rng()
 
 def get_args(parser):
     parser.add_argument('--input_dir', type = str, help = "directory where VQE_hyperparam_dict.npy exists and HR distances and plots will be stored")
@@ -24,16 +33,57 @@ def get_args(parser):
     parser.add_argument('--backend', type = str, default = "aer_simulator", help = "backend for ionq runs (aer_simulator, ionq.simulator, ionq.qpu, ionq.qpu.aria-1, default = aer_simulator)")
     parser.add_argument('--param_idx_l', action = 'store_true', help = "if there is param_idx_l, then use param_idx_l.npy in input_dir \
                                 to load the parameter index list to measure corresponding HR distances")
+    parser.add_argument('--exact_sampling', action = 'store_true', help = "draw the shots from the exact output distribution of the statevector \
+                                instead of rerunning every basis circuit. Only compatible with aer_simulator backend")
+    parser.add_argument('--seed', type = int, default = None, help = "seed of the shot sampling with --exact_sampling (default: None)")
     args = parser.parse_args()
     return args
 
+def get_statevector(hyperparam_dict, var_params, backend):
+    m, n = hyperparam_dict["m"], hyperparam_dict["n"]
+    circ = Q_Circuit(m, n, var_params, [], hyperparam_dict["n_layers"], hyperparam_dict["ansatz_type"])
+    circ.save_statevector()
+    result = backend.run(circ).result()
+    return np.array(result.get_statevector(circ))
+
+def get_exact_measurement(n_qbts, var_params, backend, h_l, hyperparam_dict, param_idx):
+    """
+    Measurement in the same counts format as get_measurement, with the shots drawn from the exact
+    output distribution. The statevector is simulated once per param_idx and the distribution is
+    computed once per (param_idx, basis), so redrawing any number of shots costs one multinomial draw.
+    """
+    basis = ''.join([str(e) for e in h_l])
+    if statevector_cache.get("param_idx") != param_idx:
+        probs_cache.clear()
+        statevector_cache["param_idx"] = param_idx
+        statevector_cache["statevector"] = get_statevector(hyperparam_dict, var_params, backend)
+    if (param_idx, basis) not in probs_cache:
+        probs_cache[(param_idx, basis)] = get_basis_probs(statevector_cache["statevector"], h_l, n_qbts)
+    return sample_counts(probs_cache[(param_idx, basis)], hyperparam_dict["shots"], rng)
+
 def get_measurement(n_qbts, var_params, backend, h_l, hyperparam_dict, param_idx):
+    if hyperparam_dict["exact_sampling"]:
+        return get_exact_measurement(n_qbts, var_params, backend, h_l, hyperparam_dict, param_idx)
     num_shots = hyperparam_dict["shots"]
     backendnm = hyperparam_dict["backend"]
-    measurement_path = os.path.join(args.input_dir, "measurement",f"{num_shots}_shots_{backendnm}", f"{param_idx}th_param_{''.join([str(e) for e in h_l])}qbt_h_gate.npy")
+    basis = ''.join([str(e) for e in h_l])
+    measurement_path = os.path.join(args.input_dir, "measurement",f"{num_shots}_shots_{backendnm}", f"{param_idx}th_param_{basis}qbt_h_gate.npy")
+    ledger_path = os.path.join(os.path.dirname(measurement_path), "ledger.jsonl")
+    entry = ledger.get((int(param_idx), basis))
     if os.path.exists(measurement_path):
         #no need to save as it is already saved
         measurement = np.load(measurement_path, allow_pickle = "True").item()
+        if entry is None or entry["status"] != "done":
+            update_ledger(ledger_path, ledger, param_idx, basis, "done", path = measurement_path)
+        return measurement
+    if entry is not None and entry["status"] == "submitted":
+        #job is already submitted (and paid for), so retrieve it instead of resubmitting
+        try:
+            job = backend.retrieve_job(entry["job_id"])
+        except Exception as err:
+            #the job stays "submitted" with the error, so the next run retries the retrieve
+            update_ledger(ledger_path, ledger, param_idx, basis, "submitted", job_id = entry["job_id"], error = str(err))
+            raise
     else:
         m, n = hyperparam_dict["m"], hyperparam_dict["n"]
         circ = Q_Circuit(m, n, var_params, h_l, hyperparam_dict["n_layers"], hyperparam_dict["ansatz_type"])
@@ -41,11 +91,19 @@ def get_measurement(n_qbts, var_params, backend, h_l, hyperparam_dict, param_idx
         circ = transpile(circ, backend)
         job = backend.run(circ, shots = num_shots)
         if backendnm != "aer_simulator":
-            job_id = job.id()
+            entry = update_ledger(ledger_path, ledger, param_idx, basis, "submitted", job_id = job.id())
+    try:
+        if backendnm != "aer_simulator":
             job_monitor(job)
         result = job.result()
-        measurement = dict(result.get_counts())
-        np.save(measurement_path, measurement)
+    except Exception as err:
+        #a submitted (paid) job stays "submitted" after a polling or network error, so the next run retrieves it again
+        if entry is None or entry["status"] != "submitted" or is_job_failed(job):
+            update_ledger(ledger_path, ledger, param_idx, basis, "failed", job_id = None if entry is None else entry.get("job_id"), error = str(err))
+        raise
+    measurement = dict(result.get_counts())
+    save_atomic(measurement_path, measurement)
+    update_ledger(ledger_path, ledger, param_idx, basis, "done", path = measurement_path)
     return measurement
 
 def get_params(params_dir_path, param_idx):
@@ -61,12 +119,7 @@ def get_measurement_index_l(h_idx, z_indices):
 
 def get_fid(hyperparam_dict, param_idx, params_dir_path, ground_state, backend):
     var_params = get_params(params_dir_path, param_idx)
-    m, n = hyperparam_dict["m"], hyperparam_dict["n"]
-    circ = Q_Circuit(m, n, var_params, [], hyperparam_dict["n_layers"], hyperparam_dict["ansatz_type"])
-    circ.save_statevector()
-    result = backend.run(circ).result()
-    statevector = result.get_statevector(circ)
-    statevector = np.array(statevector)
+    statevector = get_statevector(hyperparam_dict, var_params, backend)
     fid_sqrt = np.vdot(statevector, ground_state)
     fid = np.vdot(fid_sqrt,fid_sqrt)
     return fid.real
@@ -87,8 +140,8 @@ def get_HR_distance(hyperparam_dict, param_idx, params_dir_path, backend):
     cov_mat[2, 2] = get_nNN_coupling(z_m, m, n, 2) - exp_nNN**2
 
     #cross terms
-    NN_index_l = flatten_neighbor_l(get_nearest_neighbors(m, n), m, n)
-    nNN_index_l = flatten_neighbor_l(get_next_nearest_neighbors(m, n), m, n)
+    lattice = get_lattice(m, n)
+    NN_index_l, nNN_index_l = lattice["NN_index_l"], lattice["nNN_index_l"]
     NN_nNN_val = - (exp_NN * exp_nNN)
 
     for NN_indices in NN_index_l:
@@ -103,8 +156,7 @@ def get_HR_distance(hyperparam_dict, param_idx, params_dir_path, backend):
     for h_idx in range(n_qbts):
         h_l = [h_idx]
         cross_m = get_measurement(n_qbts, var_params, backend, h_l, hyperparam_dict, param_idx)
-        X_NN_index_l = get_measurement_index_l(h_idx, NN_index_l)
-        X_nNN_index_l = get_measurement_index_l(h_idx, nNN_index_l)
+        X_NN_index_l, X_nNN_index_l = lattice["X_NN_index_l"][h_idx], lattice["X_nNN_index_l"][h_idx]
         for indices in X_NN_index_l:
             X_NN_val += get_exp_cross(cross_m, indices)
         for indices in X_nNN_index_l:
@@ -121,10 +173,16 @@ def get_HR_distance(hyperparam_dict, param_idx, params_dir_path, backend):
     return HR_dist
 
 def main(args):
+    global rng
     if not os.path.exists(os.path.join(args.input_dir,"VQE_hyperparam_dict.npy")):
         raise ValueError( "input directory must be a valid input path that contains VQE_hyperparam_dict.npy")
-    if not os.path.isdir(os.path.join(args.input_dir, "measurement", f"{args.shots}_shots_{args.backend}")):
-        os.makedirs(os.path.join(args.input_dir, "measurement", f"{args.shots}_shots_{args.backend}"))
+    if args.exact_sampling:
+        assert args.backend == "aer_simulator", "exact sampling is only compatible with aer_simulator backend"
+    rng = np.random.default_rng(args.seed)
+    #sampled measurements are kept apart from the ones of circuit runs and of other seeds
+    backend_tag = args.backend + f"_exact_seed{args.seed}" if args.exact_sampling else args.backend
+    if not os.path.isdir(os.path.join(args.input_dir, "measurement", f"{args.shots}_shots_{backend_tag}")):
+        os.makedirs(os.path.join(args.input_dir, "measurement", f"{args.shots}_shots_{backend_tag}"))
     if not os.path.isdir(os.path.join(args.input_dir, "HR_dist_hist")):
         os.makedirs(os.path.join(args.input_dir, "HR_dist_hist"))
     if not os.path.isdir(os.path.join(args.input_dir, "HR_hyperparam_dict")):
@@ -151,9 +209,10 @@ def main(args):
     #Need a new number of shots for HR distance for cost purposes.
     hyperparam_dict["shots"] = args.shots
     hyperparam_dict["backend"] = args.backend
+    hyperparam_dict["exact_sampling"] = args.exact_sampling
 
     print("This is hyperparameter dictionary newly constructed: ", hyperparam_dict)
-    np.save(os.path.join(args.input_dir, "HR_hyperparam_dict", f"{args.shots}_shots_{args.backend}.npy"), hyperparam_dict)
+    np.save(os.path.join(args.input_dir, "HR_hyperparam_dict", f"{args.shots}_shots_{backend_tag}.npy"), hyperparam_dict)
 
     with open(os.path.join(args.input_dir, "E_hist.pkl"), "rb") as fp:
         E_hist = pickle.load(fp)
@@ -164,13 +223,10 @@ def main(args):
     n_layers = hyperparam_dict["n_layers"]
 
     #get ground state NEED TO DELETE THIS LINE THO --> PROBABLY JUST GET IT WHEN VQE
-    Hamiltonian = get_Hamiltonian(m, n, J1, J2)
-    eigen_vals, eigen_vecs = np.linalg.eig(Hamiltonian)
-    argmin_idx = np.argmin(eigen_vals)
-    gst_E, ground_state = np.real(eigen_vals[argmin_idx]), eigen_vecs[:, argmin_idx]
+    Hamiltonian = get_sparse_Hamiltonian(m, n, J1, J2)
+    eigen_vals, eigen_vecs = eigsh(Hamiltonian, k = 1, which = "SA")
+    gst_E, ground_state = eigen_vals[0], eigen_vecs[:, 0]
 
-    NN_index_l= flatten_neighbor_l(get_nearest_neighbors(m, n), m, n)
-    nNN_index_l= flatten_neighbor_l(get_next_nearest_neighbors(m, n), m, n)
 
     HR_dist_hist = []
     fid_hist = []
@@ -182,12 +238,20 @@ def main(args):
     else:
         param_idx_l = list(range(len(E_hist)))
 
+    #restart the sweep exactly where it stopped
+    ledger_path = os.path.join(args.input_dir, "measurement", f"{args.shots}_shots_{backend_tag}", "ledger.jsonl")
+    ledger.update(load_ledger(ledger_path))
+
     for param_idx in param_idx_l:
+        entry = ledger.get((int(param_idx), "HR"))
+        if entry is not None and entry["status"] == "done":
+            print(f"HR distance for {param_idx}th param already in ledger: ", entry["HR_dist"])
+            continue
         HR_dist = get_HR_distance(hyperparam_dict, param_idx, params_dir_path, backend)
         print(f"This is HR distance: {HR_dist} for {param_idx}th param")
-        HR_dist_hist.append(HR_dist)
-        with open(os.path.join(args.input_dir, f"HR_dist_hist", f"{args.shots}shots_{args.backend}.pkl"), "wb") as fp:
-            pickle.dump(HR_dist_hist, fp)
+        update_ledger(ledger_path, ledger, param_idx, "HR", "done", HR_dist = HR_dist)
+    HR_dist_hist = [ledger[(int(param_idx), "HR")]["HR_dist"] for param_idx in param_idx_l]
+    dump_atomic(os.path.join(args.input_dir, f"HR_dist_hist", f"{args.shots}shots_{backend_tag}.pkl"), HR_dist_hist)
 
     #backend for fidelity should be different
     fid_backend = Aer.get_backend("aer_simulator")
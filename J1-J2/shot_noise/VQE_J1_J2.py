@@ -1,6 +1,7 @@
 import sys
 sys.path.insert(0, "../")
 import numpy as np
+from scipy.sparse.linalg import eigsh
 import os
 from qiskit import QuantumCircuit, Aer
 from qiskit.algorithms.optimizers import IMFIL
@@ -10,7 +11,7 @@ import argparse
 from functools import partial
 import pickle
 import matplotlib.pyplot as plt
-from shot_noise.utils import get_Hamiltonian, expectation_X, get_NN_coupling, get_nNN_coupling
+from shot_noise.utils import get_sparse_Hamiltonian, expectation_X, get_NN_coupling, get_nNN_coupling
 from shot_noise.utils import get_nearest_neighbors
 from shot_noise.Circuit import Q_Circuit
 
@@ -81,10 +82,9 @@ def main(args):
     else:
         raise ValueError("please type the correct ansatz type")
 
-    Hamiltonian = get_Hamiltonian(args.m, args.n, args.J1, args.J2)
-    eigen_vals, eigen_vecs = np.linalg.eig(Hamiltonian)
-    argmin_idx = np.argmin(eigen_vals)
-    gst_E, ground_state = np.real(eigen_vals[argmin_idx]), eigen_vecs[:, argmin_idx]
+    Hamiltonian = get_sparse_Hamiltonian(args.m, args.n, args.J1, args.J2)
+    eigen_vals, eigen_vecs = eigsh(Hamiltonian, k = 1, which = "SA")
+    gst_E, ground_state = eigen_vals[0], eigen_vecs[:, 0]
     print("This ground state energy: ", gst_E)
 
     # Sets parameter initialization here.
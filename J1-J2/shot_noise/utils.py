@@ -1,4 +1,11 @@
 import numpy as np
+import os
+import sys
+import json
+import pickle
+#the sparse matrix builder is shared by all models, in model_spec.py at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+from model_spec import get_sparse_X_plus_diag
 
 def get_num_mt(mt):
     num_mt_l = list(map(lambda x: 1 if x == '0' else -1, mt))
@@ -107,6 +114,80 @@ def flatten_neighbor_l(neighbor_l, m, n):
         flat_neighbor_l.append([n1, n2])
     return flat_neighbor_l
 
+#memoized lattice geometry: (m, n, periodic) -> lattice dict of get_lattice
+lattice_cache = {}
+
+def get_periodic_neighbors(m, n, offset_l):
+    """
+    Flattened bonds (i, j) - (i + di mod m, j + dj mod n) for (di, dj) in offset_l, without
+    self loops and duplicates (which appear when m or n <= 2)
+    """
+    flat_neighbor_l, seen = [], set()
+    for i in range(m):
+        for j in range(n):
+            for di, dj in offset_l:
+                n1, n2 = n*i + j, n*((i+di) % m) + (j+dj) % n
+                if n1 != n2 and (min(n1, n2), max(n1, n2)) not in seen:
+                    seen.add((min(n1, n2), max(n1, n2)))
+                    flat_neighbor_l.append([n1, n2])
+    return flat_neighbor_l
+
+def get_edge_coloring(index_l):
+    """
+    Greedy coloring of the bonds, bonds of one color share no qubit (gate layers of HVA)
+    """
+    nn_l = [indices.copy() for indices in index_l]
+    dict_idx = 0
+    nn_dict = {}
+    while len(nn_l) > 0:
+        seen_l = nn_l.pop(0)
+        nn_dict[dict_idx] = [seen_l.copy()]
+        new_nn_l = []
+        for nn in nn_l:
+            q1, q2 = nn
+            if q1 in seen_l or q2 in seen_l:
+                new_nn_l.append(nn)
+            else:
+                nn_dict[dict_idx].append(nn)
+                seen_l.append(q1)
+                seen_l.append(q2)
+        nn_l = new_nn_l
+        dict_idx += 1
+    return nn_dict
+
+def get_lattice(m, n, periodic = False):
+    """
+    Geometry of the m x n grid, built once per (m, n, periodic) and shared by all estimators.
+    Open boundary lists are in the same order as flatten_neighbor_l(get_nearest_neighbors(m, n), m, n).
+
+    Return:
+        lattice (dict):
+            NN_index_l, nNN_index_l: flattened neighbor lists
+            NN_index, nNN_index: the same as (n_bonds, 2) int arrays
+            NN_mask, nNN_mask: bit mask (1 << i) | (1 << j) of every bond
+            nn_dict: edge coloring of the NN bonds (get_nn_dict of Circuit.py)
+            X_NN_index_l, X_nNN_index_l: [h_idx] -> [[h_idx, i, j] for bonds [i, j] without h_idx],
+                the X ZZ cross terms measured in the basis with a Hadamard gate on h_idx
+    """
+    key = (m, n, periodic)
+    if key in lattice_cache:
+        return lattice_cache[key]
+    if periodic:
+        NN_index_l = get_periodic_neighbors(m, n, [(1, 0), (0, 1)])
+        nNN_index_l = get_periodic_neighbors(m, n, [(1, 1), (1, -1)])
+    else:
+        NN_index_l = flatten_neighbor_l(get_nearest_neighbors(m, n), m, n)
+        nNN_index_l = flatten_neighbor_l(get_next_nearest_neighbors(m, n), m, n)
+    lattice = {"m": m, "n": n, "periodic": periodic, "NN_index_l": NN_index_l, "nNN_index_l": nNN_index_l}
+    for name, index_l in [("NN", NN_index_l), ("nNN", nNN_index_l)]:
+        index = np.array(index_l, dtype = np.int64).reshape(-1, 2)
+        lattice[f"{name}_index"] = index
+        lattice[f"{name}_mask"] = (1 << index[:, 0]) | (1 << index[:, 1])
+        lattice[f"X_{name}_index_l"] = [[[h_idx, zi, zj] for zi, zj in index_l if h_idx != zi and h_idx != zj] for h_idx in range(m*n)]
+    lattice["nn_dict"] = get_edge_coloring(NN_index_l)
+    lattice_cache[key] = lattice
+    return lattice
+
 def expectation_X(x_m, expo):
     tot_val, tot_count = 0, 0
     for x_mt, m_count in x_m.items():
@@ -118,7 +199,7 @@ def expectation_X(x_m, expo):
 
 def get_NN_coupling(z_m, m, n, expo):
     tot_val, tot_count = 0, 0
-    NN_l = flatten_neighbor_l(get_nearest_neighbors(m, n), m , n)
+    NN_l = get_lattice(m, n)["NN_index_l"]
     for z_mt, m_count in z_m.items():
         z_mt = get_num_mt(z_mt)
         sum_zz = 0
@@ -131,7 +212,7 @@ def get_NN_coupling(z_m, m, n, expo):
 
 def get_nNN_coupling(z_m, m, n, expo):
     tot_val, tot_count = 0, 0
-    nNN_l = flatten_neighbor_l(get_next_nearest_neighbors(m, n), m , n)
+    nNN_l = get_lattice(m, n)["nNN_index_l"]
     for z_mt, m_count in z_m.items():
         z_mt = get_num_mt(z_mt)
         sum_zz = 0
@@ -170,3 +251,138 @@ def get_Hamiltonian(m, n, J1, J2):
     nNN_coord_l = get_next_nearest_neighbors(m, n)
     Hzz_J2 = create_partial_Hamiltonian(nNN_coord_l, m, n)
     return Hx + J1*Hzz_J1 + J2*Hzz_J2
+
+def get_sparse_Hamiltonian(m, n, J1, J2):
+    """
+    Same matrix as get_Hamiltonian(m, n, J1, J2) in CSR format, built from bit operations on all
+    2^N basis states at once instead of kron products. The ZZ energy of basis state s is
+    (number of bonds) - 2*(number of bonds [i, j] with bit i of s XOR bit j of s = 1).
+    """
+    N_qubits = m * n
+    basis = np.arange(2**N_qubits, dtype = np.int32)
+    bit_l = [((basis >> i) & 1).astype(np.int8) for i in range(N_qubits)]
+    H_diag = np.zeros(2**N_qubits)
+    for J, neighbor_l in [(J1, get_nearest_neighbors(m, n)), (J2, get_next_nearest_neighbors(m, n))]:
+        index_l = flatten_neighbor_l(neighbor_l, m, n)
+        #number of anti-aligned bonds of every basis state
+        n_anti = np.zeros(2**N_qubits, dtype = np.int16)
+        for i, j in index_l:
+            n_anti += bit_l[i] ^ bit_l[j]
+        H_diag += J * (len(index_l) - 2*n_anti)
+    return get_sparse_X_plus_diag(N_qubits, H_diag)
+
+def get_basis_probs(wf, h_l, N_qubits):
+    """
+    Exact measurement probabilities of wf after a Hadamard gate on every qubit in h_l,
+    computed with fast Walsh-Hadamard butterflies. Qubit i is bit i of the statevector index.
+
+    Args:
+        wf (numpy 1d vector): statevector of length 2^N_qubits
+        h_l (list): qubits measured in the X basis
+        N_qubits (int): number of qubits
+
+    Return:
+        probs (numpy 1d vector): probability of every basis state
+    """
+    wf = np.array(wf, dtype = complex)
+    for q in h_l:
+        v = wf.reshape(2**(N_qubits-1-q), 2, 2**q)
+        a = v[:, 0, :].copy()
+        v[:, 0, :] += v[:, 1, :]
+        v[:, 1, :] *= -1
+        v[:, 1, :] += a
+    probs = np.abs(wf)**2
+    return probs / 2**len(h_l)
+
+def sample_counts(probs, shots, rng):
+    """
+    Draw shots from the exact distribution probs with a single multinomial draw
+
+    Return:
+        counts (dict): same format as result.get_counts(), the bitstring lists qubit N-1 first
+    """
+    N_qubits = int(np.log2(len(probs)))
+    counts = rng.multinomial(shots, probs / probs.sum())
+    return {format(idx, f"0{N_qubits}b"): int(counts[idx]) for idx in np.flatnonzero(counts)}
+
+def load_ledger(ledger_path):
+    """
+    Replay the checkpoint ledger of a sweep.
+    The ledger is an append-only file with one JSON entry per line, each entry recording
+    the status ("submitted", "done" or "failed") of a (param_idx, basis) pair.
+
+    Args:
+        ledger_path (str): path to the ledger file
+
+    Return:
+        ledger (dict): latest entry of every (param_idx, basis) pair
+    """
+    ledger = {}
+    if not os.path.isfile(ledger_path):
+        return ledger
+    with open(ledger_path, "r+") as fp:
+        content = fp.read()
+        #drop a partially written last line, left over if the sweep was killed mid-write
+        if not content.endswith("\n"):
+            content = content[:content.rfind("\n") + 1]
+            fp.seek(0)
+            fp.truncate()
+            fp.write(content)
+    for line in content.splitlines():
+        entry = json.loads(line)
+        ledger[(entry["param_idx"], entry["basis"])] = entry
+    return ledger
+
+def update_ledger(ledger_path, ledger, param_idx, basis, status, **fields):
+    """
+    Append an entry to the ledger. Costs O(1) per call regardless of the sweep length.
+
+    Args:
+        ledger_path (str): path to the ledger file
+        ledger (dict): ledger loaded by load_ledger, updated in place
+        param_idx (int): parameter index
+        basis (str): measurement basis ("HR" for the HR distance of param_idx)
+        status (str): "submitted", "done" or "failed"
+        fields: extra fields to record (e.g. job_id, path, HR_dist)
+    """
+    entry = {"param_idx": int(param_idx), "basis": basis, "status": status}
+    entry.update(fields)
+    with open(ledger_path, "a") as fp:
+        fp.write(json.dumps(entry) + "\n")
+        fp.flush()
+        os.fsync(fp.fileno())
+    ledger[(entry["param_idx"], basis)] = entry
+    return entry
+
+def is_job_failed(job):
+    """
+    True if job reports a terminal ERROR or CANCELLED status. A job whose status can't be read (e.g. a
+    network error) may still finish, so it is not failed and its ledger entry stays "submitted".
+    """
+    try:
+        status = job.status()
+    except Exception:
+        return False
+    return getattr(status, "name", str(status)) in ("ERROR", "CANCELLED")
+
+def save_atomic(path, obj):
+    """
+    np.save obj to path through a temporary file, so that path never holds a partial result
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as fp:
+        np.save(fp, obj, allow_pickle = True)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, path)
+
+def dump_atomic(path, obj):
+    """
+    pickle.dump obj to path through a temporary file, so that path never holds a partial result
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as fp:
+        pickle.dump(obj, fp)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, path)
@@ -7,7 +7,7 @@ sys.path.insert(0, "../")
 from noiseless.Circuit import Q_Circuit as Q_Circuit_noiseless
 from shot_noise.Circuit import Q_Circuit as Q_Circuit_noise
 from noiseless.utils import get_Hx, expected_op1_op2, expected_op, create_partial_Hamiltonian
-from noiseless.HR_J1_J2 import get_params, get_operations_l
+from noiseless.HR_J1_J2 import get_params, get_operations_l, get_zz_diag_l
 from noiseless.HR_J1_J2 import get_HR_distance as get_HR_distance_noiseless
 from shot_noise.HR_J1_J2 import get_measurement_index_l
 from shot_noise.utils import expectation_X, get_NN_coupling, get_nNN_coupling, get_exp_cross
@@ -120,8 +120,7 @@ def test1():
     var_params = get_params(params_dir_path, param_idx)
     backend = Aer.get_backend(hyperparam_dict["backend"])
     statevector = get_statevector(m, n, var_params, hyperparam_dict["n_layers"], hyperparam_dict["ansatz_type"], backend)
-    ops_l = get_operations_l(m, n)
-    HR_dist_noiseless = get_HR_distance_noiseless(hyperparam_dict,statevector, ops_l)
+    HR_dist_noiseless = get_HR_distance_noiseless(hyperparam_dict,statevector, get_zz_diag_l(m, n))
     print("This is noiseless HR distance: ", HR_dist_noiseless)
     for _ in range(10):
         HR_dist_noisy = get_HR_distance(hyperparam_dict, param_idx, params_dir_path, backend)
@@ -0,0 +1,132 @@
+"""
+Helpers shared by the benchmark scripts: loading modules of the repo, timing, memory peaks, result
+files and the comparison of two result files.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import importlib
+import subprocess
+import tracemalloc
+import numpy as np
+import scipy
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+def load_module(root, rel_dir, name):
+    """
+    Import module name with root/rel_dir on sys.path, the way the scripts of rel_dir import it
+    """
+    module_dir = os.path.join(root, rel_dir)
+    if module_dir not in sys.path:
+        sys.path.insert(0, module_dir)
+    return importlib.import_module(name)
+
+def get_meta(root):
+    try:
+        commit = subprocess.run(["git", "-C", root, "rev-parse", "HEAD"], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "root": root, "date": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+            "numpy": np.__version__, "scipy": scipy.__version__, "machine": platform.machine(), "cpu_count": os.cpu_count()}
+
+def time_func(func, repeat, max_seconds):
+    """
+    Run func once, then repeat - 1 more times unless the first call took longer than max_seconds
+
+    Return:
+        time_l (list of seconds of every call)
+    """
+    start = time.perf_counter()
+    func()
+    time_l = [time.perf_counter() - start]
+    if time_l[0] > max_seconds:
+        return time_l
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        func()
+        time_l.append(time.perf_counter() - start)
+    return time_l
+
+def peak_memory(func):
+    """
+    Peak memory (bytes) allocated by one call of func, numpy buffers included
+    """
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+def get_peak_rss():
+    """
+    Peak resident set size of this process and its finished children in bytes (None if unavailable)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    scale = 1 if sys.platform == "darwin" else 1024
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale
+
+def write_results(path, meta, result_l):
+    with open(path, "w") as fp:
+        json.dump({"meta": meta, "results": result_l}, fp, indent = 1)
+
+def load_results(path):
+    with open(path, "r") as fp:
+        return json.load(fp)
+
+def compare_results(base, new, key_l, metric, threshold, higher_is_better = False):
+    """
+    Print metric of new relative to base for every result present in both and return the regressions
+
+    Args:
+        base, new (dict): loaded result files
+        key_l (list): result fields identifying a measurement, e.g. ["kernel", "N", "shots"]
+        metric (str): result field to compare
+        threshold (float): a ratio (slowdown) above threshold is a regression
+        higher_is_better (bool): True for throughputs, the slowdown is then base/new
+
+    Return:
+        regression_l (list of (key, ratio))
+    """
+    base_dict = {tuple(res.get(key) for key in key_l): res for res in base["results"] if res.get(metric) is not None}
+    regression_l = []
+    print(f"base: {base['meta'].get('commit')}  new: {new['meta'].get('commit')}  metric: {metric}")
+    for res in new["results"]:
+        key = tuple(res.get(k) for k in key_l)
+        if key not in base_dict or res.get(metric) is None:
+            continue
+        base_val, new_val = base_dict[key][metric], res[metric]
+        if base_val == 0 or new_val == 0:
+            continue
+        ratio = base_val / new_val if higher_is_better else new_val / base_val
+        flag = "REGRESSION" if ratio > threshold else ("faster" if ratio < 1 / threshold else "")
+        print(" ".join(f"{k}={v}" for k, v in zip(key_l, key)), f"base={base_val:.4g} new={new_val:.4g} slowdown={ratio:.3f}", flag)
+        if ratio > threshold:
+            regression_l.append((key, ratio))
+    print(f"{len(regression_l)} regressions above {threshold}x")
+    return regression_l
+
+def run_at_commits(script, commit_l, extra_args, output_dir):
+    """
+    Run script at every commit in a detached git worktree and return the paths of the result files.
+    The script of the working tree is used, its --root points the kernels to the worktree.
+    """
+    path_l = []
+    for commit in commit_l:
+        worktree = os.path.join(output_dir, f"worktree_{commit}")
+        output = os.path.join(output_dir, f"bench_{commit}.json")
+        subprocess.run(["git", "-C", ROOT_DIR, "worktree", "add", "--detach", worktree, commit], check = True)
+        try:
+            subprocess.run([sys.executable, script, "--root", worktree, "--output", output] + extra_args, check = True)
+        finally:
+            subprocess.run(["git", "-C", ROOT_DIR, "worktree", "remove", "--force", worktree], check = True)
+        path_l.append(output)
+    return path_l
@@ -0,0 +1,211 @@
+"""
+Micro-benchmarks of the Hamiltonian, estimator and HR kernels.
+
+Every kernel is timed over a grid of qubit numbers N (and shots for the kernels that read
+measurement counts) on synthetic states and counts drawn with a fixed seed, and the peak memory of
+one call is measured with tracemalloc. Results are written to a json file:
+
+    python benchmarks/kernels.py --N_l 4 8 12 16 20 --shots_l 1000 10000 100000 1000000 --output bench.json
+
+Compare two result files, or run the suite at two commits (in temporary git worktrees) and compare:
+
+    python benchmarks/kernels.py --compare base.json bench.json
+    python benchmarks/kernels.py --commits HEAD~5 HEAD --N_l 4 8 12
+
+The exit status is 1 if a kernel got slower than --threshold. Once a kernel takes more than
+--max_seconds at some (N, shots), larger sizes of that kernel are skipped. Kernels of scripts whose
+imports are missing (e.g. qiskit for the HR scripts) or of functions that do not exist at the
+benchmarked commit are recorded as skipped.
+
+J1-J2 kernels use the 2 x N/2 lattice and are skipped for odd N.
+"""
+
+import os
+import sys
+import tempfile
+import argparse
+import numpy as np
+from scipy.sparse.linalg import eigsh
+from bench_utils import ROOT_DIR, load_module, get_meta, time_func, peak_memory, write_results, load_results
+from bench_utils import compare_results, run_at_commits
+
+TFIM_DIR = os.path.join("1-D-TFIM", "periodic_TFIM_simulations")
+RANDOM_TFIM_DIR = os.path.join("1-D-TFIM", "random_TFIM")
+J = 0.5
+J1, J2 = 0.5, 0.2
+#synthetic measurements: (N, shots) -> counts
+counts_cache = {}
+
+def get_args(parser):
+    parser.add_argument('--N_l', type = int, nargs = '+', default = [4, 8, 12, 16, 20], help = "numbers of qubits (default: 4 8 12 16 20)")
+    parser.add_argument('--shots_l', type = int, nargs = '+', default = [1000, 10000, 100000, 1000000], help = "numbers of shots of the counts kernels (default: 10^3 .. 10^6)")
+    parser.add_argument('--kernels', type = str, nargs = '+', default = None, help = "run only these kernels (default: all)")
+    parser.add_argument('--repeat', type = int, default = 5, help = "number of timed calls per measurement (default: 5)")
+    parser.add_argument('--max_seconds', type = float, default = 10.0, help = "skip larger sizes of a kernel once a call takes longer (default: 10)")
+    parser.add_argument('--max_dense_N', type = int, default = 12, help = "largest N of the kernels that build dense 2^N x 2^N matrices (default: 12)")
+    parser.add_argument('--no_memory', action = 'store_true', help = "do not measure the peak memory")
+    parser.add_argument('--seed', type = int, default = 0, help = "seed of the synthetic states and counts (default: 0)")
+    parser.add_argument('--root', type = str, default = ROOT_DIR, help = "repository root whose kernels are benchmarked (default: this repository)")
+    parser.add_argument('--output', type = str, default = "bench_kernels.json", help = "result file (default: bench_kernels.json)")
+    parser.add_argument('--compare', type = str, nargs = 2, default = None, help = "compare two result files (base new) instead of running")
+    parser.add_argument('--commits', type = str, nargs = 2, default = None, help = "run the suite at two commits (base new) and compare")
+    parser.add_argument('--threshold', type = float, default = 1.2, help = "slowdown ratio reported as a regression (default: 1.2)")
+    args = parser.parse_args()
+    return args
+
+def get_random_state(N, rng):
+    wf = rng.normal(size = 2**N) + 1j * rng.normal(size = 2**N)
+    return wf / np.linalg.norm(wf)
+
+def get_synthetic_counts(N, shots, seed):
+    """
+    qiskit format counts of shots draws from the distribution of a random state, the same for every basis
+    """
+    if (N, shots) not in counts_cache:
+        rng = np.random.default_rng([seed, N, shots])
+        probs = np.abs(get_random_state(N, rng))**2
+        counts = rng.multinomial(shots, probs / probs.sum())
+        counts_cache[(N, shots)] = {format(idx, f"0{N}b"): int(counts[idx]) for idx in np.flatnonzero(counts)}
+    return counts_cache[(N, shots)]
+
+def patch_measurement(HR_module, counts):
+    """
+    Make get_HR_distance of an HR script read counts instead of running circuits
+    """
+    HR_module.get_measurement = lambda n_qbts, var_params, backend, h_l, hyperparam_dict, param_idx: counts
+    HR_module.get_params = lambda params_dir_path, param_idx: None
+
+def get_kernels(root):
+    """
+    Kernels as {name: (uses_shots, dense, setup)}. setup(N, shots, seed) returns the function to time
+    or None if the kernel does not apply to N.
+    """
+    tfim = lambda: load_module(root, TFIM_DIR, "utils_periodic")
+    rand = lambda: load_module(root, RANDOM_TFIM_DIR, "utils")
+    j1j2 = lambda: load_module(root, "J1-J2", "shot_noise.utils")
+    spec = lambda: load_module(root, "", "model_spec")
+    grid = lambda N: (2, N // 2) if N % 2 == 0 and N >= 4 else None
+
+    def tfim_ground_state(N, shots, seed):
+        return lambda: eigsh(tfim().get_sparse_Hamiltonian(N, J), k = 1, which = "SA")
+
+    def tfim_HR_distance(N, shots, seed):
+        HR_module = load_module(root, TFIM_DIR, "HR_run_periodic")
+        patch_measurement(HR_module, get_synthetic_counts(N, shots, seed))
+        hyperparam_dict = {"n_qbts": N, "J": J, "shots": shots}
+        return lambda: HR_module.get_HR_distance(hyperparam_dict, 0, None, None)
+
+    def cov_mat(module_name):
+        def setup(N, shots, seed):
+            utils = load_module(root, RANDOM_TFIM_DIR, module_name)
+            ops_l = [rand().Si('x', N), rand().SiSi('zz', N)]
+            wf = get_random_state(N, np.random.default_rng(seed))
+            return lambda: utils.cov_mat(ops_l, wf)
+        return setup
+
+    def distanceVecFromSubspace(N, shots, seed):
+        rng = np.random.default_rng(seed)
+        w, A = rng.normal(size = 3), np.linalg.qr(rng.normal(size = (3, 1)))[0]
+        return lambda: rand().distanceVecFromSubspace(w, A)
+
+    def j1j2_ground_state(N, shots, seed):
+        m, n = grid(N)
+        return lambda: eigsh(j1j2().get_sparse_Hamiltonian(m, n, J1, J2), k = 1, which = "SA")
+
+    def j1j2_HR_distance(N, shots, seed):
+        m, n = grid(N)
+        HR_module = load_module(root, "J1-J2", "shot_noise.HR_J1_J2")
+        patch_measurement(HR_module, get_synthetic_counts(N, shots, seed))
+        hyperparam_dict = {"m": m, "n": n, "J1": J1, "J2": J2, "shots": shots}
+        return lambda: HR_module.get_HR_distance(hyperparam_dict, 0, None, None)
+
+    def model_spec_HR_cov(N, shots, seed):
+        model_spec = spec()
+        m, n = grid(N)
+        model = model_spec.compile_model(model_spec.get_J1_J2_spec(m, n, J1, J2))
+        counts = get_synthetic_counts(N, shots, seed)
+        def func():
+            dist = model_spec.counts_to_dist(counts)
+            cov = model_spec.get_HR_cov(model, dist, dist, {h: dist for h in model["X_sites"]})
+            return model_spec.get_HR_distance(model, cov)
+        return func
+
+    kernel_dict = {
+        "tfim_get_Hamiltonian": (False, True, lambda N, shots, seed: lambda: tfim().get_Hamiltonian(N, J)),
+        "tfim_get_sparse_Hamiltonian": (False, False, lambda N, shots, seed: lambda: tfim().get_sparse_Hamiltonian(N, J)),
+        "tfim_ground_state": (False, False, tfim_ground_state),
+        "tfim_get_exp_X": (True, False, lambda N, shots, seed: lambda: tfim().get_exp_X(get_synthetic_counts(N, shots, seed), 2)),
+        "tfim_get_exp_ZZ": (True, False, lambda N, shots, seed: lambda: tfim().get_exp_ZZ(get_synthetic_counts(N, shots, seed), 2)),
+        "tfim_get_exp_cross": (True, False, lambda N, shots, seed: lambda: tfim().get_exp_cross(get_synthetic_counts(N, shots, seed), [0, 1, 2])),
+        "tfim_HR_distance": (True, False, tfim_HR_distance),
+        "cov_mat": (False, True, cov_mat("utils")),
+        "cov_mat_cpu": (False, True, cov_mat("utils_cpu")),
+        "distanceVecFromSubspace": (False, False, distanceVecFromSubspace),
+        "j1j2_get_Hamiltonian": (False, True, lambda N, shots, seed: grid(N) and (lambda: j1j2().get_Hamiltonian(*grid(N), J1, J2))),
+        "j1j2_get_sparse_Hamiltonian": (False, False, lambda N, shots, seed: grid(N) and (lambda: j1j2().get_sparse_Hamiltonian(*grid(N), J1, J2))),
+        "j1j2_ground_state": (False, False, lambda N, shots, seed: grid(N) and j1j2_ground_state(N, shots, seed)),
+        "j1j2_expectation_X": (True, False, lambda N, shots, seed: grid(N) and (lambda: j1j2().expectation_X(get_synthetic_counts(N, shots, seed), 2))),
+        "j1j2_get_NN_coupling": (True, False, lambda N, shots, seed: grid(N) and (lambda: j1j2().get_NN_coupling(get_synthetic_counts(N, shots, seed), *grid(N), 2))),
+        "j1j2_get_exp_cross": (True, False, lambda N, shots, seed: grid(N) and (lambda: j1j2().get_exp_cross(get_synthetic_counts(N, shots, seed), [0, 1, 2, 3]))),
+        "j1j2_HR_distance": (True, False, lambda N, shots, seed: grid(N) and j1j2_HR_distance(N, shots, seed)),
+        "model_spec_HR_cov": (True, False, lambda N, shots, seed: grid(N) and model_spec_HR_cov(N, shots, seed)),
+    }
+    return kernel_dict
+
+def run_kernel(name, kernel, args):
+    uses_shots, dense, setup = kernel
+    result_l, too_slow_l = [], []
+    for N in args.N_l:
+        for shots in (args.shots_l if uses_shots else [None]):
+            result = {"kernel": name, "N": N, "shots": shots}
+            if dense and N > args.max_dense_N:
+                continue
+            if any(N >= N_slow and (shots or 0) >= (shots_slow or 0) for N_slow, shots_slow in too_slow_l):
+                result_l.append(dict(result, skipped = f"slower than {args.max_seconds} s at a smaller size"))
+                continue
+            try:
+                func = setup(N, shots, args.seed)
+                if not func:
+                    continue
+                #warm up: module import, lattice caches and synthetic counts are not timed
+                func()
+                time_l = time_func(func, args.repeat, args.max_seconds)
+            except (ImportError, AttributeError) as err:
+                result_l.append(dict(result, skipped = f"{type(err).__name__}: {err}"))
+                print(name, f"skipped ({type(err).__name__}: {err})")
+                return result_l
+            result.update({"min_s": min(time_l), "median_s": float(np.median(time_l)), "n_calls": len(time_l)})
+            if not args.no_memory:
+                result["peak_mem_bytes"] = peak_memory(func)
+            if time_l[0] > args.max_seconds:
+                too_slow_l.append((N, shots))
+            print(name, f"N={N}", f"shots={shots}", f"min={result['min_s']:.4g}s", f"median={result['median_s']:.4g}s",
+                  f"peak_mem={result.get('peak_mem_bytes', 0)/2**20:.1f}MiB")
+            result_l.append(result)
+    return result_l
+
+def main(args):
+    if args.compare is not None:
+        regression_l = compare_results(load_results(args.compare[0]), load_results(args.compare[1]), ["kernel", "N", "shots"], "min_s", args.threshold)
+        sys.exit(1 if regression_l else 0)
+    if args.commits is not None:
+        extra_args = ["--N_l"] + [str(N) for N in args.N_l] + ["--shots_l"] + [str(shots) for shots in args.shots_l]
+        extra_args += ["--repeat", str(args.repeat), "--max_seconds", str(args.max_seconds), "--max_dense_N", str(args.max_dense_N), "--seed", str(args.seed)]
+        extra_args += (["--kernels"] + args.kernels if args.kernels else []) + (["--no_memory"] if args.no_memory else [])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            base_path, new_path = run_at_commits(os.path.realpath(__file__), args.commits, extra_args, tmp_dir)
+            regression_l = compare_results(load_results(base_path), load_results(new_path), ["kernel", "N", "shots"], "min_s", args.threshold)
+        sys.exit(1 if regression_l else 0)
+
+    root = os.path.realpath(args.root)
+    kernel_dict = get_kernels(root)
+    result_l = []
+    for name in (args.kernels or kernel_dict.keys()):
+        result_l += run_kernel(name, kernel_dict[name], args)
+    write_results(args.output, get_meta(root), result_l)
+    print(f"results written to {args.output}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Micro-benchmarks of the Hamiltonian, estimator and HR kernels")
+    args = get_args(parser)
+    main(args)
@@ -0,0 +1,185 @@
+"""
+End-to-end throughput benchmark of the VQE and HR scripts.
+
+Every case runs the production scripts as separate processes, the way sweep.py does, in a
+temporary output directory:
+    1. a short VQE (IMFIL, --VQE_max_iter iterations) against AerSimulator
+    2. an HR sweep over --n_HR_points param_idx values spread evenly over the VQE history
+       (param_idx_l.npy, --param_idx_l), with the VQE p1/p2 noise
+
+Cases (--cases, default: all):
+    TFIM_6 / TFIM_6_noisy: periodic 1-D TFIM, 6 qubits
+    J1_J2_2x3 / J1_J2_2x3_noisy, J1_J2_3x3 / J1_J2_3x3_noisy: J1-J2 with depolarization and shot noise
+The noisy cases use p1 = 0.001, p2 = 0.01.
+
+Reported per case and stage: wall time (process start to exit, imports included), energy
+evaluations per second (VQE) or HR points per second (HR), peak RSS of the process and the number
+and size of the files it wrote. Results go to a json file, and --compare checks two of them:
+
+    python benchmarks/throughput.py --output throughput.json
+    python benchmarks/throughput.py --compare base.json throughput.json
+
+The number of energy evaluations of an IMFIL iteration depends on the number of parameters, so the
+evaluations are counted from E_hist.pkl rather than fixed.
+"""
+
+import os
+import sys
+import time
+import pickle
+import shutil
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+from bench_utils import ROOT_DIR, get_meta, write_results, load_results, compare_results
+sys.path.insert(0, ROOT_DIR)
+from sweep import MODEL_DIR_DICT, get_cli_args, gst_E_is_done
+
+NOISE_DICT = {"": {"p1": 0.0, "p2": 0.0}, "_noisy": {"p1": 0.001, "p2": 0.01}}
+CASE_DICT = {}
+for suffix, noise in NOISE_DICT.items():
+    CASE_DICT["TFIM_6" + suffix] = {"model": "TFIM", "VQE_args": {"n_qbts": 6, "J": 0.5, "n_layers": 3, **noise}}
+    CASE_DICT["J1_J2_2x3" + suffix] = {"model": "J1_J2", "VQE_args": {"m": 2, "n": 3, "J1": 0.5, "J2": 0.05, "n_layers": 3, **noise}}
+    CASE_DICT["J1_J2_3x3" + suffix] = {"model": "J1_J2", "VQE_args": {"m": 3, "n": 3, "J1": 0.5, "J2": 0.05, "n_layers": 3, **noise}}
+
+def get_args(parser):
+    parser.add_argument('--cases', type = str, nargs = '+', default = None, help = f"cases to run (default: all of {list(CASE_DICT.keys())})")
+    parser.add_argument('--VQE_max_iter', type = int, default = 2, help = "IMFIL iterations of the VQE (default: 2)")
+    parser.add_argument('--VQE_shots', type = int, default = 10000, help = "shots per energy evaluation (default: 10000)")
+    parser.add_argument('--HR_shots', type = int, default = 1000, help = "shots per HR basis (default: 1000)")
+    parser.add_argument('--n_HR_points', type = int, default = 50, help = "number of param_idx of the HR sweep (default: 50)")
+    parser.add_argument('--seed', type = int, default = 0, help = "seed of the initial VQE parameters (default: 0)")
+    parser.add_argument('--work_dir', type = str, default = None, help = "directory of the script outputs (default: a temporary directory, removed at exit)")
+    parser.add_argument('--output', type = str, default = "bench_throughput.json", help = "result file (default: bench_throughput.json)")
+    parser.add_argument('--compare', type = str, nargs = 2, default = None, help = "compare two result files (base new) instead of running")
+    parser.add_argument('--threshold', type = float, default = 1.2, help = "throughput loss ratio reported as a regression (default: 1.2)")
+    args = parser.parse_args()
+    return args
+
+def run_process(cmd, cwd, log_path):
+    """
+    Run cmd and wait for it
+
+    Return:
+        return code, wall time (s), peak RSS of the process (bytes, None if unavailable)
+    """
+    env = dict(os.environ)
+    env.setdefault("MPLBACKEND", "Agg")
+    start = time.perf_counter()
+    with open(log_path, "w") as fp:
+        fp.write(" ".join(cmd) + "\n")
+        fp.flush()
+        proc = subprocess.Popen(cmd, cwd = cwd, stdout = fp, stderr = subprocess.STDOUT, env = env)
+        if hasattr(os, "wait4"):
+            _, status, rusage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            peak_rss = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+        else:
+            proc.wait()
+            peak_rss = None
+    return proc.returncode, time.perf_counter() - start, peak_rss
+
+def get_file_stats(dir_path):
+    """
+    Number of files under dir_path and their total size in bytes
+    """
+    n_files, n_bytes = 0, 0
+    for dirpath, _, filename_l in os.walk(dir_path):
+        for filename in filename_l:
+            n_files += 1
+            n_bytes += os.path.getsize(os.path.join(dirpath, filename))
+    return n_files, n_bytes
+
+def get_stage_result(case_nm, stage, returncode, wall_s, peak_rss, file_stats_before, file_stats_after, n_items, item_nm):
+    result = {"case": case_nm, "stage": stage, "returncode": returncode, "wall_s": wall_s, "peak_rss_bytes": peak_rss,
+              "files_written": file_stats_after[0] - file_stats_before[0], "bytes_written": file_stats_after[1] - file_stats_before[1],
+              item_nm: n_items, "per_s": n_items / wall_s if returncode == 0 else None}
+    print(case_nm, stage, f"returncode={returncode}", f"wall={wall_s:.2f}s", f"{item_nm}={n_items}",
+          f"per_s={result['per_s'] or 0:.3g}", f"peak_rss={(peak_rss or 0)/2**20:.0f}MiB", f"files={result['files_written']}")
+    return result
+
+def prepare_gst_E(VQE_args, work_dir):
+    """
+    The TFIM VQE reads its ground state energy from gst_E_dict_J_{J}_periodic.npy (--gst_E_dir), computed
+    once like in sweep.py, in work_dir so the dictionaries of the source tree stay untouched
+    """
+    J = float(VQE_args["J"])
+    if not gst_E_is_done(os.path.join(work_dir, f"gst_E_dict_J_{J}_periodic.npy"), [VQE_args["n_qbts"]]):
+        cmd = [sys.executable, os.path.join(ROOT_DIR, "1-D-TFIM", "get_gst_E.py")] + get_cli_args({"J": J, "max_n_qbts": VQE_args["n_qbts"], "periodic": True})
+        subprocess.run(cmd, cwd = work_dir, check = True)
+
+def get_n_params(model, VQE_args):
+    """
+    Number of ALA parameters of the VQE scripts
+    """
+    n_layers = VQE_args["n_layers"]
+    if model == "TFIM":
+        return n_layers * VQE_args["n_qbts"]
+    n_qbts = VQE_args["m"] * VQE_args["n"]
+    if n_qbts % 2 == 1:
+        return n_layers * (n_qbts - 1)
+    return sum(n_qbts if i % 2 == 0 else n_qbts - 2 for i in range(n_layers))
+
+def run_case(case_nm, case, args, work_dir):
+    model, VQE_args = case["model"], case["VQE_args"]
+    cwd = MODEL_DIR_DICT[model]
+    run_dir = os.path.join(work_dir, case_nm)
+    os.makedirs(os.path.join(run_dir, "params_dir"), exist_ok = True)
+    init_param_path = os.path.join(work_dir, f"{case_nm}_init_param.npy")
+    np.save(init_param_path, np.random.default_rng(args.seed).uniform(-np.pi, np.pi, size = get_n_params(model, VQE_args)))
+    if model == "TFIM":
+        prepare_gst_E(VQE_args, work_dir)
+        VQE_args = {**VQE_args, "gst_E_dir": work_dir}
+    result_l = []
+
+    #VQE
+    VQE_script = "VQE_run_periodic.py" if model == "TFIM" else "VQE_J1_J2.py"
+    VQE_arg_dict = {**VQE_args, "shots": args.VQE_shots, "max_iter": args.VQE_max_iter, "optimizer": "IMFIL",
+                    "init_param": init_param_path, "output_dir": run_dir}
+    file_stats = get_file_stats(run_dir)
+    returncode, wall_s, peak_rss = run_process([sys.executable, VQE_script] + get_cli_args(VQE_arg_dict), cwd, os.path.join(work_dir, f"{case_nm}_VQE.log"))
+    E_hist_path = os.path.join(run_dir, "E_hist.pkl")
+    n_evals = 0
+    if os.path.isfile(E_hist_path):
+        with open(E_hist_path, "rb") as fp:
+            n_evals = len(pickle.load(fp))
+    result_l.append(get_stage_result(case_nm, "VQE", returncode, wall_s, peak_rss, file_stats, get_file_stats(run_dir), n_evals, "n_evals"))
+    if returncode != 0 or n_evals == 0:
+        return result_l
+
+    #HR sweep
+    param_idx_l = np.unique(np.linspace(0, n_evals - 1, args.n_HR_points).astype(int))
+    np.save(os.path.join(run_dir, "param_idx_l.npy"), param_idx_l)
+    HR_script = "HR_run_periodic.py" if model == "TFIM" else "HR_J1_J2.py"
+    HR_arg_dict = {"input_dir": run_dir, "shots": args.HR_shots, "backend": "aer_simulator", "use_VQE_p1_p2": True, "param_idx_l": True}
+    file_stats = get_file_stats(run_dir)
+    returncode, wall_s, peak_rss = run_process([sys.executable, HR_script] + get_cli_args(HR_arg_dict), cwd, os.path.join(work_dir, f"{case_nm}_HR.log"))
+    result_l.append(get_stage_result(case_nm, "HR", returncode, wall_s, peak_rss, file_stats, get_file_stats(run_dir), len(param_idx_l), "n_points"))
+    return result_l
+
+def main(args):
+    if args.compare is not None:
+        regression_l = compare_results(load_results(args.compare[0]), load_results(args.compare[1]), ["case", "stage"], "per_s", args.threshold, higher_is_better = True)
+        sys.exit(1 if regression_l else 0)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix = "bench_throughput_")
+    os.makedirs(work_dir, exist_ok = True)
+    result_l = []
+    try:
+        for case_nm in (args.cases or CASE_DICT.keys()):
+            result_l += run_case(case_nm, CASE_DICT[case_nm], args, work_dir)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors = True)
+    meta = get_meta(ROOT_DIR)
+    meta.update({"VQE_max_iter": args.VQE_max_iter, "VQE_shots": args.VQE_shots, "HR_shots": args.HR_shots, "n_HR_points": args.n_HR_points})
+    write_results(args.output, meta, result_l)
+    print(f"results written to {args.output}")
+    if any(result["returncode"] != 0 for result in result_l):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "End-to-end VQE and HR throughput benchmark")
+    args = get_args(parser)
+    main(args)
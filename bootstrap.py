@@ -0,0 +1,142 @@
+"""
+Bootstrap error bars of HR distances, energies and HR covariance eigenvalues from stored counts.
+
+The HR scripts report one HR distance per param_idx, and getting its spread by rerunning the
+circuits costs simulation or hardware time. The bootstrap only needs the stored counts: the counts
+of every basis (Z, X and the per-qubit Hadamard bases) are redrawn n_boot times with one multinomial
+draw per basis, and all replicates go through the covariance and eigh kernels of model_spec.py at
+once (the weights carry a leading replicate axis). Bases are resampled independently, like they
+are measured.
+
+    python bootstrap.py --model TFIM --input_dir RUN_DIR --n_boot 2000
+    python bootstrap.py --model J1_J2 --input_dir RUN_DIR --shots 1000 --use_VQE_p1_p2 --param_idx_l
+
+The measurements are read from the store of the HR scripts (input_dir/measurement for the periodic
+TFIM, input_dir/measurement/{shots}_shots_{backend}_p1_{p1}_p2_{p2} for J1-J2). Missing Z and X
+bases are read from input_dir/measurement/VQE (VQE --save_counts), and param_idx without stored
+measurements are skipped. The point estimates, percentile confidence intervals and bootstrap
+standard deviations of every param_idx are written to input_dir/HR_bootstrap_{...}.pkl:
+
+    {param_idx: {"HR_dist": {"estimate", "lo", "hi", "std"}, "E": {...}, "eigvals": {...}}}
+
+From python, with counts at hand (e.g. worker.py HR_point with return_counts = True):
+
+    result = bootstrap_HR(model, z_m, x_m, cross_m_dict, n_boot = 2000, rng = np.random.default_rng(0))
+"""
+
+import os
+import time
+import pickle
+import argparse
+import numpy as np
+import model_spec
+
+def get_args(parser):
+    parser.add_argument('--model', type = str, choices = ["TFIM", "J1_J2"], help = "TFIM (periodic 1-D TFIM) or J1_J2")
+    parser.add_argument('--input_dir', type = str, help = "VQE output directory with VQE_hyperparam_dict.npy and the HR measurements")
+    parser.add_argument('--n_boot', type = int, default = 1000, help = "number of bootstrap replicates (default: 1000)")
+    parser.add_argument('--alpha', type = float, default = 0.05, help = "the confidence intervals cover 1 - alpha (default: 0.05)")
+    parser.add_argument('--seed', type = int, default = None, help = "seed of the resampling (default: None)")
+    parser.add_argument('--param_idx_l', action = 'store_true', help = "only use the parameter indices of param_idx_l.npy in input_dir")
+    parser.add_argument('--shots', type = int, default = 1000, help = "J1_J2: shots of the HR measurements (default: 1000)")
+    parser.add_argument('--backend', type = str, default = "aer_simulator", help = "J1_J2: backend of the HR measurements (default: aer_simulator)")
+    parser.add_argument('--p1', type = float, default = 0.0, help = "J1_J2: p1 of the HR measurements (default: 0.0)")
+    parser.add_argument('--p2', type = float, default = 0.0, help = "J1_J2: p2 of the HR measurements (default: 0.0)")
+    parser.add_argument('--use_VQE_p1_p2', action = 'store_true', help = "J1_J2: the HR measurements used the VQE p1 and p2 values")
+    args = parser.parse_args()
+    return args
+
+def get_model(model, hyperparam_dict):
+    if model == "TFIM":
+        spec = model_spec.get_TFIM_spec(hyperparam_dict["n_qbts"], hyperparam_dict["J"], periodic = True)
+    else:
+        spec = model_spec.get_J1_J2_spec(hyperparam_dict["m"], hyperparam_dict["n"], hyperparam_dict["J1"], hyperparam_dict["J2"])
+    return model_spec.compile_model(spec)
+
+def get_summary(estimate, replicates, alpha):
+    """
+    Point estimate with the percentile confidence interval and standard deviation of its replicates
+    """
+    lo, hi = np.quantile(replicates, [alpha/2, 1 - alpha/2], axis = 0)
+    return {"estimate": estimate, "lo": lo, "hi": hi, "std": np.std(replicates, axis = 0, ddof = 1)}
+
+def bootstrap_HR(model, z_m, x_m, cross_m_dict, n_boot, rng, alpha = 0.05):
+    """
+    Bootstrap the HR distance, energy and covariance eigenvalues of one parameter vector
+
+    Args:
+        model (dict): compiled model of model_spec.py
+        z_m, x_m: counts of the Z and X basis
+        cross_m_dict: {h: counts} of the basis with a Hadamard gate on qubit h only, for h in model["X_sites"]
+        n_boot (int): number of replicates
+        rng (numpy Generator): random number generator
+        alpha (float): the confidence intervals cover 1 - alpha
+
+    Return:
+        result (dict): get_summary of "HR_dist", "E" and "eigvals" (ascending)
+    """
+    z_dist, x_dist = model_spec.counts_to_dist(z_m), model_spec.counts_to_dist(x_m)
+    cross_dist_dict = {h: model_spec.counts_to_dist(cross_m_dict[h]) for h in model["X_sites"]}
+    cov_mat = model_spec.get_HR_cov(model, z_dist, x_dist, cross_dist_dict)
+    z_boot, x_boot = model_spec.resample_dist(z_m, n_boot, rng), model_spec.resample_dist(x_m, n_boot, rng)
+    cross_boot_dict = {h: model_spec.resample_dist(cross_m_dict[h], n_boot, rng) for h in model["X_sites"]}
+    cov_boot = model_spec.get_HR_cov(model, z_boot, x_boot, cross_boot_dict)
+    return {"HR_dist": get_summary(model_spec.get_HR_distance(model, cov_mat), model_spec.get_HR_distance(model, cov_boot), alpha),
+            "E": get_summary(model_spec.get_energy(model, z_dist, x_dist), model_spec.get_energy(model, z_boot, x_boot), alpha),
+            "eigvals": get_summary(np.linalg.eigvalsh(cov_mat), np.linalg.eigvalsh(cov_boot), alpha)}
+
+def load_counts(measurement_dir, VQE_dir, param_idx, h_l):
+    """
+    Stored counts of param_idx in the basis with Hadamard gates on h_l, None if they are not stored
+    """
+    filename = f"{param_idx}th_param_{''.join([str(e) for e in h_l])}qbt_h_gate.npy"
+    for dir_path in [measurement_dir, VQE_dir]:
+        path = os.path.join(dir_path, filename)
+        if os.path.exists(path):
+            return np.load(path, allow_pickle = True).item()
+    return None
+
+def main(args):
+    hyperparam_dict = np.load(os.path.join(args.input_dir, "VQE_hyperparam_dict.npy"), allow_pickle = True).item()
+    model = get_model(args.model, hyperparam_dict)
+    n_qbts = model["n_qubits"]
+    if args.model == "TFIM":
+        measurement_dir, tag = os.path.join(args.input_dir, "measurement"), f"{args.n_boot}boot"
+    else:
+        p1, p2 = (hyperparam_dict["p1"], hyperparam_dict["p2"]) if args.use_VQE_p1_p2 else (args.p1, args.p2)
+        measurement_nm = f"{args.shots}_shots_{args.backend}_p1_{p1}_p2_{p2}"
+        measurement_dir, tag = os.path.join(args.input_dir, "measurement", measurement_nm), f"{measurement_nm}_{args.n_boot}boot"
+    VQE_dir = os.path.join(args.input_dir, "measurement", "VQE")
+
+    if args.param_idx_l:
+        param_idx_l = np.load(os.path.join(args.input_dir, "param_idx_l.npy"), allow_pickle = True)
+    else:
+        with open(os.path.join(args.input_dir, "E_hist.pkl"), "rb") as fp:
+            param_idx_l = list(range(len(pickle.load(fp))))
+
+    rng = np.random.default_rng(args.seed)
+    result_dict = {}
+    for param_idx in param_idx_l:
+        z_m = load_counts(measurement_dir, VQE_dir, param_idx, [])
+        x_m = load_counts(measurement_dir, VQE_dir, param_idx, list(range(n_qbts)))
+        cross_m_dict = {h: load_counts(measurement_dir, VQE_dir, param_idx, [h]) for h in model["X_sites"]}
+        if z_m is None or x_m is None or any(cross_m is None for cross_m in cross_m_dict.values()):
+            continue
+        start = time.perf_counter()
+        result = bootstrap_HR(model, z_m, x_m, cross_m_dict, args.n_boot, rng, args.alpha)
+        elapsed = time.perf_counter() - start
+        result_dict[int(param_idx)] = result
+        HR, E = result["HR_dist"], result["E"]
+        print(f"{param_idx}th param: HR distance {HR['estimate']:.4f} [{HR['lo']:.4f}, {HR['hi']:.4f}], "
+              f"E {E['estimate']:.4f} [{E['lo']:.4f}, {E['hi']:.4f}] ({1000 * elapsed:.1f} ms)")
+    if not result_dict:
+        raise ValueError(f"no param_idx has stored Z, X and Hadamard basis measurements in {measurement_dir}")
+    output_path = os.path.join(args.input_dir, f"HR_bootstrap_{tag}.pkl")
+    with open(output_path, "wb") as fp:
+        pickle.dump(result_dict, fp)
+    print(f"{len(result_dict)} param_idx with {100 * (1 - args.alpha):g}% confidence intervals written to {output_path}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Bootstrap confidence intervals of HR distances and energies from stored counts")
+    args = get_args(parser)
+    main(args)
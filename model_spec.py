@@ -0,0 +1,321 @@
+"""
+Declarative model specification for Hamiltonian reconstruction.
+
+A model is a lattice (or an explicit graph) and a list of term groups. Every term group is a sum of
+X or Z Pauli strings with one coupling, and is one coordinate of the HR vector:
+
+    spec = {
+        "lattice": {"type": "grid", "m": 3, "n": 4, "periodic": False},
+        "terms": [
+            {"name": "X", "pauli": "X", "coupling": 1.0},
+            {"name": "J1", "pauli": "ZZ", "bonds": "NN", "coupling": 0.5},
+            {"name": "J2", "pauli": "ZZ", "bonds": "nNN", "coupling": 0.05},
+        ],
+    }
+
+Lattice types and their bond sets:
+    chain (N, periodic): NN, nNN
+    grid (m, n, periodic): NN, nNN (diagonals). Qubit n*i + j, same bonds as the J1-J2 scripts
+    ladder (L): leg, rung
+    triangular (m, n, periodic): NN
+    kagome (m, n): NN, 3 qubits per unit cell
+    graph (n_qubits, bonds): explicit {"bond set name": [[i, j], ...]}
+"X"/"Z" terms act on "sites" (default: all qubits), "ZZ" terms on a bond set or explicit "edges".
+
+compile_model turns a spec into the sparse Hamiltonian, the bit masks of every term, the HR
+coupling vector and the term tables of get_HR_cov, which estimates the HR covariance matrix from
+Z, X and per-qubit Hadamard basis measurements (qiskit counts) or from exact distributions
+(get_state_distributions). New models get the fast path without another copy of utils.py.
+
+The weights of a distribution may have a leading replicate axis (e.g. resample_dist), then
+get_energy, get_HR_cov and get_HR_distance return one result per replicate in one pass.
+"""
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.linalg import eigsh
+
+def get_chain_bonds(N, periodic = False):
+    n_bonds = N if periodic else N - 1
+    NN = [[i, (i+1) % N] for i in range(n_bonds)]
+    nNN = [[i, (i+2) % N] for i in range(N if periodic else N - 2)]
+    return N, {"NN": NN, "nNN": nNN}
+
+def get_grid_bonds(m, n, periodic = False):
+    NN, nNN = [], []
+    for i in range(m):
+        for j in range(n):
+            if i + 1 < m or periodic:
+                NN.append([n*i + j, n*((i+1) % m) + j])
+            if j + 1 < n or periodic:
+                NN.append([n*i + j, n*i + (j+1) % n])
+    for i in range(m):
+        for j in range(n):
+            if (i + 1 < m and j + 1 < n) or periodic:
+                nNN.append([n*i + j, n*((i+1) % m) + (j+1) % n])
+            if (i + 1 < m and j - 1 >= 0) or periodic:
+                nNN.append([n*i + j, n*((i+1) % m) + (j-1) % n])
+    return m * n, {"NN": NN, "nNN": nNN}
+
+def get_ladder_bonds(L):
+    leg = [[i, i+1] for i in range(L - 1)] + [[L + i, L + i + 1] for i in range(L - 1)]
+    rung = [[i, L + i] for i in range(L)]
+    return 2 * L, {"leg": leg, "rung": rung}
+
+def get_triangular_bonds(m, n, periodic = False):
+    N, bond_dict = get_grid_bonds(m, n, periodic)
+    diag = [bond for bond in bond_dict["nNN"][::2]] if periodic else \
+           [[n*i + j, n*(i+1) + j + 1] for i in range(m - 1) for j in range(n - 1)]
+    return N, {"NN": bond_dict["NN"] + diag}
+
+def get_kagome_bonds(m, n):
+    """
+    m x n unit cells with sites a, b, c = 3*(n*i + j) + 0, 1, 2. a-b along a1, a-c along a2
+    """
+    site = lambda i, j, s: 3*(n*i + j) + s
+    NN = []
+    for i in range(m):
+        for j in range(n):
+            NN += [[site(i, j, 0), site(i, j, 1)], [site(i, j, 0), site(i, j, 2)], [site(i, j, 1), site(i, j, 2)]]
+            if j + 1 < n:
+                NN.append([site(i, j, 1), site(i, j+1, 0)])
+            if i + 1 < m:
+                NN.append([site(i, j, 2), site(i+1, j, 0)])
+            if i + 1 < m and j - 1 >= 0:
+                NN.append([site(i, j, 2), site(i+1, j-1, 1)])
+    return 3 * m * n, {"NN": NN}
+
+LATTICE_DICT = {
+    "chain": lambda lat: get_chain_bonds(lat["N"], lat.get("periodic", False)),
+    "grid": lambda lat: get_grid_bonds(lat["m"], lat["n"], lat.get("periodic", False)),
+    "ladder": lambda lat: get_ladder_bonds(lat["L"]),
+    "triangular": lambda lat: get_triangular_bonds(lat["m"], lat["n"], lat.get("periodic", False)),
+    "kagome": lambda lat: get_kagome_bonds(lat["m"], lat["n"]),
+    "graph": lambda lat: (lat["n_qubits"], lat["bonds"]),
+}
+
+def dedup_bonds(bond_l):
+    """
+    Drop self loops and repeated bonds (periodic boundaries of short sides)
+    """
+    new_bond_l, seen = [], set()
+    for i, j in bond_l:
+        key = (min(i, j), max(i, j))
+        if i != j and key not in seen:
+            seen.add(key)
+            new_bond_l.append([i, j])
+    return new_bond_l
+
+def get_TFIM_spec(N, J, periodic = False):
+    return {"lattice": {"type": "chain", "N": N, "periodic": periodic},
+            "terms": [{"name": "X", "pauli": "X", "coupling": 1.0}, {"name": "J", "pauli": "ZZ", "bonds": "NN", "coupling": J}]}
+
+def get_J1_J2_spec(m, n, J1, J2, periodic = False):
+    return {"lattice": {"type": "grid", "m": m, "n": n, "periodic": periodic},
+            "terms": [{"name": "X", "pauli": "X", "coupling": 1.0}, {"name": "J1", "pauli": "ZZ", "bonds": "NN", "coupling": J1},
+                      {"name": "J2", "pauli": "ZZ", "bonds": "nNN", "coupling": J2}]}
+
+def compile_model(spec):
+    """
+    Compile a model spec once
+
+    Return:
+        model (dict):
+            n_qubits, term_names, couplings, orig_H (normalized couplings, the HR target vector)
+            terms: per term {"name", "pauli" ("X" or "Z" basis), "masks" (bit mask of every Pauli string)}
+            X_sites: qubits with an X term, i.e. the Hadamard bases needed for the cross terms
+            H_diag: diagonal of the Z terms, X_coef: coefficient of X_i of every qubit
+    """
+    lattice = spec["lattice"]
+    if lattice["type"] not in LATTICE_DICT:
+        raise ValueError(f"lattice type {lattice['type']} is not supported")
+    n_qubits, bond_dict = LATTICE_DICT[lattice["type"]](lattice)
+    bond_dict = {name: dedup_bonds(bond_l) for name, bond_l in bond_dict.items()}
+    model = {"n_qubits": n_qubits, "bond_dict": bond_dict, "terms": []}
+    X_coef = np.zeros(n_qubits)
+    for term in spec["terms"]:
+        if term["pauli"] in ("X", "Z"):
+            index_l = [[i] for i in term.get("sites", range(n_qubits))]
+        elif term["pauli"] == "ZZ":
+            index_l = term["edges"] if "edges" in term else bond_dict[term["bonds"]]
+        else:
+            raise ValueError(f"pauli {term['pauli']} is not supported, use X, Z or ZZ")
+        masks = np.array([sum(1 << int(q) for q in indices) for indices in index_l], dtype = np.int64)
+        basis = "X" if term["pauli"] == "X" else "Z"
+        model["terms"].append({"name": term["name"], "pauli": basis, "masks": masks, "coupling": float(term["coupling"])})
+        if basis == "X":
+            for (q,) in index_l:
+                X_coef[q] += term["coupling"]
+    model["term_names"] = [term["name"] for term in model["terms"]]
+    model["couplings"] = np.array([term["coupling"] for term in model["terms"]])
+    model["orig_H"] = model["couplings"] / np.linalg.norm(model["couplings"])
+    model["X_sites"] = [q for q in range(n_qubits) if X_coef[q] != 0 or
+                        any(((term["masks"] >> q) & 1).any() for term in model["terms"] if term["pauli"] == "X")]
+    model["X_coef"] = X_coef
+    basis = np.arange(2**n_qubits, dtype = np.int64)
+    model["H_diag"] = np.zeros(2**n_qubits)
+    for term in model["terms"]:
+        if term["pauli"] == "Z":
+            model["H_diag"] += term["coupling"] * get_term_values(basis, term["masks"], n_qubits)
+    return model
+
+def get_parity(states, mask, n_qubits):
+    parity = np.zeros(len(states), dtype = np.int64)
+    masked = states & mask
+    for q in range(n_qubits):
+        parity ^= (masked >> q) & 1
+    return parity
+
+def get_term_values(states, masks, n_qubits, skip_qubit = None):
+    """
+    Value of a sum of Pauli strings (bit masks) on measured basis states, each string is
+    (-1)^(parity of the masked bits). Strings acting on skip_qubit are left out.
+    """
+    values = np.zeros(len(states))
+    for mask in masks:
+        if skip_qubit is not None and (mask >> skip_qubit) & 1:
+            continue
+        values += 1 - 2*get_parity(states, mask, n_qubits)
+    return values
+
+def get_sparse_X_plus_diag(N_qubits, H_diag):
+    """
+    sum_i X_i + diag(H_diag) as a scipy CSR matrix. Row s has exactly N_qubits + 1 entries, the
+    diagonal and the X terms at columns s ^ (1 << i), so indptr and indices are written directly.
+    """
+    dim = 2**N_qubits
+    basis = np.arange(dim, dtype = np.int32)
+    indices = np.empty((dim, N_qubits + 1), dtype = np.int32)
+    data = np.ones((dim, N_qubits + 1))
+    indices[:, 0], data[:, 0] = basis, H_diag
+    for i in range(N_qubits):
+        indices[:, i+1] = basis ^ (1 << i)
+    indptr = np.arange(0, dim * (N_qubits + 1) + 1, N_qubits + 1)
+    return csr_matrix((data.reshape(-1), indices.reshape(-1), indptr), shape = (dim, dim))
+
+def get_sparse_Hamiltonian(model):
+    """
+    sum_i X_coef[i] X_i + diag(H_diag) in CSR format, built with bit operations
+    """
+    n_qubits = model["n_qubits"]
+    dim = 2**n_qubits
+    basis = np.arange(dim, dtype = np.int64)
+    X_qubits = [q for q in range(n_qubits) if model["X_coef"][q] != 0]
+    indices = np.empty((dim, len(X_qubits) + 1), dtype = np.int64)
+    data = np.empty((dim, len(X_qubits) + 1))
+    indices[:, 0], data[:, 0] = basis, model["H_diag"]
+    for k, q in enumerate(X_qubits):
+        indices[:, k+1], data[:, k+1] = basis ^ (1 << q), model["X_coef"][q]
+    indptr = np.arange(0, dim * (len(X_qubits) + 1) + 1, len(X_qubits) + 1)
+    return csr_matrix((data.reshape(-1), indices.reshape(-1), indptr), shape = (dim, dim))
+
+def get_ground_state(model):
+    val, vec = eigsh(get_sparse_Hamiltonian(model), k = 1, which = "SA")
+    return val[0], vec[:, 0]
+
+def counts_to_dist(counts):
+    """
+    qiskit counts (bitstring of qubit N-1 ... qubit 0 -> count) to (states, weights)
+    """
+    states = np.array([int(key.replace(" ", ""), 2) for key in counts], dtype = np.int64)
+    weights = np.array(list(counts.values()), dtype = float)
+    return states, weights / weights.sum()
+
+def resample_dist(counts, n_boot, rng):
+    """
+    Bootstrap replicates of measured counts: n_boot multinomial redraws of the measured number of
+    shots from the measured frequencies, in one draw
+
+    Return:
+        (states, weights): weights of shape (n_boot, number of distinct states)
+    """
+    states, weights = counts_to_dist(counts)
+    shots = int(sum(counts.values()))
+    return states, rng.multinomial(shots, weights, size = n_boot) / shots
+
+def get_basis_probs(wf, h_l, n_qubits):
+    """
+    Exact probabilities of wf after a Hadamard gate on every qubit in h_l (Walsh-Hadamard butterflies)
+    """
+    wf = np.array(wf, dtype = complex)
+    for q in h_l:
+        v = wf.reshape(2**(n_qubits-1-q), 2, 2**q)
+        a = v[:, 0, :].copy()
+        v[:, 0, :] += v[:, 1, :]
+        v[:, 1, :] *= -1
+        v[:, 1, :] += a
+    return np.abs(wf)**2 / 2**len(h_l)
+
+def get_state_distributions(model, wf):
+    """
+    Exact Z basis, X basis and per-qubit Hadamard basis distributions of wf, in the format of get_HR_cov
+    """
+    n_qubits = model["n_qubits"]
+    basis = np.arange(2**n_qubits, dtype = np.int64)
+    z_dist = (basis, get_basis_probs(wf, [], n_qubits))
+    x_dist = (basis, get_basis_probs(wf, list(range(n_qubits)), n_qubits))
+    cross_dist_dict = {h: (basis, get_basis_probs(wf, [h], n_qubits)) for h in model["X_sites"]}
+    return z_dist, x_dist, cross_dist_dict
+
+def get_energy(model, z_dist, x_dist):
+    """
+    Energy sum_a coupling_a <term_a> from the Z and X basis distributions
+    """
+    n_qubits = model["n_qubits"]
+    E = 0
+    for term in model["terms"]:
+        states, weights = x_dist if term["pauli"] == "X" else z_dist
+        E = E + term["coupling"] * (weights @ get_term_values(states, term["masks"], n_qubits))
+    return E
+
+def get_HR_cov(model, z_dist, x_dist, cross_dist_dict):
+    """
+    HR covariance matrix of the term groups of model
+
+    Args:
+        z_dist, x_dist: (states, weights) of the Z and X basis measurements, e.g. counts_to_dist(counts)
+        cross_dist_dict: {h: (states, weights)} of the basis with a Hadamard gate on qubit h only,
+            for h in model["X_sites"]. X_h anticommutes with the Z strings acting on h, so those
+            strings do not contribute to the symmetrized cross terms.
+
+    Return:
+        cov_mat (numpy array of shape (..., n_terms, n_terms), ... is the replicate axis of the weights)
+    """
+    n_qubits, terms = model["n_qubits"], model["terms"]
+    n_terms = len(terms)
+    value_l, exp_l = [], []
+    for term in terms:
+        states, weights = x_dist if term["pauli"] == "X" else z_dist
+        values = get_term_values(states, term["masks"], n_qubits)
+        value_l.append(values)
+        exp_l.append(weights @ values)
+    cov_mat = np.zeros(np.shape(exp_l[0]) + (n_terms, n_terms))
+    for a in range(n_terms):
+        for b in range(a, n_terms):
+            pauli_a, pauli_b = terms[a]["pauli"], terms[b]["pauli"]
+            if pauli_a == pauli_b:
+                weights = x_dist[1] if pauli_a == "X" else z_dist[1]
+                exp_ab = weights @ (value_l[a] * value_l[b])
+            else:
+                x_term, z_term = (terms[a], terms[b]) if pauli_a == "X" else (terms[b], terms[a])
+                exp_ab = 0
+                for mask in x_term["masks"]:
+                    h = int(mask).bit_length() - 1
+                    states, weights = cross_dist_dict[h]
+                    x_h = 1 - 2*((states >> h) & 1)
+                    exp_ab = exp_ab + weights @ (x_h * get_term_values(states, z_term["masks"], n_qubits, skip_qubit = h))
+            cov_mat[..., a, b] = exp_ab - exp_l[a] * exp_l[b]
+            cov_mat[..., b, a] = cov_mat[..., a, b]
+    return cov_mat
+
+def get_HR_distance(model, cov_mat, n_eig = 1):
+    """
+    Distance of the normalized couplings from the span of the n_eig lowest eigenvectors of cov_mat,
+    one distance per matrix of a stack of covariance matrices
+    """
+    val, vec = np.linalg.eigh(cov_mat)
+    order = np.argsort(val, axis = -1)[..., None, :n_eig]
+    vec = np.take_along_axis(vec, np.broadcast_to(order, vec.shape[:-1] + (n_eig,)), axis = -1)
+    orig_H = model["orig_H"]
+    proj = (vec @ (np.swapaxes(vec, -1, -2) @ orig_H)[..., None])[..., 0]
+    return np.linalg.norm(orig_H - proj, axis = -1)
@@ -0,0 +1,274 @@
+"""
+Parameter sweep orchestrator for the VQE -> HR -> fidelity -> noisy energy pipeline.
+
+A grid spec (json) is expanded into one task DAG per grid point. The tasks are the usual CLI scripts,
+run with at most --n_workers scripts at a time, and a task starts only after its dependencies finished.
+Tasks whose outputs already exist are skipped, so an interrupted sweep is resumed by running it again.
+
+TFIM (1-D-TFIM/periodic_TFIM_simulations):
+    get_gst_E.py (per J, in output_dir) -> VQE_run_periodic.py -> HR_run_periodic.py -> noisy_E_HR_fid.py (fidelity and noisy energy)
+J1_J2 (J1-J2/depolarization_shot_noise):
+    VQE_J1_J2.py -> HR_J1_J2.py (HR distance and fidelity) -> noisy_E_HR_fid.py (noisy energy)
+
+Example spec:
+{
+    "model": "TFIM",
+    "output_dir": "sweep_TFIM",
+    "grid": {"n_qbts": [6, 8], "J": [0.5, 1.0], "noise": [{"p1": 0.0, "p2": 0.0}, {"p1": 0.001, "p2": 0.01}],
+             "shots": [10000], "n_layers": [3], "trial": [0, 1, 2], "HR_shots": [1000]},
+    "VQE_args": {"max_iter": 500},
+    "HR_args": {"backend": "aer_simulator"},
+    "fid_args": {}
+}
+Every grid value is a list and the grid is their cartesian product. A list of dicts (e.g. "noise") is
+zipped, i.e. its keys vary together. Keys starting with HR_ are HR arguments, all other keys except
+trial are VQE arguments (J1_J2 takes m, n, J1, J2 instead of n_qbts, J). VQE_args, HR_args and
+fid_args are fixed arguments of the VQE, HR and noisy_E_HR_fid scripts. The outputs of a grid point
+are stored in output_dir/{VQE arguments}/{ansatz_type}_{n_layers}layers_tr{trial}, like ALA_3layers_tr5.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import subprocess
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+ROOT_DIR = os.path.dirname(os.path.realpath(__file__))
+MODEL_DIR_DICT = {"TFIM": os.path.join(ROOT_DIR, "1-D-TFIM", "periodic_TFIM_simulations"),
+                  "J1_J2": os.path.join(ROOT_DIR, "J1-J2", "depolarization_shot_noise")}
+
+def get_args(parser):
+    parser.add_argument('--spec', type = str, help = "json file of the sweep grid spec")
+    parser.add_argument('--n_workers', type = int, default = os.cpu_count(), help = "maximum number of scripts running at the same time (default: number of cores)")
+    parser.add_argument('--dry_run', action = 'store_true', help = "print the tasks and their status without running them")
+    args = parser.parse_args()
+    return args
+
+def expand_grid(grid):
+    """
+    Cartesian product of the grid. A value that is a dict is merged into the grid point.
+    """
+    key_l = list(grid.keys())
+    point_l = []
+    for value_t in itertools.product(*[grid[key] for key in key_l]):
+        point = {}
+        for key, value in zip(key_l, value_t):
+            if isinstance(value, dict):
+                point.update(value)
+            else:
+                point[key] = value
+        point_l.append(point)
+    return point_l
+
+def get_cli_args(arg_dict):
+    cli_args = []
+    for key, value in arg_dict.items():
+        if isinstance(value, bool):
+            if value:
+                cli_args.append(f"--{key}")
+        else:
+            cli_args += [f"--{key}", str(value)]
+    return cli_args
+
+def get_task(stage, script, cwd, arg_dict, outputs, deps, is_done = None):
+    return {"stage": stage, "cmd": [sys.executable, script] + get_cli_args(arg_dict), "cwd": cwd,
+            "outputs": outputs, "deps": deps, "is_done": is_done}
+
+def split_point(point):
+    VQE_arg_dict = {key: value for key, value in point.items() if not key.startswith("HR_") and key != "trial"}
+    HR_arg_dict = {key[len("HR_"):]: value for key, value in point.items() if key.startswith("HR_")}
+    # argparse stores p1, p2 as float, and scripts use str(p1) in file names
+    for key in ["p1", "p2"]:
+        VQE_arg_dict[key] = float(VQE_arg_dict.get(key, 0.0))
+    return VQE_arg_dict, HR_arg_dict
+
+def get_point_dir(output_dir, VQE_arg_dict, trial):
+    point_nm = "_".join(f"{key}_{value}" for key, value in VQE_arg_dict.items() if key != "n_layers")
+    run_nm = f"{VQE_arg_dict.get('ansatz_type', 'ALA')}_{VQE_arg_dict.get('n_layers', 3)}layers_tr{trial}"
+    return os.path.join(output_dir, point_nm, run_nm)
+
+def gst_E_is_done(path, n_qbts_l):
+    if not os.path.isfile(path):
+        return False
+    gst_E_dict = np.load(path, allow_pickle = True).item()
+    return all(n_qbts in gst_E_dict for n_qbts in n_qbts_l)
+
+def get_TFIM_tasks(spec, point_l, output_dir):
+    """
+    Task DAG of the periodic 1-D TFIM for all grid points
+    """
+    cwd = MODEL_DIR_DICT["TFIM"]
+    task_dict = {}
+    VQE_args = spec.get("VQE_args", {})
+    # one ground state energy dictionary per J in output_dir (VQE --gst_E_dir), unless VQE falls back to Lanczos
+    if VQE_args.get("optimizer") != "lbfgs-adjoint":
+        J_dict = {}
+        for point in point_l:
+            VQE_arg_dict, _ = split_point(point)
+            J_dict.setdefault(float(VQE_arg_dict.get("J", 0.5)), set()).add(int(VQE_arg_dict.get("n_qbts", 6)))
+        for J, n_qbts_set in J_dict.items():
+            gst_path = os.path.join(output_dir, f"gst_E_dict_J_{J}_periodic.npy")
+            task_dict[f"gst_E/J_{J}"] = get_task("gst_E", os.path.join(ROOT_DIR, "1-D-TFIM", "get_gst_E.py"), output_dir,
+                                                 {"J": J, "max_n_qbts": max(n_qbts_set), "periodic": True}, [gst_path], [],
+                                                 is_done = lambda gst_path = gst_path, n_qbts_set = n_qbts_set: gst_E_is_done(gst_path, n_qbts_set))
+
+    for point in point_l:
+        VQE_arg_dict, HR_arg_dict = split_point(point)
+        run_dir = get_point_dir(output_dir, VQE_arg_dict, point.get("trial", 0))
+        run_nm = os.path.relpath(run_dir, output_dir)
+        n_qbts, n_layers = VQE_arg_dict.get("n_qbts", 6), VQE_arg_dict.get("n_layers", 3)
+        p1, p2 = VQE_arg_dict["p1"], VQE_arg_dict["p2"]
+
+        VQE_deps = [f"gst_E/J_{float(VQE_arg_dict.get('J', 0.5))}"] if VQE_args.get("optimizer") != "lbfgs-adjoint" else []
+        task_dict[f"VQE/{run_nm}"] = get_task("VQE", "VQE_run_periodic.py", cwd, {**VQE_args, **VQE_arg_dict, "output_dir": run_dir,
+                                              "gst_E_dir": output_dir}, [os.path.join(run_dir, "VQE_hyperparam_dict.npy")], VQE_deps)
+
+        HR_arg_dict = {**spec.get("HR_args", {}), **HR_arg_dict, "input_dir": run_dir}
+        HR_shots, HR_backend = HR_arg_dict.get("shots", 1000), HR_arg_dict.get("backend", "aer_simulator")
+        if HR_backend == "aer_simulator":
+            HR_arg_dict["use_VQE_p1_p2"] = True
+        else:
+            p1, p2 = 0.0, 0.0
+        HR_nm = f"{run_nm}/{HR_shots}shots_{HR_backend}"
+        task_dict[f"HR/{HR_nm}"] = get_task("HR", "HR_run_periodic.py", cwd, HR_arg_dict,
+                                            [os.path.join(run_dir, f"{n_qbts}qubits_{n_layers}layers_shots_{HR_shots}_HR_dist.png")], [f"VQE/{run_nm}"])
+
+        fid_arg_dict = {**spec.get("fid_args", {}), "input_dir": run_dir, "p1": p1, "p2": p2}
+        fid_img_nm = f"layers_shots_{HR_shots}_shots_{HR_backend}_p1_{p1}_p2_{p2}_noisy_E_HR_fid.svg"
+        if fid_arg_dict.get("get_first_excited_state", False):
+            fid_img_nm = "_fst_excited_state_" + fid_img_nm
+        task_dict[f"noisy_E_fid/{HR_nm}"] = get_task("noisy_E_fid", "noisy_E_HR_fid.py", cwd, fid_arg_dict,
+                                                     [os.path.join(run_dir, f"{n_qbts}qubits_{n_layers}{fid_img_nm}")], [f"HR/{HR_nm}"])
+    return task_dict
+
+def get_J1_J2_tasks(spec, point_l, output_dir):
+    """
+    Task DAG of the 2-D J1-J2 model with depolarization and shot noise for all grid points
+    """
+    cwd = MODEL_DIR_DICT["J1_J2"]
+    task_dict = {}
+    VQE_args = spec.get("VQE_args", {})
+    for point in point_l:
+        VQE_arg_dict, HR_arg_dict = split_point(point)
+        run_dir = get_point_dir(output_dir, VQE_arg_dict, point.get("trial", 0))
+        run_nm = os.path.relpath(run_dir, output_dir)
+        n_qbts = VQE_arg_dict["m"] * VQE_arg_dict["n"]
+        n_layers, shots = VQE_arg_dict.get("n_layers", 3), VQE_arg_dict.get("shots", 10000)
+        p1, p2 = VQE_arg_dict["p1"], VQE_arg_dict["p2"]
+
+        task_dict[f"VQE/{run_nm}"] = get_task("VQE", "VQE_J1_J2.py", cwd, {**VQE_args, **VQE_arg_dict, "output_dir": run_dir},
+                                              [os.path.join(run_dir, f"{n_qbts}qubits_{n_layers}layers_shots_{shots}.png")], [])
+
+        HR_arg_dict = {**spec.get("HR_args", {}), **HR_arg_dict, "input_dir": run_dir}
+        HR_shots, HR_backend = HR_arg_dict.get("shots", 1000), HR_arg_dict.get("backend", "aer_simulator")
+        if HR_backend == "aer_simulator":
+            HR_arg_dict["use_VQE_p1_p2"] = True
+        else:
+            p1, p2 = 0.0, 0.0
+        HR_nm = f"{run_nm}/{HR_shots}shots_{HR_backend}"
+        task_dict[f"HR_fid/{HR_nm}"] = get_task("HR_fid", "HR_J1_J2.py", cwd, HR_arg_dict,
+                                                [os.path.join(run_dir, f"{n_qbts}qubits_{n_layers}layers_shots_{HR_shots}_p1_{p1}_p2_{p2}_HR_dist.png")],
+                                                [f"VQE/{run_nm}"])
+
+        noisy_E_arg_dict = {**spec.get("fid_args", {}), "input_dir": run_dir,
+                            "HR_hyperparam_dict_nm": f"{HR_shots}_shots_{HR_backend}_p1_{p1}_p2_{p2}.npy"}
+        task_dict[f"noisy_E/{HR_nm}"] = get_task("noisy_E", "noisy_E_HR_fid.py", cwd, noisy_E_arg_dict,
+                                                 [os.path.join(run_dir, f"{n_qbts}qubits_{n_layers}layers_shots_{HR_shots}_shots_{HR_backend}_p1_{p1}_p2_{p2}_noisy_HR_dist.svg")],
+                                                 [f"HR_fid/{HR_nm}"])
+    return task_dict
+
+def is_done(task):
+    if task["is_done"] is not None:
+        return task["is_done"]()
+    return all(os.path.exists(path) for path in task["outputs"])
+
+def run_task(task_nm, task, log_dir, env):
+    """
+    Run one task as a script process, stdout and stderr go to log_dir
+
+    Return:
+        task name, return code, runtime
+    """
+    log_path = os.path.join(log_dir, task_nm.replace("/", "__") + ".log")
+    start = time.time()
+    with open(log_path, "w") as fp:
+        fp.write(" ".join(task["cmd"]) + "\n")
+        fp.flush()
+        returncode = subprocess.run(task["cmd"], cwd = task["cwd"], stdout = fp, stderr = subprocess.STDOUT, env = env).returncode
+    return task_nm, returncode, time.time() - start
+
+def run_tasks(task_dict, n_workers, log_dir):
+    """
+    Run the task DAG. A task is submitted once all of its dependencies are done,
+    and is dropped if one of its dependencies failed.
+    """
+    status_dict = {task_nm: "done" if is_done(task) else "pending" for task_nm, task in task_dict.items()}
+    print(f"{sum(status == 'done' for status in status_dict.values())} of {len(task_dict)} tasks already done")
+    # split the cores between the running scripts so numpy and aer do not oversubscribe them
+    env = dict(os.environ)
+    env.setdefault("OMP_NUM_THREADS", str(max(1, os.cpu_count() // n_workers)))
+    env.setdefault("MPLBACKEND", "Agg")
+    running = {}
+    with ThreadPoolExecutor(max_workers = n_workers) as pool:
+        while True:
+            for task_nm, task in task_dict.items():
+                if status_dict[task_nm] != "pending":
+                    continue
+                dep_status_l = [status_dict[dep] for dep in task["deps"]]
+                if any(status in ["failed", "dropped"] for status in dep_status_l):
+                    status_dict[task_nm] = "dropped"
+                    print(f"dropped {task_nm}, a dependency failed")
+                elif all(status == "done" for status in dep_status_l):
+                    status_dict[task_nm] = "running"
+                    running[pool.submit(run_task, task_nm, task, log_dir, env)] = task_nm
+            if len(running) == 0:
+                break
+            finished, _ = wait(running, return_when = FIRST_COMPLETED)
+            for future in finished:
+                task_nm, returncode, runtime = future.result()
+                del running[future]
+                if returncode == 0 and is_done(task_dict[task_nm]):
+                    status_dict[task_nm] = "done"
+                    print(f"done {task_nm} ({runtime:.1f}s)")
+                else:
+                    status_dict[task_nm] = "failed"
+                    print(f"failed {task_nm} (return code {returncode}), see log in {log_dir}")
+    return status_dict
+
+def main(args):
+    with open(args.spec, "r") as fp:
+        spec = json.load(fp)
+    if spec["model"] not in MODEL_DIR_DICT:
+        raise ValueError(f"model must be one of {list(MODEL_DIR_DICT.keys())}")
+    output_dir = os.path.realpath(spec.get("output_dir", "."))
+    log_dir = os.path.join(output_dir, "logs")
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+
+    point_l = expand_grid(spec["grid"])
+    if spec["model"] == "TFIM":
+        task_dict = get_TFIM_tasks(spec, point_l, output_dir)
+    else:
+        task_dict = get_J1_J2_tasks(spec, point_l, output_dir)
+
+    if args.dry_run:
+        for task_nm, task in task_dict.items():
+            print("done   " if is_done(task) else "pending", task_nm, " ".join(task["cmd"][1:]))
+        return
+
+    start = time.time()
+    status_dict = run_tasks(task_dict, args.n_workers, log_dir)
+    status_l = list(status_dict.values())
+    print(f"sweep finished in {time.time() - start:.1f}s: {status_l.count('done')} done, "
+          f"{status_l.count('failed')} failed, {status_l.count('dropped')} dropped")
+    if status_l.count("done") != len(status_l):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Parameter sweep over VQE, HR, fidelity and noisy energy")
+    args = get_args(parser)
+    main(args)
@@ -0,0 +1,307 @@
+"""
+Warm worker daemon for VQE energy, HR point and fidelity tasks.
+
+Every script run pays the python, qiskit and Aer start-up and rebuilds its noise model, transpiled
+circuits, lattice and ground state. The worker is a long-lived process that keeps them in memory and
+runs small tasks sent by thin clients over a Unix socket:
+
+    python worker.py serve &
+    python worker.py ping
+    python worker.py stats
+    python worker.py shutdown
+
+From python, e.g. a sweep driver or an analysis script:
+
+    from worker import connect, call
+    conn = connect()
+    hyperparam_dict = np.load(os.path.join(run_dir, "VQE_hyperparam_dict.npy"), allow_pickle = True).item()
+    E_l = call(conn, "VQE_E", model = "TFIM", hyperparam_dict = hyperparam_dict, var_params_l = var_params_l)["E_l"]
+
+Tasks take model ("TFIM" for the periodic 1-D TFIM or "J1_J2") and the hyperparam_dict saved by the
+VQE and HR scripts, i.e. n_qbts, J (TFIM) or m, n, J1, J2, ansatz_type (J1_J2) and n_layers, shots, p1, p2:
+    VQE_E (var_params_l): energies, the Z and X bases of all parameter vectors are run as one Aer job
+    HR_point (var_params): HR distance from the Z, X and per-qubit Hadamard bases, run as one Aer job
+    fid (var_params_l): fidelity with the ground state, in the convention of the model's HR script
+        (statevector, or density matrix if p1 or p2 > 0)
+    ping, stats: liveness, and calls and time per task
+return_counts = True adds the measured counts to the VQE_E and HR_point results.
+
+Kept warm: Aer backends with their noise models (p1, p2, method), transpiled parameterized circuits
+(model, basis, backend), compiled models of model_spec.py and ground states (model parameters).
+Tasks run one at a time since Aer already uses all cores for one job, and the tasks of several
+connections queue. Start one worker per socket (--socket) to run tasks in parallel. The socket is
+only accessible by the user who started the worker.
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import traceback
+import numpy as np
+from multiprocessing.connection import Listener, Client
+from sweep import MODEL_DIR_DICT
+import model_spec
+
+sys.path.insert(0, MODEL_DIR_DICT["TFIM"])
+sys.path.insert(0, os.path.dirname(MODEL_DIR_DICT["J1_J2"]))
+
+DEFAULT_ADDRESS = os.path.join(tempfile.gettempdir(), f"HR_worker_{os.getuid()}.sock")
+#Aer backends by (p1, p2, method)
+backend_cache = {}
+#transpiled parameterized circuits by (model key, n_params, basis, backend key)
+circ_template_cache = {}
+#compiled model_spec models and ground states by model key
+model_cache = {}
+gst_cache = {}
+#calls and time per task
+stats_dict = {}
+task_lock = threading.Lock()
+stop_event = threading.Event()
+
+def get_args(parser):
+    parser.add_argument('command', type = str, choices = ["serve", "ping", "stats", "shutdown"], help = "start the worker, or send it a command")
+    parser.add_argument('--socket', type = str, default = DEFAULT_ADDRESS, help = f"Unix socket of the worker (default: {DEFAULT_ADDRESS})")
+    args = parser.parse_args()
+    return args
+
+def get_model_key(model, hyperparam_dict):
+    if model == "TFIM":
+        return (model, hyperparam_dict["n_qbts"], float(hyperparam_dict["J"]), hyperparam_dict["n_layers"])
+    elif model == "J1_J2":
+        return (model, hyperparam_dict["m"], hyperparam_dict["n"], float(hyperparam_dict["J1"]), float(hyperparam_dict["J2"]),
+                hyperparam_dict["n_layers"], hyperparam_dict.get("ansatz_type", "ALA"))
+    raise ValueError(f"model must be one of {list(MODEL_DIR_DICT.keys())}")
+
+def get_n_qbts(model, hyperparam_dict):
+    return hyperparam_dict["n_qbts"] if model == "TFIM" else hyperparam_dict["m"] * hyperparam_dict["n"]
+
+def get_compiled_model(model, hyperparam_dict):
+    key = get_model_key(model, hyperparam_dict)
+    if key not in model_cache:
+        if model == "TFIM":
+            spec = model_spec.get_TFIM_spec(hyperparam_dict["n_qbts"], hyperparam_dict["J"], periodic = True)
+        else:
+            spec = model_spec.get_J1_J2_spec(hyperparam_dict["m"], hyperparam_dict["n"], hyperparam_dict["J1"], hyperparam_dict["J2"])
+        model_cache[key] = model_spec.compile_model(spec)
+    return model_cache[key]
+
+def get_gst(model, hyperparam_dict):
+    """
+    Ground state of the model from its symmetry sectors, like the VQE and HR scripts
+    """
+    key = get_model_key(model, hyperparam_dict)
+    if key not in gst_cache:
+        if model == "TFIM":
+            from symmetry import get_sector_gst
+            _, gst_cache[key] = get_sector_gst(hyperparam_dict["n_qbts"], hyperparam_dict["J"])
+        else:
+            from depolarization_shot_noise.symmetry import get_sector_gst
+            _, gst_cache[key] = get_sector_gst(hyperparam_dict["m"], hyperparam_dict["n"], hyperparam_dict["J1"], hyperparam_dict["J2"])
+    return gst_cache[key]
+
+def get_backend(p1, p2, method = "automatic"):
+    """
+    AerSimulator with the depolarizing noise model of the scripts
+    """
+    key = (float(p1), float(p2), method)
+    if key not in backend_cache:
+        from qiskit_aer import AerSimulator
+        if p1 == 0 and p2 == 0:
+            backend_cache[key] = AerSimulator(method = method)
+        else:
+            from qiskit_aer.noise import NoiseModel, depolarizing_error
+            noise_model = NoiseModel()
+            noise_model.add_all_qubit_quantum_error(depolarizing_error(p1, 1), ['h','ry'])
+            noise_model.add_all_qubit_quantum_error(depolarizing_error(p2, 2), ['cx'])
+            backend_cache[key] = AerSimulator(method = method, noise_model = noise_model)
+    return backend_cache[key]
+
+def get_circuit(model, hyperparam_dict, var_params, h_l):
+    if model == "TFIM":
+        from HR_run_periodic import Q_Circuit
+        return Q_Circuit(hyperparam_dict["n_qbts"], var_params, h_l, hyperparam_dict["n_layers"])
+    from depolarization_shot_noise.Circuit import Q_Circuit
+    return Q_Circuit(hyperparam_dict["m"], hyperparam_dict["n"], var_params, h_l, hyperparam_dict["n_layers"], hyperparam_dict.get("ansatz_type", "ALA"))
+
+def get_circ_template(model, hyperparam_dict, n_params, h_l, backend_key):
+    key = (get_model_key(model, hyperparam_dict), n_params, tuple(h_l), backend_key)
+    if key not in circ_template_cache:
+        from qiskit import transpile
+        from qiskit.circuit import ParameterVector
+        n_qbts = get_n_qbts(model, hyperparam_dict)
+        theta = ParameterVector("theta", n_params)
+        circ = get_circuit(model, hyperparam_dict, theta, h_l)
+        circ.measure(list(range(n_qbts)), list(range(n_qbts)))
+        circ_template_cache[key] = (theta, transpile(circ, get_backend(*backend_key)))
+    return circ_template_cache[key]
+
+def get_measurement_batch(model, hyperparam_dict, var_params_l, h_l_l):
+    """
+    Measure every parameter vector in var_params_l in every basis of h_l_l with a single job
+
+    Return:
+        measurement_l (list of the counts of every basis, per parameter vector)
+    """
+    backend_key = (float(hyperparam_dict["p1"]), float(hyperparam_dict["p2"]), "automatic")
+    circ_l = []
+    for var_params in var_params_l:
+        for h_l in h_l_l:
+            theta, circ = get_circ_template(model, hyperparam_dict, len(var_params), h_l, backend_key)
+            circ_l.append(circ.assign_parameters({theta: var_params}))
+    result = get_backend(*backend_key).run(circ_l, shots = hyperparam_dict["shots"]).result()
+    counts_l = [dict(result.get_counts(i)) for i in range(len(circ_l))]
+    return [counts_l[i:i+len(h_l_l)] for i in range(0, len(counts_l), len(h_l_l))]
+
+def get_energy(model, hyperparam_dict, z_m, x_m):
+    """
+    Energy from Z and X basis counts with the estimators of the VQE scripts
+    """
+    if model == "TFIM":
+        from utils_periodic import get_exp_X, get_exp_ZZ
+        return get_exp_X(x_m, 1) + hyperparam_dict["J"] * get_exp_ZZ(z_m, 1)
+    from depolarization_shot_noise.utils import expectation_X, get_NN_coupling, get_nNN_coupling
+    m, n = hyperparam_dict["m"], hyperparam_dict["n"]
+    return expectation_X(x_m, 1) + hyperparam_dict["J1"] * get_NN_coupling(z_m, m, n, 1) + hyperparam_dict["J2"] * get_nNN_coupling(z_m, m, n, 1)
+
+def run_VQE_E(model, hyperparam_dict, var_params_l, return_counts = False):
+    n_qbts = get_n_qbts(model, hyperparam_dict)
+    measurement_l = get_measurement_batch(model, hyperparam_dict, var_params_l, [[], list(range(n_qbts))])
+    result = {"E_l": [get_energy(model, hyperparam_dict, z_m, x_m) for z_m, x_m in measurement_l]}
+    if return_counts:
+        result["counts_l"] = measurement_l
+    return result
+
+def run_HR_point(model, hyperparam_dict, var_params, return_counts = False):
+    compiled_model = get_compiled_model(model, hyperparam_dict)
+    n_qbts = compiled_model["n_qubits"]
+    X_sites = compiled_model["X_sites"]
+    measurement = get_measurement_batch(model, hyperparam_dict, [var_params], [[], list(range(n_qbts))] + [[h] for h in X_sites])[0]
+    z_m, x_m = measurement[0], measurement[1]
+    cross_dist_dict = {h: model_spec.counts_to_dist(cross_m) for h, cross_m in zip(X_sites, measurement[2:])}
+    cov_mat = model_spec.get_HR_cov(compiled_model, model_spec.counts_to_dist(z_m), model_spec.counts_to_dist(x_m), cross_dist_dict)
+    result = {"HR_dist": model_spec.get_HR_distance(compiled_model, cov_mat), "E": get_energy(model, hyperparam_dict, z_m, x_m)}
+    if return_counts:
+        result["counts"] = {"z": z_m, "x": x_m, "cross": dict(zip(X_sites, measurement[2:]))}
+    return result
+
+def run_fid(model, hyperparam_dict, var_params_l):
+    if model == "TFIM":
+        from utils_periodic import get_fidelity
+    else:
+        from depolarization_shot_noise.utils import get_fidelity
+    gst = get_gst(model, hyperparam_dict)
+    noiseless = hyperparam_dict["p1"] == 0 and hyperparam_dict["p2"] == 0
+    backend = get_backend(hyperparam_dict["p1"], hyperparam_dict["p2"], "automatic" if noiseless else "density_matrix")
+    circ_l = []
+    for var_params in var_params_l:
+        circ = get_circuit(model, hyperparam_dict, var_params, [])
+        if noiseless:
+            circ.save_statevector()
+        else:
+            circ.save_density_matrix()
+        circ_l.append(circ)
+    result = backend.run(circ_l).result()
+    fid_l = []
+    for i, circ in enumerate(circ_l):
+        if noiseless:
+            overlap = np.vdot(np.array(result.get_statevector(circ)), gst)
+            fid_l.append(float(np.square(np.absolute(overlap)) if model == "TFIM" else overlap.real))
+        else:
+            fid_l.append(float(get_fidelity(gst, result.data(i)['density_matrix'])))
+    return {"fid_l": fid_l}
+
+def run_ping():
+    return {"pid": os.getpid(), "n_backends": len(backend_cache), "n_circ_templates": len(circ_template_cache), "n_models": len(model_cache)}
+
+def run_stats():
+    return {"stats": stats_dict, **run_ping()}
+
+TASK_DICT = {"VQE_E": run_VQE_E, "HR_point": run_HR_point, "fid": run_fid, "ping": run_ping, "stats": run_stats}
+
+def run_task(request):
+    """
+    Run one request {"task": name, **task_args}
+
+    Return:
+        {"ok": True, "result": result} or {"ok": False, "error": traceback}
+    """
+    task = request.pop("task", None)
+    if task not in TASK_DICT:
+        return {"ok": False, "error": f"unknown task {task}, tasks: {list(TASK_DICT.keys())}"}
+    if "model" in request and request["model"] not in MODEL_DIR_DICT:
+        return {"ok": False, "error": f"model must be one of {list(MODEL_DIR_DICT.keys())}"}
+    start = time.perf_counter()
+    try:
+        with task_lock:
+            result = TASK_DICT[task](**request)
+    except Exception:
+        return {"ok": False, "error": traceback.format_exc()}
+    entry = stats_dict.setdefault(task, {"calls": 0, "total_s": 0.0})
+    entry["calls"] += 1
+    entry["total_s"] += time.perf_counter() - start
+    return {"ok": True, "result": result}
+
+def handle_connection(conn, address):
+    with conn:
+        while True:
+            try:
+                request = conn.recv()
+            except EOFError:
+                return
+            if request.get("task") == "shutdown":
+                conn.send({"ok": True, "result": None})
+                stop_event.set()
+                #wake up the accept of the main thread
+                Client(address, family = "AF_UNIX").close()
+                return
+            conn.send(run_task(request))
+
+def serve(address):
+    if os.path.exists(address):
+        try:
+            Client(address, family = "AF_UNIX").close()
+        except OSError:
+            #stale socket of a worker that did not exit cleanly
+            os.remove(address)
+        else:
+            raise ValueError(f"a worker is already listening on {address}")
+    #the socket is created readable and writable by the user only
+    umask = os.umask(0o077)
+    try:
+        listener = Listener(address, family = "AF_UNIX")
+    finally:
+        os.umask(umask)
+    print(f"worker {os.getpid()} listening on {address}", flush = True)
+    with listener:
+        while not stop_event.is_set():
+            conn = listener.accept()
+            threading.Thread(target = handle_connection, args = (conn, address), daemon = True).start()
+    print(f"worker {os.getpid()} stopped", flush = True)
+
+def connect(address = DEFAULT_ADDRESS):
+    return Client(address, family = "AF_UNIX")
+
+def call(conn, task, **task_args):
+    """
+    Run task on the worker of conn and return its result, raises RuntimeError if the task failed
+    """
+    conn.send({"task": task, **task_args})
+    response = conn.recv()
+    if not response["ok"]:
+        raise RuntimeError(f"worker task {task} failed:\n{response['error']}")
+    return response["result"]
+
+def main(args):
+    if args.command == "serve":
+        serve(args.socket)
+        return
+    with connect(args.socket) as conn:
+        print(call(conn, args.command))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Warm worker for VQE energy, HR point and fidelity tasks")
+    args = get_args(parser)
+    main(args)